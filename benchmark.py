@@ -0,0 +1,333 @@
+"""
+Тесты производительности подсчета частот, построения дерева, архивирования и извлечения.
+Синтетические наборы данных генерируются локально с фиксированным seed, поэтому запуски воспроизводимы.
+Каждое измерение выполняется в отдельном процессе, чтобы пиковый объем памяти (peak RSS) относился
+только к нему.
+
+Запуск:
+    python benchmark.py [--size МБ] [--repeat N] [--output results.json]
+                        [--baseline baseline.json] [--threshold 0.1] [--save-baseline baseline.json]
+Код возврата 1, если по сравнению с baseline найдены регрессии.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+import huffman_coding as hf
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Размер одного набора данных по умолчанию, Мб
+SIZE = 4
+
+# Количество и размер маленьких файлов в наборе "small"
+SMALL_COUNT = 256
+SMALL_SIZE = 2 ** 14
+
+REPEAT = 3
+THRESHOLD = 0.1
+SEED = 2024
+
+
+def genUniform(size: int, rnd: random.Random) -> bytes:
+    """
+    Равномерно распределенные случайные байты (несжимаемые данные).
+    """
+    return rnd.randbytes(size)
+
+
+def genText(size: int, rnd: random.Random) -> bytes:
+    """
+    Текст из слов, частоты которых распределены по закону Ципфа.
+    """
+    letters = "etaoinshrdlcumwfgypbvkjxqz"
+    words = ["".join(rnd.choices(letters, weights=range(26, 0, -1), k=rnd.randint(1, 10))) for _ in range(2000)]
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    parts = []
+    length = 0
+    while length < size:
+        line = " ".join(rnd.choices(words, weights=weights, k=12)).capitalize() + ".\n"
+        parts.append(line)
+        length += len(line)
+    return "".join(parts).encode("utf-8")[:size]
+
+
+def genRuns(size: int, rnd: random.Random) -> bytes:
+    """
+    Серии одинаковых байтов случайной длины.
+    """
+    parts = []
+    length = 0
+    while length < size:
+        run = bytes([rnd.choice(b"\x00\x20\xff" + bytes(range(48, 58)))]) * int(rnd.expovariate(1 / 200) + 1)
+        parts.append(run)
+        length += len(run)
+    return b"".join(parts)[:size]
+
+
+def genBinary(size: int, rnd: random.Random) -> bytes:
+    """
+    Данные, похожие на исполняемый файл: записи из небольших целых чисел, области нулей,
+    строки и случайные (сжатые) участки.
+    """
+    parts = []
+    length = 0
+    while length < size:
+        kind = rnd.random()
+        if kind < 0.5:
+            part = b"".join(struct.pack("<IHhB", rnd.randrange(2 ** 16), rnd.randrange(256), rnd.randint(-100, 100),
+                                        rnd.randrange(8)) for _ in range(rnd.randint(16, 256)))
+        elif kind < 0.7:
+            part = bytes(rnd.randint(16, 4096))
+        elif kind < 0.85:
+            part = ("%s_%d\x00" % (rnd.choice(("init", "read", "write", "close", "malloc")),
+                                   rnd.randrange(1000))).encode("ascii") * rnd.randint(1, 8)
+        else:
+            part = rnd.randbytes(rnd.randint(64, 2048))
+        parts.append(part)
+        length += len(part)
+    return b"".join(parts)[:size]
+
+
+# Наборы данных из одного файла: {название: генератор}
+CORPORA = {
+    "uniform": genUniform,
+    "text": genText,
+    "runs": genRuns,
+    "binary": genBinary,
+}
+
+
+def makeCorpora(workDir: str, size: int, seed=SEED) -> dict:
+    """
+    Создает файлы наборов данных в workDir.
+    :return: {название: [путь к файлу, ...], ...}; набор "small" состоит из SMALL_COUNT файлов
+    """
+    corpora = {}
+    for name, generator in CORPORA.items():
+        filename = os.path.join(workDir, name + ".bin")
+        with open(filename, "wb") as file:
+            file.write(generator(size, random.Random(f"{seed}-{name}")))
+        corpora[name] = [filename]
+
+    rnd = random.Random(f"{seed}-small")
+    smallDir = os.path.join(workDir, "small")
+    os.makedirs(smallDir)
+    corpora["small"] = []
+    for i in range(SMALL_COUNT):
+        generator = CORPORA[rnd.choice(("text", "binary", "runs"))]
+        filename = os.path.join(smallDir, f"file{i}.bin")
+        with open(filename, "wb") as file:
+            file.write(generator(rnd.randint(SMALL_SIZE // 2, SMALL_SIZE), rnd))
+        corpora["small"].append(filename)
+    return corpora
+
+
+def getPeakRss() -> int:
+    """
+    :return: пиковый объем памяти текущего процесса в байтах или None, если модуль resource недоступен
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В Linux ru_maxrss в килобайтах, в macOS - в байтах
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def opFreq(filenames: list, outDir: str) -> tuple:
+    start = time.perf_counter()
+    for filename in filenames:
+        hf.Freq(filename=filename)
+    return time.perf_counter() - start, None
+
+
+def opTree(filenames: list, outDir: str) -> tuple:
+    freqs = [hf.Freq(filename=filename) for filename in filenames]
+    start = time.perf_counter()
+    for freq in freqs:
+        hf.HuffTree(filename=None, from_="freq", freq=freq).getCodes()
+    return time.perf_counter() - start, None
+
+
+def opToArchive(filenames: list, outDir: str) -> tuple:
+    hf.CACHE.clear()
+    pairs = [(filename, os.path.join(outDir, os.path.basename(filename))) for filename in filenames]
+    start = time.perf_counter()
+    if len(pairs) == 1:
+        hf.toArchive(*pairs[0])
+    else:
+        hf.toArchiveMany(pairs)
+    seconds = time.perf_counter() - start
+    newSize = sum(os.path.getsize(newName + "." + hf.EXTENSION) for _, newName in pairs)
+    return seconds, newSize / sum(os.path.getsize(filename) for filename in filenames)
+
+
+def opFromArchive(filenames: list, outDir: str) -> tuple:
+    pairs = [(os.path.join(outDir, os.path.basename(filename)) + "." + hf.EXTENSION,
+              os.path.join(outDir, "restored_" + os.path.splitext(os.path.basename(filename))[0]))
+             for filename in filenames]
+    start = time.perf_counter()
+    if len(pairs) == 1:
+        hf.fromArchive(*pairs[0])
+    else:
+        hf.fromArchiveMany(pairs)
+    return time.perf_counter() - start, None
+
+
+# Измеряемые операции: {название: функция(filenames, outDir) -> (seconds, ratio)}
+# fromArchive использует архивы, созданные toArchive, поэтому идет после нее
+OPERATIONS = {
+    "freq": opFreq,
+    "tree": opTree,
+    "toArchive": opToArchive,
+    "fromArchive": opFromArchive,
+}
+
+
+def measure(resultQueue, operation: str, filenames: list, outDir: str) -> None:
+    """
+    Выполняет операцию в процессе-обработчике и отправляет (seconds, peakRss, ratio) в resultQueue.
+    """
+    try:
+        seconds, ratio = OPERATIONS[operation](filenames, outDir)
+        resultQueue.put((seconds, getPeakRss(), ratio))
+    except Exception as e:
+        resultQueue.put(e)
+
+
+def runOne(operation: str, filenames: list, outDir: str) -> tuple:
+    """
+    Выполняет операцию в отдельном процессе.
+    :return: (seconds, peakRss, ratio)
+    """
+    resultQueue = mp.Queue()
+    process = mp.Process(target=measure, args=(resultQueue, operation, filenames, outDir))
+    process.start()
+    result = resultQueue.get()
+    process.join()
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def runBenchmarks(size=SIZE, repeat=REPEAT, seed=SEED, log=print) -> dict:
+    """
+    Создает наборы данных во временной папке и измеряет каждую операцию на каждом наборе.
+    Для времени берется лучший из repeat запусков, для памяти - наибольший.
+    :param size: размер каждого набора данных, Мб
+    :param log: вызывается со строкой после каждого измерения (None - ничего не выводить)
+    :return: {"info": {...}, "results": [{"corpus", "operation", "bytes", "seconds", "mbPerSec",
+             "peakRss", "ratio"}, ...]}
+    """
+    results = []
+    workDir = tempfile.mkdtemp(prefix="huff_bench_")
+    try:
+        corpora = makeCorpora(workDir, size * 2 ** 20, seed)
+        for corpus, filenames in corpora.items():
+            outDir = os.path.join(workDir, "out_" + corpus)
+            os.makedirs(outDir)
+            totalSize = sum(os.path.getsize(filename) for filename in filenames)
+            for operation in OPERATIONS:
+                runs = [runOne(operation, filenames, outDir) for _ in range(repeat)]
+                seconds = min(run[0] for run in runs)
+                peaks = [run[1] for run in runs if run[1] is not None]
+                result = {
+                    "corpus": corpus,
+                    "operation": operation,
+                    "bytes": totalSize,
+                    "seconds": round(seconds, 6),
+                    "mbPerSec": round(totalSize / 2 ** 20 / seconds, 3) if seconds else None,
+                    "peakRss": max(peaks) if peaks else None,
+                    "ratio": None if runs[0][2] is None else round(runs[0][2], 4),
+                }
+                results.append(result)
+                if log:
+                    log(formatResult(result))
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": hf.np is not None,
+        "size": size,
+        "repeat": repeat,
+        "seed": seed,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    return {"info": info, "results": results}
+
+
+def formatResult(result: dict) -> str:
+    peakRss = "-" if result["peakRss"] is None else f"{result['peakRss'] / 2 ** 20:.1f} Мб"
+    ratio = "-" if result["ratio"] is None else f"{result['ratio']:.3f}"
+    return f"{result['corpus']:<8} {result['operation']:<12} {result['mbPerSec']:>10.2f} Мб/с " \
+           f"{peakRss:>12} {ratio:>8}"
+
+
+def compareResults(results: dict, baseline: dict, threshold=THRESHOLD) -> list:
+    """
+    Сравнивает результаты с сохраненными ранее.
+    Регрессия - скорость меньше, чем в baseline, или пиковая память больше более чем на threshold (доля),
+    или сжатие хуже.
+    :return: [(corpus, operation, "описание"), ...]
+    """
+    base = {(result["corpus"], result["operation"]): result for result in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        key = (result["corpus"], result["operation"])
+        if key not in base:
+            continue
+        old = base[key]
+        if old["mbPerSec"] and result["mbPerSec"] < old["mbPerSec"] * (1 - threshold):
+            regressions.append(key + (f"скорость {old['mbPerSec']} -> {result['mbPerSec']} Мб/с",))
+        if old["peakRss"] and result["peakRss"] and result["peakRss"] > old["peakRss"] * (1 + threshold):
+            regressions.append(key + (f"память {old['peakRss']} -> {result['peakRss']} байт",))
+        if old["ratio"] is not None and result["ratio"] is not None and result["ratio"] > old["ratio"] + 1e-4:
+            regressions.append(key + (f"сжатие {old['ratio']} -> {result['ratio']}",))
+    return regressions
+
+
+def main(args=None) -> int:
+    parser = argparse.ArgumentParser(description="Тесты производительности архиватора")
+    parser.add_argument("--size", type=int, default=SIZE, help="размер каждого набора данных, Мб")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="количество запусков каждого измерения")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--output", help="файл для результатов в формате JSON")
+    parser.add_argument("--baseline", help="результаты для сравнения (JSON)")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="допустимое ухудшение (доля)")
+    parser.add_argument("--save-baseline", help="сохранить результаты как новый baseline")
+    args = parser.parse_args(args)
+
+    print(f"{'набор':<8} {'операция':<12} {'скорость':>15} {'память':>12} {'сжатие':>8}")
+    results = runBenchmarks(size=args.size, repeat=args.repeat, seed=args.seed)
+    for filename in (args.output, args.save_baseline):
+        if filename:
+            with open(filename, "w", encoding="utf-8") as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compareResults(results, baseline, args.threshold)
+        for corpus, operation, message in regressions:
+            print(f"РЕГРЕССИЯ: {corpus} {operation}: {message}")
+        if regressions:
+            return 1
+        print("Регрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
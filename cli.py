@@ -0,0 +1,309 @@
+"""
+Консольный запуск архиватора без графического интерфейса (не импортирует tkinter).
+
+    python cli.py compress ФАЙЛЫ... [-o ПАПКА] [--pack ИМЯ] [--workers N] [--canonical] [--block-size N]
+                                   [--block-workers N] [--max-code-length N] [--context | --rle] [--dict СЛОВАРЬ]
+                                   [--no-store-raw] [--pipeline [--queue-depth N]] [--json]
+    python cli.py extract АРХИВЫ... [-o ПАПКА] [--workers N] [--block-workers N] [--dict СЛОВАРЬ]
+                                   [--pipeline [--queue-depth N]] [--json]
+    python cli.py test АРХИВЫ... [--workers N] [--dict СЛОВАРЬ] [--json]
+    python cli.py dict ФАЙЛЫ... -o СЛОВАРЬ [--sample-size N] [--json]
+    python cli.py preview ФАЙЛЫ... [--estimate | --context] [--max-code-length N] [--json]
+    python cli.py list АРХИВ [--json]
+
+ФАЙЛЫ - имена файлов, шаблоны (*.txt, dir/**/*.log) или @список.txt (имена файлов по одному в строке).
+Код возврата 1, если некоторые файлы не удалось обработать или команду не удалось выполнить
+(например, list для файла, который не является архивом-контейнером, или --dict с отсутствующим словарем).
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+
+import huffman_coding as hf
+
+
+def expandFilenames(patterns: list) -> list:
+    """
+    :param patterns: имена файлов, шаблоны glob и "@файл со списком имен"
+    :return: имена существующих файлов без повторов, в порядке patterns
+    """
+    filenames = []
+    for pattern in patterns:
+        if pattern.startswith("@"):
+            with open(pattern[1:], "r", encoding="utf-8") as file:
+                names = [line.strip() for line in file if line.strip()]
+            filenames += expandFilenames(names)
+        elif glob.has_magic(pattern):
+            filenames += sorted(name for name in glob.glob(pattern, recursive=True) if os.path.isfile(name))
+        else:
+            filenames.append(pattern)
+    return list(dict.fromkeys(filenames))
+
+
+def makeNewNames(filenames: list, outDir: str) -> list:
+    """
+    :return: [(oldName, outDir/oldNameWithoutExt), ...], одинаковые имена дополняются номером, как в gui
+    """
+    pairs = []
+    names = set()
+    for oldName in filenames:
+        stem = os.path.join(outDir or os.path.dirname(oldName), os.path.splitext(os.path.basename(oldName))[0])
+        newName = stem
+        counter = 1
+        while newName in names:
+            newName = f"{stem} ({counter})"
+            counter += 1
+        names.add(newName)
+        pairs.append((oldName, newName))
+    return pairs
+
+
+def makeProgress(quiet: bool) -> hf.Progress:
+    """
+    :return: hf.Progress, который выводит прогресс в stderr (если stderr - терминал и не задан quiet)
+    """
+    if quiet or not sys.stderr.isatty():
+        return hf.Progress()
+
+    def printProgress(progress: hf.Progress) -> None:
+        sys.stderr.write(f"\r{progress.getPercent():3d}%  {progress.getThroughput() / 2 ** 20:.1f} Мб/с ")
+        sys.stderr.flush()
+
+    return hf.Progress(funcUpdate=printProgress, interval=0.5)
+
+
+def checkDictionary(args) -> None:
+    """
+    Считывает словарь --dict до начала работы: отсутствующий или поврежденный словарь - ошибка всей команды,
+    а не каждого файла.
+    """
+    if args.dict:
+        hf.getDictionary(args.dict)
+
+
+def cmndCompress(args, progress: hf.Progress) -> tuple:
+    checkDictionary(args)
+    filenames = expandFilenames(args.files)
+    if args.outdir:
+        os.makedirs(args.outdir, exist_ok=True)
+    if args.pack:
+        errLst = hf.toContainer(filenames, os.path.splitext(args.pack)[0], canonical=args.canonical,
+                                blockSize=args.block_size, workers=args.block_workers,
+                                maxCodeLength=args.max_code_length, progress=progress, storeRaw=args.store_raw,
+                                context=args.context, rle=args.rle, dictionary=args.dict)
+        newName = os.path.splitext(args.pack)[0] + "." + hf.CONTAINER_EXTENSION
+        files = [{"file": name, "oldSize": oldSize, "newSize": length}
+                 for name, oldSize, start, length in hf.listContainer(newName)]
+        return {"archive": newName, "files": files, "failed": errLst}, errLst
+
+    pairs = makeNewNames(filenames, args.outdir)
+    errLst = hf.toArchiveMany(pairs, canonical=args.canonical, workers=args.workers, blockSize=args.block_size,
+                              maxCodeLength=args.max_code_length, progress=progress, storeRaw=args.store_raw,
+                              context=args.context, rle=args.rle, dictionary=args.dict, pipeline=args.pipeline,
+                              readDepth=args.queue_depth, writeDepth=args.queue_depth, blockWorkers=args.block_workers)
+    files = []
+    for oldName, newName in pairs:
+        if oldName in errLst:
+            continue
+        oldSize = os.path.getsize(oldName)
+        newSize = os.path.getsize(newName + "." + hf.EXTENSION)
+        files.append({"file": oldName, "archive": newName + "." + hf.EXTENSION, "oldSize": oldSize,
+                      "newSize": newSize, "compression": hf.getCompress(oldSize, newSize)})
+    return {"files": files, "failed": errLst}, errLst
+
+
+def extractedName(oldName: str, newName: str) -> str:
+    """
+    :return: путь, по которому hf.fromArchive извлекает архив oldName: newName с расширением исходного файла
+             из заголовка архива (для архива-контейнера - папка newName)
+    """
+    if hf.isContainer(oldName):
+        return newName
+    with open(oldName, "rb") as file:
+        return newName + "." + hf.ArchiveHeader(file).ext
+
+
+def cmndExtract(args, progress: hf.Progress) -> tuple:
+    checkDictionary(args)
+    filenames = expandFilenames(args.files)
+    if args.outdir:
+        os.makedirs(args.outdir, exist_ok=True)
+    pairs = makeNewNames(filenames, args.outdir)
+    errLst = hf.fromArchiveMany(pairs, workers=args.workers, progress=progress, dictionary=args.dict,
+                                pipeline=args.pipeline, readDepth=args.queue_depth, writeDepth=args.queue_depth,
+                                blockWorkers=args.block_workers)
+    files = [{"archive": oldName, "file": extractedName(oldName, newName)}
+             for oldName, newName in pairs if oldName not in errLst]
+    return {"files": files, "failed": errLst}, errLst
+
+
+def cmndTest(args, progress: hf.Progress) -> tuple:
+    checkDictionary(args)
+    files = []
+    errLst = []
+    for oldName in expandFilenames(args.files):
+        try:
+            errors = [{"block": block, "error": message}
+                      for block, message in hf.testArchive(oldName, workers=args.workers, progress=progress,
+                                                           dictionary=args.dict)]
+        except Exception as error:
+            errors = [{"block": None, "error": str(error)}]
+        files.append({"archive": oldName, "ok": not errors, "errors": errors})
+        if errors:
+            errLst.append(oldName)
+    return {"files": files, "failed": errLst}, errLst
+
+
+def cmndDict(args, progress: hf.Progress) -> tuple:
+    filenames = expandFilenames(args.files)
+    newName = hf.trainDictionary(filenames, os.path.splitext(args.outfile)[0], sampleSize=args.sample_size)
+    return {"dictionary": newName, "files": [{"file": filename} for filename in filenames]}, []
+
+
+def cmndPreview(args, progress: hf.Progress) -> tuple:
+    filenames = expandFilenames(args.files)
+    keys = ["file", "oldSize", "newSize", "compression"]
+    if args.estimate:
+        if args.max_code_length:
+            raise ValueError("--max-code-length нельзя использовать с --estimate")
+        statistic = hf.previewEstimate(filenames, progress=progress)
+        keys.append("error")
+    else:
+        statistic = hf.preview(filenames, progress=progress, context=args.context,
+                               maxCodeLength=args.max_code_length)
+        if args.max_code_length:
+            keys.append("compressionLoss")
+        if args.context:
+            keys += ["contextNewSize", "contextCompression"]
+    files = [dict(zip(keys, row)) for row in statistic]
+    return {"files": files[:-1], "total": files[-1] if files else None}, []
+
+
+def cmndList(args, progress: hf.Progress) -> tuple:
+    files = [{"file": name, "oldSize": oldSize, "newSize": length}
+             for name, oldSize, start, length in hf.listContainer(args.archive)]
+    return {"archive": args.archive, "files": files}, []
+
+
+def printResult(command: str, result: dict) -> None:
+    """
+    Выводит результат команды в виде таблицы.
+    """
+    if command == "dict":
+        print(result["dictionary"])
+        return
+    for item in result["files"] + ([result["total"]] if result.get("total") else []):
+        values = [str(item[key]) for key in ("file", "oldSize", "newSize", "compression", "compressionLoss", "error",
+                                             "contextNewSize", "contextCompression") if key in item]
+        if command == "extract":
+            values = [item["archive"], "->", item["file"]]
+        if command == "test":
+            values = [item["archive"], "OK" if item["ok"] else "ОШИБКА"]
+            values += [error["error"] for error in item["errors"]]
+        print("\t".join(values))
+    for name in result.get("failed", []):
+        print(f"Ошибка: {name}", file=sys.stderr)
+
+
+def makeParser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="cli.py", description="Архиватор на основе кодов Хаффмана")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def addPipeline(commandParser: argparse.ArgumentParser) -> None:
+        commandParser.add_argument("--pipeline", action="store_true",
+                                   help="одновременно читать, обрабатывать и записывать разные файлы")
+        commandParser.add_argument("--queue-depth", type=int, default=hf.PIPELINE_DEPTH,
+                                   help="глубина очередей чтения и записи для --pipeline, файлов")
+
+    def addCommon(commandParser: argparse.ArgumentParser) -> None:
+        commandParser.add_argument("--json", action="store_true", help="вывести результат в формате JSON")
+        commandParser.add_argument("-q", "--quiet", action="store_true", help="не выводить прогресс")
+
+    compress = commands.add_parser("compress", help="создать архивы файлов")
+    compress.add_argument("files", nargs="+", help="файлы, шаблоны или @список")
+    compress.add_argument("-o", "--outdir", help="папка для архивов (по умолчанию - папка исходного файла)")
+    compress.add_argument("--pack", help="добавить все файлы в один архив-контейнер с этим именем")
+    compress.add_argument("-w", "--workers", type=int, default=1,
+                          help="количество файлов, обрабатываемых одновременно (процессов)")
+    compress.add_argument("--canonical", action="store_true", help="канонические коды")
+    compress.add_argument("--block-size", type=int, help="размер блоков архива, байт")
+    compress.add_argument("--block-workers", type=int, default=1,
+                          help="количество процессов, кодирующих блоки одного файла (с --block-size)")
+    mode = compress.add_mutually_exclusive_group()
+    mode.add_argument("--context", action="store_true", help="модель порядка 1 (коды по предыдущему байту)")
+    mode.add_argument("--rle", action="store_true", help="заменять серии одинаковых байтов символами повтора")
+    compress.add_argument("--dict", help="кодировать подходящие файлы кодами словаря (см. команду dict)")
+    compress.add_argument("--no-store-raw", dest="store_raw", action="store_false",
+                          help="сжимать даже несжимаемые файлы, а не хранить их как есть")
+    compress.add_argument("--max-code-length", type=int, help=f"максимальная длина кода (например, "
+                                                              f"{hf.MAX_CODE_LENGTH})")
+    addPipeline(compress)
+    addCommon(compress)
+
+    extract = commands.add_parser("extract", help="извлечь файлы из архивов")
+    extract.add_argument("files", nargs="+", help="архивы, шаблоны или @список")
+    extract.add_argument("-o", "--outdir", help="папка для извлеченных файлов (по умолчанию - папка архива)")
+    extract.add_argument("-w", "--workers", type=int, default=1,
+                         help="количество архивов, извлекаемых одновременно (процессов)")
+    extract.add_argument("--block-workers", type=int, default=1,
+                         help="количество процессов, декодирующих блоки одного архива из блоков")
+    extract.add_argument("--dict", help="словарь, которым закодированы архивы")
+    addPipeline(extract)
+    addCommon(extract)
+
+    test = commands.add_parser("test", help="проверить архивы по контрольным суммам, не извлекая файлы")
+    test.add_argument("files", nargs="+", help="архивы, шаблоны или @список")
+    test.add_argument("-w", "--workers", type=int, default=1, help="количество процессов")
+    test.add_argument("--dict", help="словарь, которым закодированы архивы")
+    addCommon(test)
+
+    dictCommand = commands.add_parser("dict", help="построить словарь по выборке из файлов")
+    dictCommand.add_argument("files", nargs="+", help="файлы, шаблоны или @список")
+    dictCommand.add_argument("-o", "--outfile", required=True, help="путь к словарю")
+    dictCommand.add_argument("--sample-size", type=int, default=hf.DICT_SAMPLE_SIZE,
+                             help="количество байтов из начала каждого файла")
+    addCommon(dictCommand)
+
+    preview = commands.add_parser("preview", help="рассчитать размеры архивов без их создания")
+    preview.add_argument("files", nargs="+", help="файлы, шаблоны или @список")
+    mode = preview.add_mutually_exclusive_group()
+    mode.add_argument("--estimate", action="store_true", help="быстрая оценка по выборке из файлов")
+    mode.add_argument("--context", action="store_true", help="рассчитать также сжатие моделью порядка 1")
+    preview.add_argument("--max-code-length", type=int,
+                         help="рассчитать сжатие для кодов не длиннее N (как compress --max-code-length) "
+                              "и его потерю в процентных пунктах")
+    addCommon(preview)
+
+    listCommand = commands.add_parser("list", help="показать файлы архива-контейнера")
+    listCommand.add_argument("archive")
+    addCommon(listCommand)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = makeParser().parse_args(argv)
+    progress = makeProgress(args.quiet or args.json)
+    command = {"compress": cmndCompress, "extract": cmndExtract, "test": cmndTest, "dict": cmndDict,
+               "preview": cmndPreview, "list": cmndList}
+    try:
+        result, errLst = command[args.command](args, progress)
+    except (OSError, ValueError) as error:
+        if progress.funcUpdate:
+            sys.stderr.write("\n")
+        print(f"Ошибка: {error}", file=sys.stderr)
+        return 1
+    if progress.funcUpdate:
+        sys.stderr.write("\n")
+    result["progress"] = progress.toDict()
+    if args.json:
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        printResult(args.command, result)
+    return 1 if errLst else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,6 @@
 import os
+import queue
+import threading
 import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog as fd
@@ -10,6 +12,9 @@ TITLE = "Архиватор"
 ROOT_W = 600
 ROOT_H = 400
 
+# Период опроса прогресса фоновой обработки, мс
+POLL_INTERVAL = 50
+
 # Убираем размытость виджетов tkinter в Windows 10:
 try:
     from ctypes import windll
@@ -59,32 +64,46 @@ class TopWindow(tk.Toplevel):
 class windowProgress(TopWindow):
     """
     Виджет окна, отвечающего за процесс обработки файлов.
+    Обработка выполняется в фоновом потоке (в том же процессе, чтобы частоты байтов оставались в hf.CACHE),
+    окно раз в POLL_INTERVAL мс читает прогресс из progress и сообщения из очереди messages.
     filenames: список имен обрабатываемых файлов
-    mode: режим обработки ("to", "from", "preview")
+    mode: режим обработки ("to", "from", "preview", "estimate" - приблизительный preview по выборкам,
+          "pack" - в один архив-контейнер, "unpack" - выбранные файлы из архива-контейнера)
+    packName: путь к архиву-контейнеру (для "pack" - без расширения)
+    saveDir: папка для извлеченных файлов (для "unpack")
+    maxCodeLength: максимальная длина кода (для "to", "pack" и "preview", см. hf.toArchive)
     statisticData: статистика для файлов
     interrupt_flag: флаг прерывания обработки файлов
+    progress: hf.Progress задачи, через него же задача прерывается
+    messages: очередь сообщений от фонового потока: ("file",), ("done", результат), ("error", исключение)
     """
 
-    def __init__(self, filenames: tuple, mode: str):
-        assert mode in ("to", "from", "preview")
+    def __init__(self, filenames: tuple, mode: str, packName: str = None, saveDir: str = None,
+                 maxCodeLength: int = None):
+        assert mode in ("to", "from", "preview", "estimate", "pack", "unpack")
 
         self.filenames = filenames
         self.mode = mode
+        self.packName = packName
+        self.saveDir = saveDir
+        self.maxCodeLength = maxCodeLength
         self.statisticData = None
         self.interrupt_flag = False
+        self.progress = hf.Progress()
+        self.messages = queue.Queue()
 
-        if mode == "to":
+        if mode in ("to", "pack"):
             title = "Добавление в архив"
-        elif mode == "from":
+        elif mode in ("from", "unpack"):
             title = "Извлечение из архива"
-        elif mode == "preview":
+        elif mode in ("preview", "estimate"):
             title = "Расчет"
 
         super().__init__(title=title, width=500, height=100)
         self.protocol("WM_DELETE_WINDOW", self.interrupt)
 
         self.lblCurrentFileName = tk.Label(self,
-                                           text=formatFileName(self.filenames[0][0] if mode != "preview" else
+                                           text=formatFileName(self.filenames[0][0] if mode in ("to", "from") else
                                                                self.filenames[0]))
         self.percentCounter = tk.IntVar(value=0)
         self.progressBarPercents = ttk.Progressbar(self,
@@ -100,23 +119,61 @@ class windowProgress(TopWindow):
         self.progressBarPercents.pack(expand=0, fill=tk.X)
         self.progressBarFiles.pack(expand=0, fill=tk.X)
 
-        self.update()
-
         if mode == "to":
-            self.cmnd_toArchiveMany()
+            job, self.finish = self.cmnd_toArchiveMany, self.finish_toArchiveMany
         elif mode == "from":
-            self.cmnd_fromArchiveMany()
+            job, self.finish = self.cmnd_fromArchiveMany, self.finish_fromArchiveMany
         elif mode == "preview":
-            self.statisticData = self.cmnd_preview()
+            job, self.finish = self.cmnd_preview, self.finish_preview
+        elif mode == "estimate":
+            job, self.finish = self.cmnd_previewEstimate, self.finish_preview
+        elif mode == "pack":
+            job, self.finish = self.cmnd_toContainer, self.finish_toContainer
+        elif mode == "unpack":
+            job, self.finish = self.cmnd_fromContainer, self.finish_fromContainer
+
+        threading.Thread(target=self.runJob, args=(job,), daemon=True).start()
+        self.after(POLL_INTERVAL, self.poll)
+
+    def runJob(self, job):
+        """
+        Выполняется в фоновом потоке: запускает обработку и отправляет ее результат в очередь сообщений.
+        """
+        try:
+            self.messages.put(("done", job()))
+        except Exception as e:
+            self.messages.put(("error", e))
 
-        self.dismiss()
+    def poll(self):
+        """
+        Обновляет окно по прогрессу и сообщениям фонового потока и завершает его после окончания обработки.
+        """
+        self.percentCounter.set(self.progress.getPercent())
+        try:
+            while True:
+                message = self.messages.get_nowait()
+                if message[0] == "file":
+                    self.nextFile()
+                elif message[0] == "done":
+                    self.finish(message[1])
+                    self.dismiss()
+                    return
+                elif message[0] == "error":
+                    msgbox.showerror(message=f"Ошибка при обработке файлов:\n{message[1]}")
+                    self.dismiss()
+                    return
+        except queue.Empty:
+            pass
+        self.after(POLL_INTERVAL, self.poll)
 
     def cmnd_toArchiveMany(self):
         """
         Запускает создание архивов.
         """
-        errLst = hf.toArchiveMany(filenames=self.filenames, funcAfterFile=self.funcAfterFile,
-                                  funcAfterPercent=self.funcAfterPercent)
+        return hf.toArchiveMany(filenames=self.filenames, funcAfterFile=self.funcAfterFile, progress=self.progress,
+                                maxCodeLength=self.maxCodeLength)
+
+    def finish_toArchiveMany(self, errLst: list):
         if self.interrupt_flag:
             msgbox.showerror(message="Преобразование могло завершиться с ошибками")
             return
@@ -134,9 +191,9 @@ class windowProgress(TopWindow):
         """
         Запускает извлечение файлов из архивов.
         """
-        errLst = hf.fromArchiveMany(filenames=self.filenames, funcAfterFile=self.funcAfterFile,
-                                    funcAfterPercent=self.funcAfterPercent)
+        return hf.fromArchiveMany(filenames=self.filenames, funcAfterFile=self.funcAfterFile, progress=self.progress)
 
+    def finish_fromArchiveMany(self, errLst: list):
         if self.interrupt_flag:
             msgbox.showerror(message="Преобразование могло завершиться с ошибками")
             return
@@ -150,48 +207,99 @@ class windowProgress(TopWindow):
                              message=f"Некоторые архивы ({len(errLst)} / {len(self.filenames)} шт.) не удалось "
                                      f"восстановить:\n{symb.join(errLst)}")
 
+    def cmnd_toContainer(self):
+        """
+        Запускает создание одного архива-контейнера для всех файлов.
+        """
+        return hf.toContainer(filenames=self.filenames, newName=self.packName, funcAfterFile=self.funcAfterFile,
+                              progress=self.progress, maxCodeLength=self.maxCodeLength)
+
+    def finish_toContainer(self, errLst: list):
+        if self.interrupt_flag:
+            msgbox.showerror(message="Преобразование могло завершиться с ошибками")
+            return
+
+        if not errLst:
+            msgbox.showinfo(title="Преобразование завершено",
+                            message=f"Все файлы ({len(self.filenames)} шт.) успешно добавлены в архив")
+        else:
+            symb = "\n"
+            msgbox.showerror(title="Преобразование завершено",
+                             message=f"Некоторые файлы ({len(errLst)} / {len(self.filenames)} шт.) не удалось "
+                                     f"добавить в архив:\n{symb.join(errLst)}")
+
+    def cmnd_fromContainer(self):
+        """
+        Запускает извлечение выбранных файлов из архива-контейнера.
+        """
+        return hf.fromContainer(oldName=self.packName, newDir=self.saveDir, names=self.filenames,
+                                funcAfterFile=self.funcAfterFile, progress=self.progress)
+
+    def finish_fromContainer(self, errLst: list):
+        if self.interrupt_flag:
+            msgbox.showerror(message="Преобразование могло завершиться с ошибками")
+            return
+
+        if not errLst:
+            msgbox.showinfo(title="Преобразование завершено",
+                            message=f"Все файлы ({len(self.filenames)} шт.) удалось успешно извлечь из архива")
+        else:
+            symb = "\n"
+            msgbox.showerror(title="Преобразование завершено",
+                             message=f"Некоторые файлы ({len(errLst)} / {len(self.filenames)} шт.) не удалось "
+                                     f"извлечь:\n{symb.join(errLst)}")
+
     def cmnd_preview(self):
         """
         Запускает расчет статистики для файлов без созданияя архивов.
         """
-        return hf.preview(filenames=self.filenames, funcAfterPercent=self.funcAfterPercent, funcAfterFile=self.funcAfterFile)
+        return hf.preview(filenames=self.filenames, funcAfterFile=self.funcAfterFile, progress=self.progress,
+                          context=True, maxCodeLength=self.maxCodeLength)
+
+    def cmnd_previewEstimate(self):
+        """
+        Запускает приблизительный расчет статистики для файлов по выборкам из них.
+        """
+        return hf.previewEstimate(filenames=self.filenames, funcAfterFile=self.funcAfterFile, progress=self.progress)
+
+    def finish_preview(self, statisticData: list):
+        self.statisticData = statisticData
 
     def funcAfterFile(self):
         """
-        Для вызова после обработки очередного файла, двигает значение ProgressBar.
+        Вызывается в фоновом потоке после обработки очередного файла.
+        """
+        self.messages.put(("file",))
+
+    def nextFile(self):
+        """
+        Двигает значение ProgressBar файлов и показывает имя следующего файла.
         """
         self.filesCounter.set(self.filesCounter.get() + 1)
         self.percentCounter.set(0)
         try:
-            if self.mode != "preview":
+            if self.mode in ("to", "from"):
                 self.lblCurrentFileName["text"] = self.filenames[self.filesCounter.get()][0]
             else:
                 self.lblCurrentFileName["text"] = self.filenames[self.filesCounter.get()]
         except IndexError:
             pass
-        self.update()
-
-    def funcAfterPercent(self):
-        """
-        Для вызова после обработки каждого 1% файла, двигает значение ProgressBar.
-        """
-        self.percentCounter.set(self.percentCounter.get() + 1)
-        self.update()
 
     def getStatisticData(self):
         return self.statisticData
 
     def interrupt(self):
-        if self.mode == "preview" or \
+        if self.mode in ("preview", "estimate") or \
                 msgbox.askokcancel(message="В результате этого действия некоторые из создаваемых "
                                            "файлов могут оказаться повреждены"):
             self.interrupt_flag = True
-            hf.RUN = False
+            self.progress.stop()
 
 
 class windowChooseToArchive(TopWindow):
     """
     Виджет окна, отвечающего за процесс выбора файлов для добавления в архив.
+    limitCodes: ограничивать длину кодов hf.MAX_CODE_LENGTH (для точного расчета и архивирования)
     """
 
     def __init__(self):
@@ -213,37 +321,76 @@ class windowChooseToArchive(TopWindow):
             self.btnToArchive = tk.Button(self.frameMenu,
                                           text="Архивировать",
                                           command=self.click_btnToArchive)
+            self.btnToContainer = tk.Button(self.frameMenu,
+                                            text="Архивировать в один файл",
+                                            command=self.click_btnToContainer)
+            self.limitCodes = tk.BooleanVar(value=False)
+            self.chkLimitCodes = tk.Checkbutton(self.frameMenu,
+                                                text=f"Коды не длиннее {hf.MAX_CODE_LENGTH} бит",
+                                                variable=self.limitCodes)
             self.btnPreview.pack(side=tk.LEFT, expand=1, fill=tk.X)
             self.btnToArchive.pack(side=tk.LEFT, expand=1, fill=tk.X)
+            self.btnToContainer.pack(side=tk.LEFT, expand=1, fill=tk.X)
+            self.chkLimitCodes.pack(side=tk.LEFT)
             self.frameMenu.pack(fill=tk.X)
 
     def click_btnPreview(self):
         """
-        Запускает процесс расчета размеров архивов, открывая окно windowProgress, и строит соответствующую таблицу.
+        Строит таблицу с приблизительными размерами архивов (по выборкам из файлов, расчет выполняется
+        в окне windowProgress) и предлагает точный расчет.
         """
         self.btnPreview["state"] = "disabled"
-        statisticData = windowProgress(filenames=self.filenames, mode="preview").getStatisticData()
+        window = windowProgress(filenames=self.filenames, mode="estimate")
+        self.wait_window(window)
+        statisticData = window.getStatisticData()
+        if not statisticData:
+            self.btnPreview["state"] = "normal"
+            return
 
         # Построение таблицы:
-        columns = ("filename", "oldSize", "newSize", "compression")
-        table = ttk.Treeview(self,
-                             columns=columns,
-                             show="headings")
-        table.pack(fill=tk.BOTH, expand=1)
-
-        table.heading(column="filename", text="Файл")
-        table.heading(column="oldSize", text="Размер файла, байт")
-        table.heading(column="newSize", text="Размер архива, байт")
-        table.heading(column="compression", text="Сжатие, %")
+        columns = ("filename", "oldSize", "newSize", "compression", "error", "compressionLoss", "contextCompression")
+        self.table = ttk.Treeview(self,
+                                  columns=columns,
+                                  show="headings")
+        self.table.pack(fill=tk.BOTH, expand=1)
+
+        self.table.heading(column="filename", text="Файл")
+        self.table.heading(column="oldSize", text="Размер файла, байт")
+        self.table.heading(column="newSize", text="Размер архива, байт")
+        self.table.heading(column="compression", text="Сжатие, %")
+        self.table.heading(column="error", text="Погрешность, байт")
+        self.table.heading(column="compressionLoss", text="Потеря сжатия, п.п.")
+        self.table.heading(column="contextCompression", text="Сжатие (порядок 1), %")
 
         width = self.winfo_width()
-        table.column("#1", width=int(0.55 * width))
-        table.column("#2", width=int(0.15 * width))
-        table.column("#3", width=int(0.15 * width))
-        table.column("#4", width=int(0.15 * width))
+        self.table.column("#1", width=int(0.28 * width))
+        for column in range(2, 8):
+            self.table.column(f"#{column}", width=int(0.12 * width))
+
+        for filename, oldSize, newSize, compression, error in statisticData:
+            self.table.insert("", tk.END, values=(filename, oldSize, newSize, compression, "±" + str(error), "", ""))
 
-        for oneData in statisticData:
-            table.insert("", tk.END, values=oneData)
+        self.btnRefine = tk.Button(self.frameMenu,
+                                   text="Точный расчет",
+                                   command=self.click_btnRefine)
+        self.btnRefine.pack(side=tk.LEFT, expand=1, fill=tk.X)
+
+    def click_btnRefine(self):
+        """
+        Запускает точный расчет размеров архивов (в том числе для модели порядка 1 и, если выбрано,
+        с ограничением длины кодов), открывая окно windowProgress, и обновляет таблицу.
+        """
+        self.btnRefine["state"] = "disabled"
+        window = windowProgress(filenames=self.filenames, mode="preview", maxCodeLength=self.getMaxCodeLength())
+        self.wait_window(window)
+        statisticData = window.getStatisticData()
+        if not statisticData:
+            self.btnRefine["state"] = "normal"
+            return
+        self.table.delete(*self.table.get_children())
+        for filename, oldSize, newSize, compression, *loss, contextNewSize, contextCompression in statisticData:
+            self.table.insert("", tk.END, values=(filename, oldSize, newSize, compression, 0, "".join(map(str, loss)),
+                                                  contextCompression))
 
     def click_btnToArchive(self):
         """
@@ -262,8 +409,28 @@ class windowChooseToArchive(TopWindow):
                         self.filenames[j][1] += f" ({counter})"
                         counter += 1
 
+            maxCodeLength = self.getMaxCodeLength()
+            self.dismiss()
+            windowProgress(filenames=tuple(self.filenames), mode="to", maxCodeLength=maxCodeLength)
+
+    def click_btnToContainer(self):
+        """
+        Запускает процесс добавления всех файлов в один архив-контейнер, открывая окно windowProgress.
+        """
+        packName = fd.asksaveasfilename(title="Сохранить архив как...",
+                                        defaultextension="." + hf.CONTAINER_EXTENSION,
+                                        filetypes=[("", "." + hf.CONTAINER_EXTENSION)])
+        if packName:
+            maxCodeLength = self.getMaxCodeLength()
             self.dismiss()
-            windowProgress(filenames=tuple(self.filenames), mode="to")
+            windowProgress(filenames=tuple(self.filenames), mode="pack", packName=os.path.splitext(packName)[0],
+                           maxCodeLength=maxCodeLength)
+
+    def getMaxCodeLength(self):
+        """
+        :return: hf.MAX_CODE_LENGTH, если выбрано ограничение длины кодов, иначе None
+        """
+        return hf.MAX_CODE_LENGTH if self.limitCodes.get() else None
 
     def checkSizeFiles(self) -> list:
         """
@@ -283,8 +450,11 @@ class windowChooseFromArchive(TopWindow):
 
     def __init__(self):
         self.filenames = fd.askopenfilenames(title="Выберите архивы для извлечения...",
-                                             filetypes=[("", "." + hf.EXTENSION)])
-        if self.filenames:
+                                             filetypes=[("", "." + hf.EXTENSION),
+                                                        ("", "." + hf.CONTAINER_EXTENSION)])
+        if len(self.filenames) == 1 and hf.isContainer(self.filenames[0]):
+            windowContainer(self.filenames[0])
+        elif self.filenames:
             saveDir = fd.askdirectory(title="Выберите папку для сохранения извлеченных файлов...")
             if saveDir:
                 super().__init__("Извлечение из архива...", ROOT_W, ROOT_H)
@@ -294,6 +464,58 @@ class windowChooseFromArchive(TopWindow):
                 windowProgress(filenames=tuple(self.filenames), mode="from")
 
 
+class windowContainer(TopWindow):
+    """
+    Виджет окна со списком файлов архива-контейнера, позволяющего извлечь только выбранные файлы.
+    names: {iid строки таблицы: имя файла} - имена берутся отсюда, а не из значений строк, которые Tk может
+           преобразовать (например, "007" в число 7)
+    """
+
+    def __init__(self, packName: str):
+        self.packName = packName
+        super().__init__(os.path.basename(packName), ROOT_W, ROOT_H)
+
+        self.frameMenu = tk.Frame(self)
+        self.btnExtractSelected = tk.Button(self.frameMenu,
+                                            text="Извлечь выбранные",
+                                            command=self.click_btnExtractSelected)
+        self.btnExtractAll = tk.Button(self.frameMenu,
+                                       text="Извлечь все",
+                                       command=self.click_btnExtractAll)
+        self.btnExtractSelected.pack(side=tk.LEFT, expand=1, fill=tk.X)
+        self.btnExtractAll.pack(side=tk.LEFT, expand=1, fill=tk.X)
+        self.frameMenu.pack(fill=tk.X)
+
+        self.table = ttk.Treeview(self,
+                                  columns=("filename", "oldSize"),
+                                  show="headings")
+        self.table.heading(column="filename", text="Файл")
+        self.table.heading(column="oldSize", text="Размер файла")
+        self.table.pack(fill=tk.BOTH, expand=1)
+        self.names = {}
+        for name, oldSize, start, length in hf.listContainer(packName):
+            self.names[self.table.insert("", tk.END, values=(name, formatSize(oldSize)))] = name
+
+    def click_btnExtractSelected(self):
+        names = tuple(self.names[item] for item in self.table.selection())
+        if names:
+            self.extract(names)
+
+    def click_btnExtractAll(self):
+        names = tuple(self.names[item] for item in self.table.get_children())
+        if names:
+            self.extract(names)
+
+    def extract(self, names: tuple):
+        """
+        Запускает извлечение файлов names, открывая окно windowProgress.
+        """
+        saveDir = fd.askdirectory(title="Выберите папку для сохранения извлеченных файлов...")
+        if saveDir:
+            self.dismiss()
+            windowProgress(filenames=names, mode="unpack", packName=self.packName, saveDir=saveDir)
+
+
 class windowMain(tk.Tk):
     """
     Виджет главного окна.
@@ -1,50 +1,434 @@
+import hashlib
+import io
+import json
+import mmap
+import multiprocessing as mp
 import os
-from math import ceil
+import queue
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from itertools import chain
+from math import ceil, log2, sqrt
 
 import path_tools as pt
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 EXTENSION = "huff_archive"
 
+# Архив-контейнер с несколькими файлами (см. toContainer)
+CONTAINER_EXTENSION = "huff_pack"
+CONTAINER_MAGIC = b"HUFFPACK"
+
+# Словарь - общие канонические коды для набора маленьких файлов (см. trainDictionary)
+DICT_EXTENSION = "huff_dict"
+DICT_MAGIC = b"HUFFDICT"
+
+# Размер блока, которым файлы считываются с диска
+CHUNK_SIZE = 2 ** 20
+
+# Отображать файлы в память (mmap) вместо чтения через буфер
+USE_MMAP = True
+
+# Заголовок архива версии 2 (см. writeHeader): HEADER_MAGIC, версия, флаги, формат, длина всего заголовка,
+# размер исходного файла (8 байт), затем расширение и данные формата (дерево, таблица блоков и т.д.).
+# Архивы версии 1 начинаются сразу с расширения (см. ArchiveHeader.readV1)
+HEADER_MAGIC = b"\x89HUF"
+HEADER_VERSION = 2
+HEADER = struct.Struct(">4sBBBIQ")
+FLAG_SYNC_INDEX = 1  # в конце архива записан индекс точек синхронизации (см. writeArchive)
+FLAG_CHECKSUMS = 2  # записаны контрольные суммы CRC32 блоков исходного файла (см. headerToBytes, StreamEncoder)
+
+# Формат архива: в архиве версии 1 вместо размера дерева (в обычном дереве всегда не меньше 3 вершин)
+# записывается 0, если за ним следует байт формата, описывающий другой способ хранения дерева
+FORMAT_TREE = 0  # дерево целиком (см. HuffTree.toBytes)
+FORMAT_CANONICAL = 1  # канонические коды: хранятся только длины кодов
+FORMAT_BLOCKS = 2  # файл разбит на блоки со своими каноническими кодами и таблицей смещений блоков
+FORMAT_STREAM = 3  # поток блоков с размерами перед каждым блоком, без заранее известного размера файла
+FORMAT_STORED = 4  # исходный файл хранится без сжатия (см. isIncompressible)
+FORMAT_CONTEXT = 5  # модель порядка 1: коды выбираются по предыдущему байту (см. ContextModel)
+FORMAT_RLE = 6  # серии одинаковых байтов заменяются символами повтора (см. writeRle)
+FORMAT_DICT = 7  # канонические коды из словаря, на который архив ссылается по id (см. Dictionary)
+
+# Данные с энтропией больше этой (бит на байт) хранятся без сжатия: коды Хаффмана сократили бы их
+# меньше, чем на 1 - RAW_ENTROPY / 8, а кодирование и декодирование занимают основное время
+RAW_ENTROPY = 7.95
+
+# Максимальное количество файлов, частоты байтов которых хранятся в памяти (см. FreqCache)
+CACHE_SIZE = 4096
+
+# Выборка для быстрой оценки размера архива: количество блоков и размер блока (см. estimateOneFile)
+SAMPLE_COUNT = 64
+SAMPLE_SIZE = 2 ** 12
+
+# Признак индекса точек синхронизации в конце архива с одним деревом (см. writeArchive)
+SYNC_MAGIC = b"HUFFSYNC"
+
+# Рекомендуемая максимальная длина кода при ограничении длин кодов (см. limitCodeLengths)
+MAX_CODE_LENGTH = 15
+
+# Выборка для обучения словаря: не больше DICT_SAMPLE_SIZE байт из начала каждого файла
+# и не больше DICT_MAX_SAMPLE байт всего (см. trainDictionary)
+DICT_SAMPLE_SIZE = 2 ** 16
+DICT_MAX_SAMPLE = 2 ** 26
+
+# Серии из RLE_MIN_RUN и более одинаковых байтов кодируются первым байтом серии и символами повтора
+# RLE_SYMBOL + k, каждый из которых повторяет предыдущий байт 2 ** k раз (k = 0..RLE_MAX_SHIFT)
+RLE_MIN_RUN = 4
+RLE_MAX_SHIFT = 16
+RLE_SYMBOL = 256
+# Начало серии и продолжение серии каждого байта (см. findRuns)
+RUN_START = re.compile(rb"(.)\1{%d}" % (RLE_MIN_RUN - 1), re.DOTALL)
+RUN_BYTES = [re.compile(re.escape(bytes([byte])) + b"*") for byte in range(256)]
+
+# Контексты (предыдущие байты), встречающиеся реже, кодируются общим деревом модели порядка 1 (см. ContextModel)
+CONTEXT_MIN_COUNT = 256
+
+# Размер блока по умолчанию для архивов из блоков
+BLOCK_SIZE = 2 ** 22
+
+# Файлы не больше этого размера архивируются за одно чтение целиком в память,
+# файлы большего размера - блоками (см. toArchive)
+MEMORY_LIMIT = 2 ** 28
+
+# Конвейер пакетной обработки (см. BatchPipeline): глубина очередей считанных и обработанных файлов
+# и количество потоков ввода-вывода
+PIPELINE_DEPTH = 4
+PIPELINE_IO_THREADS = 2
+
 RUN = True
 
+# Очередь сообщений о прогрессе и событие отмены в процессе-обработчике (см. runMany)
+WORKER_QUEUE = None
+WORKER_CANCEL = None
+
+
+def isRunning(cancel=None) -> bool:
+    """
+    :param cancel: объект с методом is_set() (threading.Event, multiprocessing.Event), отменяющий конкретную задачу
+    :return: False, если обработка прервана глобальным флагом RUN или через cancel
+    """
+    return RUN and not (cancel is not None and cancel.is_set())
+
+
+def countBytes(chunk: bytes) -> list:
+    """
+    Подсчитывает количество каждого байта в блоке данных (с помощью numpy, если он установлен).
+    :param chunk: блок данных (bytes, mmap или memoryview)
+    :return: список из 256 чисел, где i-й элемент - количество байтов i в chunk
+    """
+    if np is not None:
+        return np.bincount(np.frombuffer(chunk, dtype=np.uint8), minlength=256).tolist()
+    # Один проход Counter (на C) быстрее 256 проходов bytes.count
+    counts = [0] * 256
+    for byte, count in Counter(memoryview(chunk)).items():
+        counts[byte] = count
+    return counts
+
+
+@contextmanager
+def mapFile(file):
+    """
+    Отображает открытый для чтения файл в память.
+    :param file: бинарный файловый объект
+    :return: mmap (только для чтения) или None, если USE_MMAP == False или файл нельзя отобразить в память
+             (пустой файл, канал, неподдерживаемая платформа) - тогда файл нужно читать обычным образом
+    """
+    if not USE_MMAP:
+        yield None
+        return
+    try:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, io.UnsupportedOperation):
+        yield None
+        return
+    try:
+        yield mapped
+    finally:
+        try:
+            mapped.close()
+        except BufferError:
+            # Остались срезы memoryview, память освободится вместе с последним из них
+            pass
+
+
+def readChunks(file, mapped=None):
+    """
+    Генератор блоков файла размером CHUNK_SIZE от текущей позиции file до конца.
+    :param mapped: результат mapFile(file); если задан, блоки - срезы memoryview без копирования данных
+    """
+    if mapped is None:
+        chunk = file.read(CHUNK_SIZE)
+        while chunk:
+            yield chunk
+            chunk = file.read(CHUNK_SIZE)
+        return
+    view = memoryview(mapped)
+    for pos in range(file.tell(), len(view), CHUNK_SIZE):
+        yield view[pos:pos + CHUNK_SIZE]
+
+
+def readAt(file, mapped, pos: int, length: int) -> bytes:
+    """
+    :param mapped: результат mapFile(file)
+    :return: length байтов file с позиции pos (срез memoryview без копирования, если файл отображен в память)
+    """
+    if mapped is not None:
+        return memoryview(mapped)[pos:pos + length]
+    file.seek(pos)
+    return file.read(length)
+
+
+def callAfterPercents(funcAfterPercent, done: int, step: int, total: int) -> int:
+    """
+    Вызывает funcAfterPercent по одному разу за каждый 1% от total, пройденный при обработке очередного блока.
+    :param done: количество байтов, обработанных до блока
+    :param step: размер блока
+    :param total: общее количество байтов
+    :return: количество байтов, обработанных с учетом блока
+    """
+    if funcAfterPercent and total:
+        for _ in range((done + step) * 100 // total - done * 100 // total):
+            funcAfterPercent()
+    return done + step
+
+
+class Progress:
+    """
+    Прогресс и метрики обработки файлов. Обработчики (Freq, toArchive, fromArchive и др.) обновляют его один раз
+    на блок данных, а окно прогресса или консольный запуск читают из него состояние.
+    funcAfterPercent: вызывается после обработки каждого 1% текущего файла
+    funcUpdate: вызывается с объектом Progress не чаще, чем раз в interval секунд
+    cancel: см. isRunning; кроме того, обработку можно прервать методом stop
+    total, done: размер текущего файла и количество его обработанных байтов
+    bytesProcessed: количество байтов, обработанных с момента создания объекта
+    phases: {"фаза": секунды, ...} - суммарное время фаз "histogram", "tree", "encode", "decode", "check",
+            "write"
+    Метод is_set позволяет передавать объект как cancel (см. isRunning).
+    """
+
+    def __init__(self, funcAfterPercent=None, cancel=None, funcUpdate=None, interval=0.1):
+        self.funcAfterPercent = funcAfterPercent
+        self.funcUpdate = funcUpdate
+        self.interval = interval
+        self.cancel = cancel
+        self.stopped = False
+        self.total = 0
+        self.done = 0
+        self.bytesProcessed = 0
+        self.phases = {}
+        self.startTime = time.perf_counter()
+        self.lastUpdate = self.startTime
+
+    def begin(self, total: int, done: int = 0) -> None:
+        """
+        Начинает обработку очередного файла.
+        :param total: размер файла
+        :param done: количество байтов файла, которые не нужно обрабатывать (например, заголовок архива)
+        """
+        self.total = total
+        self.done = done
+
+    def advance(self, step: int, processed=True) -> None:
+        """
+        Отмечает обработку очередного блока текущего файла размером step байт.
+        :param processed: учитывать ли блок в bytesProcessed (False - блок пропущен, например, взят из кэша)
+        """
+        self.done = callAfterPercents(self.funcAfterPercent, self.done, step, self.total)
+        if processed:
+            self.bytesProcessed += step
+        if self.funcUpdate:
+            now = time.perf_counter()
+            if now - self.lastUpdate >= self.interval:
+                self.lastUpdate = now
+                self.funcUpdate(self)
+
+    def finish(self) -> None:
+        """
+        Отмечает текущий файл обработанным полностью, не учитывая оставшиеся байты в bytesProcessed.
+        """
+        if self.done < self.total:
+            self.advance(self.total - self.done, processed=False)
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Прибавляет время выполнения блока with к фазе name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def addPhases(self, phases: dict) -> None:
+        """
+        Прибавляет время фаз, измеренное в другом процессе.
+        """
+        for name, seconds in phases.items():
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def stop(self) -> None:
+        self.stopped = True
+
+    def isRunning(self) -> bool:
+        return not self.stopped and isRunning(self.cancel)
+
+    def is_set(self) -> bool:
+        return not self.isRunning()
+
+    def getPercent(self) -> int:
+        """
+        :return: процент обработки текущего файла
+        """
+        return self.done * 100 // self.total if self.total else 0
+
+    def getElapsed(self) -> float:
+        return time.perf_counter() - self.startTime
+
+    def getThroughput(self) -> float:
+        """
+        :return: средняя скорость обработки, байт/с
+        """
+        elapsed = self.getElapsed()
+        return self.bytesProcessed / elapsed if elapsed else 0.0
+
+    def toDict(self) -> dict:
+        return {"bytesProcessed": self.bytesProcessed, "seconds": round(self.getElapsed(), 6),
+                "throughput": round(self.getThroughput(), 1),
+                "phases": {name: round(seconds, 6) for name, seconds in self.phases.items()}}
+
+
+def getProgress(progress: Progress = None, funcAfterPercent=None, cancel=None) -> Progress:
+    """
+    :return: progress или, если он не передан, новый Progress с funcAfterPercent и cancel
+    """
+    if progress is not None:
+        return progress
+    return Progress(funcAfterPercent=funcAfterPercent, cancel=cancel)
+
 
 class Freq:
     """
     Содержит частоты каждого байта, встречающегося в определенном файле
     freq: {byte: count, ...}
+    Если передан data, частоты считаются по данным в памяти, а filename не используется.
+    Если передан counts ({byte: count, ...}), частоты берутся из него.
+    progress: см. Progress (вместо funcAfterPercent и cancel)
     """
-    def __init__(self, filename: str, funcAfterPercent=None):
+    def __init__(self, filename: str = None, funcAfterPercent=None, cancel=None, data: bytes = None,
+                 progress: Progress = None, counts: dict = None):
         self.freq = {}
 
-        oldFileSize = os.path.getsize(filename)
-
-        chunk_counter = 0
-        with open(filename, "rb") as file:
-            chunk = file.read(1)
-            while chunk:
-                if not RUN:
-                    return
-                try:
-                    self.freq[ord(chunk)] += 1
-                except KeyError:
-                    self.freq[ord(chunk)] = 1
-                chunk_counter += 1
-                if funcAfterPercent and int(chunk_counter / oldFileSize * 100) - int(
-                        (chunk_counter - 1) / oldFileSize * 100) == 1:
-                    funcAfterPercent()
-                chunk = file.read(1)
+        if counts is not None:
+            self.freq = dict(counts)
+        elif data is not None:
+            self.update(data)
+        else:
+            progress = getProgress(progress, funcAfterPercent, cancel)
+            progress.begin(os.path.getsize(filename))
+            with open(filename, "rb") as file, mapFile(file) as mapped:
+                for chunk in readChunks(file, mapped):
+                    if not progress.isRunning():
+                        return
+                    with progress.phase("histogram"):
+                        self.update(chunk)
+                    progress.advance(len(chunk))
 
         # Добавляем еще один байт с нулевой частотой, если файл состоит из одинаковых байтов, для того,
         # чтобы можно было построить дерево
         if len(self.freq) == 1:
             self.freq[([k for k in self.freq.keys()][0] + 1) % 256] = 0
 
+    def update(self, chunk: bytes) -> None:
+        """
+        Добавляет к частотам количество байтов из очередного блока данных.
+        Новые байты добавляются в порядке их первого появления, как при побайтовом чтении,
+        чтобы дерево (а значит, и архив) не зависело от размера блока.
+        :param chunk: bytes, mmap или memoryview
+        """
+        counts = countBytes(chunk)
+        newBytes = [byte for byte in range(256) if counts[byte] and byte not in self.freq]
+        if newBytes:
+            find = chunk.find if hasattr(chunk, "find") else bytes(chunk).find
+            newBytes.sort(key=lambda byte: find(bytes([byte])))
+        for byte in newBytes:
+            self.freq[byte] = 0
+        for byte in range(256):
+            if counts[byte]:
+                self.freq[byte] += counts[byte]
+
     def toList(self):
         """
         Возвращает атрибут self.freq в виде списка
         """
         return [[k, v] for k, v in self.freq.items()]
 
+    def getEntropy(self) -> float:
+        """
+        :return: энтропия Шеннона частот байтов, бит на байт (нижняя граница средней длины кода)
+        """
+        total = sum(self.freq.values())
+        if not total:
+            return 0.0
+        return -sum(count / total * log2(count / total) for count in self.freq.values() if count)
+
+
+def readLengths(file, extended=False) -> dict:
+    """
+    Функция, обратная HuffTree.lengthsToBytes
+    :param file: бинарный файловый объект, указатель которого стоит на начале данных о длинах кодов
+    :param extended: длины кодов расширенного алфавита (с символами повтора, см. RLE_SYMBOL)
+    :return: {byte: codeLength, ...}
+    """
+    if extended:
+        count = int.from_bytes(file.read(2), "big")
+        if count < 96:
+            data = file.read(count * 3)
+            return {int.from_bytes(data[i:i + 2], "big"): data[i + 2] for i in range(0, len(data), 3)}
+        size = int.from_bytes(file.read(2), "big")
+        return {symbol: length for symbol, length in enumerate(file.read(size)) if length}
+    count = ord(file.read(1)) + 1
+    if count < 128:
+        data = file.read(count * 2)
+        return {data[i]: data[i + 1] for i in range(0, len(data), 2)}
+    return {byte: length for byte, length in enumerate(file.read(256)) if length}
+
+
+def limitCodeLengths(freq: dict, maxLength: int) -> dict:
+    """
+    Строит оптимальные длины кодов, не превышающие maxLength, алгоритмом package-merge:
+    на каждом из maxLength - 1 шагов соседние элементы отсортированного по весу списка объединяются в пакеты,
+    которые сливаются со списком листьев; длина кода байта равна количеству вхождений его листа
+    в первые 2 * [кол-во байтов] - 2 элементов итогового списка.
+    :param freq: {byte: count, ...}
+    :return: {byte: codeLength, ...}
+    """
+    if len(freq) > 2 ** maxLength:
+        raise ValueError(f"{len(freq)} байтов нельзя закодировать кодами длины не больше {maxLength}")
+    # Элемент списка: (вес, байты всех листьев пакета)
+    leaves = sorted(((count, (byte,)) for byte, count in freq.items()), key=lambda item: item[0])
+    current = leaves
+    for _ in range(maxLength - 1):
+        packages = [(a[0] + b[0], a[1] + b[1]) for a, b in zip(current[0::2], current[1::2])]
+        current = sorted(leaves + packages, key=lambda item: item[0])
+    lengths = dict.fromkeys(freq, 0)
+    for _, symbols in current[:2 * len(leaves) - 2]:
+        for byte in symbols:
+            lengths[byte] += 1
+    return lengths
+
 
 class HuffTree:
     """
@@ -53,26 +437,56 @@ class HuffTree:
     freq: Freq(filename)
     tree: [leafs: (byte, selfId), ..., edges: (toIdif0, toIdif1), ..., root: (toIdif0, toIdif1)]
     codes: {byte: "bincode", ...}
+    decodeTable: [[(b"decoded bytes", nextTopID), ... 256], ...] для каждой внутренней вершины (None для листьев)
+                 (для расширенного алфавита - см. getRunDecodeTable)
+    canonical: True, если коды канонические и в архив сохраняются только их длины
+    maxCodeLength: максимальная длина кода (None - без ограничения); если коды дерева Хаффмана длиннее,
+                   дерево перестраивается по ограниченным длинам (см. limitCodeLengths) и коды становятся
+                   каноническими
+    from_: "file" - по исходному файлу, "archive" - по архиву (или по открытому архиву file, указатель
+           которого стоит на данных о дереве), "freq" - по готовому объекту Freq (freq),
+           "lengths" - по длинам канонических кодов (lengths: {byte: codeLength, ...})
     """
 
-    def __init__(self, filename: str, from_: str, funcAfterPercent=None):
-        assert from_ in ("file", "archive")
+    def __init__(self, filename: str, from_: str, funcAfterPercent=None, canonical=False, cancel=None,
+                 freq: Freq = None, lengths: dict = None, file=None, maxCodeLength: int = None,
+                 progress: Progress = None):
+        assert from_ in ("file", "archive", "freq", "lengths")
 
         self.filename = filename
         self.freq = None
         self.tree = None
         self.codes = None
+        self.decodeTable = None
+        self.canonical = canonical
 
         if from_ == "file":
-            self.initFromFile(funcAfterPercent)
+            self.initFromFile(funcAfterPercent, cancel, progress)
+            self.initCodes(canonical, maxCodeLength)
+        elif from_ == "archive" and file is not None:
+            self.readTree(file)
         elif from_ == "archive":
             self.initFromArchive()
-
-    def initFromFile(self, funcAfterPercent=None):
+        elif from_ == "freq":
+            self.initFromFreq(freq)
+            self.initCodes(canonical, maxCodeLength)
+        elif from_ == "lengths":
+            self.canonical = True
+            self.initFromLengths(lengths)
+
+    def initFromFile(self, funcAfterPercent=None, cancel=None, progress: Progress = None):
         """
         Возвращает объект HuffTree для исходного файла.
         """
 
+        self.initFromFreq(Freq(filename=self.filename, funcAfterPercent=funcAfterPercent, cancel=cancel,
+                               progress=progress))
+
+    def initFromFreq(self, freq: Freq) -> None:
+        """
+        Строит дерево по готовому списку частот.
+        """
+
         def insertTopToFreq(freqLst: list, newTop: list[int, list[int, int], int]) -> None:
             """
             Вставляет newTop в отсортированный по невозрастанию freqLst с помощью бинпоиска.
@@ -98,7 +512,7 @@ class HuffTree:
                 else:
                     b = k - 1
 
-        self.freq = Freq(filename=self.filename, funcAfterPercent=funcAfterPercent)
+        self.freq = freq
         freqLst = self.freq.toList()
         # now freqLst: [[byte, count], ...]
         freqLst.sort(key=lambda x: x[1], reverse=True)
@@ -115,22 +529,81 @@ class HuffTree:
             insertTopToFreq(freqLst, newTop)
             self.tree.append(newTop[1])
 
+    def initCodes(self, canonical=False, maxCodeLength: int = None) -> None:
+        """
+        Перестраивает построенное по частотам дерево в каноническое и/или с ограниченными длинами кодов.
+        """
+        lengths = self.getCodeLengths()
+        if maxCodeLength and max(lengths.values()) > maxCodeLength:
+            self.canonical = True
+            self.initFromLengths(limitCodeLengths(self.freq.freq, maxCodeLength))
+        elif canonical:
+            self.initFromLengths(lengths)
+
     def initFromArchive(self):
         """
         Возвращает объект HuffTree, данные для которого записаны в архиве.
         self.freq при этом == None
         """
         with open(self.filename, "rb") as file:
-            # Пропускаем данные об расширение исходного файла
-            extLen = ord(file.read(1))
-            file.read(extLen)
+            tree = ArchiveHeader(file).tree
+        if tree is None:
+            raise ValueError("В архиве нет общего дерева")
+        self.tree, self.codes, self.canonical = tree.tree, tree.codes, tree.canonical
 
-            # Восстанавливаем дерево
-            self.tree = []
-            treesize = ord(file.read(1)) * 256 + ord(file.read(1))
-            for i in range(treesize):
-                self.tree.append(
-                    (ord(file.read(1)) * 256 + ord(file.read(1)), ord(file.read(1)) * 256 + ord(file.read(1))))
+    def readTree(self, file) -> None:
+        """
+        Восстанавливает дерево (см. toBytes) из открытого архива.
+        :param file: бинарный файловый объект, указатель которого стоит на начале данных о дереве
+        """
+        treesize = int.from_bytes(file.read(2), "big")
+        if treesize == 0:
+            fmt = ord(file.read(1))
+            if fmt not in (FORMAT_CANONICAL, FORMAT_RLE):
+                raise ValueError(f"Неизвестный формат дерева: {fmt}")
+            self.canonical = True
+            self.initFromLengths(readLengths(file, extended=fmt == FORMAT_RLE))
+            return
+        data = file.read(treesize * 4)
+        self.tree = [(int.from_bytes(data[i:i + 2], "big"), int.from_bytes(data[i + 2:i + 4], "big"))
+                     for i in range(0, len(data), 4)]
+
+    def initFromLengths(self, lengths: dict) -> None:
+        """
+        Строит дерево с каноническими кодами по длинам кодов.
+        Коды назначаются по возрастанию (длина кода, байт), поэтому для восстановления дерева
+        достаточно знать только длины. Вершины располагаются в том же формате, что и в обычном дереве:
+        сначала листья, затем внутренние вершины уровень за уровнем снизу вверх, корень последний.
+        :param lengths: {byte: codeLength, ...}
+        """
+        order = sorted(lengths, key=lambda byte: (lengths[byte], byte))
+        codes = {}
+        code = 0
+        prevLength = lengths[order[0]]
+        for byte in order:
+            code <<= lengths[byte] - prevLength
+            prevLength = lengths[byte]
+            codes[byte] = format(code, "b").zfill(prevLength)
+            code += 1
+
+        self.tree = [(byte, topID) for topID, byte in enumerate(order)]
+        # level: {"префикс кода": topID, ...} для вершин текущего уровня
+        level = {}
+        for length in range(prevLength, 0, -1):
+            level.update({codes[byte]: topID for topID, byte in enumerate(order) if lengths[byte] == length})
+            parents = {}
+            for prefix in sorted(level):
+                if prefix[-1] == "1":
+                    continue
+                if prefix[:-1] + "1" not in level:
+                    raise ValueError("Длины кодов не образуют полное дерево")
+                parents[prefix[:-1]] = len(self.tree)
+                self.tree.append((level[prefix], level[prefix[:-1] + "1"]))
+            if len(parents) * 2 != len(level):
+                raise ValueError("Длины кодов не образуют полное дерево")
+            level = parents
+        self.codes = codes
+        self.decodeTable = None
 
     def len(self) -> int:
         """
@@ -142,6 +615,8 @@ class HuffTree:
         """
         :return: длина данных о дереве в байтах, которые сохраняются в архив
         """
+        if self.canonical:
+            return len(self.toBytes())
         return len(self.tree) * 4 + 2
 
     def lenArchiveData(self) -> int:
@@ -179,6 +654,16 @@ class HuffTree:
         assert bit in (0, 1)
         return self.tree[topID][bit]
 
+    def getTopByCode(self, code: str) -> int:
+        """
+        :param code: начало двоичного кода ("bincode")
+        :return: номер вершины, в которую ведет code от корня
+        """
+        topID = self.getRootID()
+        for bit in code:
+            topID = self.getNextTopID(topID, int(bit))
+        return topID
+
     def getByte(self, topID: int) -> int:
         """
         :param topID: номер вершины-листа
@@ -215,11 +700,132 @@ class HuffTree:
         self.codes = codes
         return self.codes
 
+    def getCodeLengths(self) -> dict:
+        """
+        :return: длины двоичных кодов для каждого байта в формате {byte: codeLength, ...}
+        """
+        return {byte: len(code) for byte, code in self.getCodes().items()}
+
+    def isExtended(self) -> bool:
+        """
+        :return: True, если в дереве есть символы повтора (см. RLE_SYMBOL)
+        """
+        return max(self.getCodes()) >= RLE_SYMBOL
+
+    def lengthsToBytes(self) -> bytes:
+        """
+        :return: длины канонических кодов для сохранения в архив: количество байтов - 1 и пары (байт, длина кода),
+                 если байтов меньше 128, иначе длины кодов всех 256 байтов (см. readLengths).
+                 Для расширенного алфавита (см. isExtended): количество символов (2 байта) и тройки
+                 (символ: 2 байта, длина кода), если символов меньше 96, иначе размер алфавита (2 байта)
+                 и длины кодов всех символов
+        """
+        lengths = self.getCodeLengths()
+        if self.isExtended():
+            data = len(lengths).to_bytes(2, "big")
+            if len(lengths) < 96:
+                return data + b"".join(symbol.to_bytes(2, "big") + bytes([lengths[symbol]])
+                                       for symbol in sorted(lengths))
+            size = max(lengths) + 1
+            return data + size.to_bytes(2, "big") + bytes(lengths.get(symbol, 0) for symbol in range(size))
+        lst = [len(lengths) - 1]
+        if len(lengths) < 128:
+            for byte in sorted(lengths):
+                lst += [byte, lengths[byte]]
+        else:
+            lst += [lengths.get(byte, 0) for byte in range(256)]
+        return bytes(lst)
+
+    def getDecodeTable(self) -> list:
+        """
+        Строит таблицу для декодирования сразу целого байта архива.
+        decodeTable[topID][byte] == (байты, декодированные при проходе 8 битов byte от вершины topID,
+                                     вершина, в которой закончился проход)
+        Таблица строится удвоением: переходы на 1 бит -> на 2 бита -> на 4 бита -> на 8 битов.
+        :return: таблица переходов для каждой внутренней вершины дерева (для листьев - None)
+        """
+        if self.decodeTable:
+            return self.decodeTable
+
+        rootID = self.getRootID()
+        inner = [topID for topID in range(self.len()) if not self.isLeaf(topID)]
+        table = [None] * self.len()
+        for topID in inner:
+            steps = []
+            for bit in (0, 1):
+                nextID = self.getNextTopID(topID, bit)
+                if self.isLeaf(nextID):
+                    steps.append((bytes([self.getByte(nextID)]), rootID))
+                else:
+                    steps.append((b"", nextID))
+            table[topID] = steps
+
+        for bits in (1, 2, 4):
+            newTable = [None] * self.len()
+            for topID in inner:
+                steps = []
+                for high in range(2 ** bits):
+                    highData, middleID = table[topID][high]
+                    for lowData, nextID in table[middleID]:
+                        steps.append((highData + lowData, nextID))
+                newTable[topID] = steps
+            table = newTable
+
+        self.decodeTable = table
+        return self.decodeTable
+
+    def getRunDecodeTable(self) -> list:
+        """
+        Аналог getDecodeTable для расширенного алфавита (см. isExtended).
+        decodeTable[topID][byte] == (байты, декодированные при проходе 8 битов byte от вершины topID,
+                                     ((позиция в этих байтах, количество повторов), ...) для символов повтора,
+                                     вершина, в которой закончился проход)
+        Символ повтора на позиции 0 повторяет последний байт, декодированный до прохода (см. unpackRuns).
+        """
+        if self.decodeTable:
+            return self.decodeTable
+
+        rootID = self.getRootID()
+        inner = [topID for topID in range(self.len()) if not self.isLeaf(topID)]
+        table = [None] * self.len()
+        for topID in inner:
+            steps = []
+            for bit in (0, 1):
+                nextID = self.getNextTopID(topID, bit)
+                if not self.isLeaf(nextID):
+                    steps.append((b"", (), nextID))
+                elif self.getByte(nextID) < RLE_SYMBOL:
+                    steps.append((bytes([self.getByte(nextID)]), (), rootID))
+                else:
+                    steps.append((b"", ((0, 2 ** (self.getByte(nextID) - RLE_SYMBOL)),), rootID))
+            table[topID] = steps
+
+        for bits in (1, 2, 4):
+            newTable = [None] * self.len()
+            for topID in inner:
+                steps = []
+                for high in range(2 ** bits):
+                    highData, highRuns, middleID = table[topID][high]
+                    for lowData, lowRuns, nextID in table[middleID]:
+                        if lowRuns:
+                            lowRuns = tuple((pos + len(highData), count) for pos, count in lowRuns)
+                        steps.append((highData + lowData, highRuns + lowRuns, nextID))
+                newTable[topID] = steps
+            table = newTable
+
+        self.decodeTable = table
+        return self.decodeTable
+
     def toBytes(self) -> bytes:
         """
         :return: данные о дереве для сохранения в файл-архив
-                 (2 байта на размер дерева и по 4 байта на каждую вершину (по 2 байта на число из пары))
+                 (2 байта на размер дерева и по 4 байта на каждую вершину (по 2 байта на число из пары)).
+                 Для канонических кодов: 2 нулевых байта, байт формата, количество байтов - 1 и
+                 пары (байт, длина кода), если байтов меньше 128, иначе длины кодов всех 256 байтов;
+                 для расширенного алфавита байт формата равен FORMAT_RLE (см. lengthsToBytes)
         """
+        if self.canonical:
+            return bytes([0, 0, FORMAT_RLE if self.isExtended() else FORMAT_CANONICAL]) + self.lengthsToBytes()
         assert self.len() <= 2 ** 16 - 1
         lst = [self.len() // 256, self.len() % 256]
         for top in self.tops():
@@ -228,253 +834,2777 @@ class HuffTree:
         return bytes(lst)
 
 
-def toArchive(oldName: str, newName: str, funcAfterPercent=None) -> tuple:
+class FreqCache:
     """
-    Создает архив на основе исходного файла.
-    Структура архива:
-        размер исх. расширения: 1 байт
-        исх. расширение: 1 байт - 1 символ
-        данные о дереве: 2 + 4 * [длина дерева] байт
-        размер исходного файла (1 байт == число-цифра) + 1 байт byte10
-        массив байтов
-    :param oldName: путь к исходному файлу
-    :param newName: путь к архиву, без расширения
-    :param funcAfterPercent: вызывается каждый раз после обработки 1% исходного файла
-    :return: (oldSize, newSize, compression)
+    LRU-кэш частот байтов и деревьев для файлов, чтобы архивирование после предпросмотра
+    и повторный предпросмотр не считали частоты заново.
+    Ключ файла: (полный путь, размер, время изменения, inode) - при изменении файла запись не используется.
+    items: OrderedDict {key: {"freq": Freq, "trees": {(canonical, maxCodeLength): HuffTree}}, ...},
+           последние - недавно использованные
+    maxSize: максимальное количество файлов в памяти
+    path: папка для хранения частот на диске (None - только в памяти); на диске хранятся только частоты,
+          деревья строятся по ним заново
     """
 
-    newName += "." + EXTENSION
-    tree = HuffTree(filename=oldName, from_="file")
-    codes = tree.getCodes()
-    with open(oldName, "rb") as oldfile:
-        with open(newName, "wb") as newfile:
-            # Записываем данные об исходном расширении
-            oldExt = pt.getExt(oldName)
-            oldExtLen = len(oldExt)
-            newfile.write(bytes([oldExtLen]))
-            newfile.write(bytes([ord(char) for char in oldExt]))
-
-            # Записываем данные о дереве
-            newfile.write(tree.toBytes())
-
-            # Записываем размер исходного файла в байтах
-            oldFileSize = os.path.getsize(oldName)
-            newfile.write(intToBytes(oldFileSize) + bytes([10]))
-
-            # Записываем архивированные данные
-            chunk_counter = 0
-            nullByte = 0
-            k = 7
-            while True:
-                if not RUN:
-                    return ()
-                chunk = oldfile.read(1)
-                chunk_counter += 1
-                if funcAfterPercent and int(chunk_counter / oldFileSize * 100) - int(
-                        (chunk_counter - 1) / oldFileSize * 100) == 1:
-                    funcAfterPercent()
-                if not chunk:
-                    if k < 7:
-                        newfile.write(bytes([nullByte]))
-                    break
-                byte = ord(chunk)
-                code = codes[byte]
-                for bit in code:
-                    if bit == "1":
-                        nullByte |= (1 << k)
-                    k -= 1
-                    if k < 0:
-                        k = 7
-                        newfile.write(bytes([nullByte]))
-                        nullByte = 0
-    newFileSize = os.path.getsize(newName)
-    return oldFileSize, newFileSize, getCompress(oldFileSize, newFileSize)
+    def __init__(self, maxSize=CACHE_SIZE, path: str = None):
+        self.items = OrderedDict()
+        self.maxSize = maxSize
+        self.path = path
+
+    @staticmethod
+    def getKey(filename: str) -> tuple:
+        stat = os.stat(filename)
+        return os.path.realpath(filename), stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+    def getDiskPath(self, key: tuple) -> str:
+        return os.path.join(self.path, hashlib.sha1(repr(key).encode("utf-8")).hexdigest() + ".json")
+
+    def getFreq(self, filename: str):
+        """
+        :return: Freq для файла или None, если его нет в кэше
+        """
+        key = self.getKey(filename)
+        if key in self.items:
+            self.items.move_to_end(key)
+            return self.items[key]["freq"]
+        if self.path:
+            try:
+                with open(self.getDiskPath(key), "r", encoding="utf-8") as file:
+                    freq = Freq(data=b"")
+                    freq.freq = {byte: count for byte, count in json.load(file)}
+            except (OSError, ValueError):
+                return None
+            self.putFreq(filename, freq, key=key, save=False)
+            return freq
+        return None
+
+    def putFreq(self, filename: str, freq: Freq, key: tuple = None, save=True) -> None:
+        key = key or self.getKey(filename)
+        self.items[key] = {"freq": freq, "trees": {}}
+        self.items.move_to_end(key)
+        while len(self.items) > self.maxSize:
+            self.items.popitem(last=False)
+        if self.path and save:
+            os.makedirs(self.path, exist_ok=True)
+            diskPath = self.getDiskPath(key)
+            with open(diskPath + ".tmp", "w", encoding="utf-8") as file:
+                json.dump(freq.toList(), file)
+            os.replace(diskPath + ".tmp", diskPath)
+
+    def getTree(self, filename: str, canonical=False, maxCodeLength: int = None):
+        """
+        :return: HuffTree для файла (строится по частотам из кэша) или None, если частот файла нет в кэше
+        """
+        freq = self.getFreq(filename)
+        if freq is None:
+            return None
+        trees = self.items[self.getKey(filename)]["trees"]
+        if (canonical, maxCodeLength) not in trees:
+            trees[canonical, maxCodeLength] = HuffTree(filename=filename, from_="freq", freq=freq,
+                                                       canonical=canonical, maxCodeLength=maxCodeLength)
+        return trees[canonical, maxCodeLength]
+
+    def clear(self) -> None:
+        self.items.clear()
 
 
-def toArchiveMany(filenames: tuple[(str, str)], funcAfterFile=None, funcAfterPercent=None) -> list:
+# Общий кэш для preview и toArchive
+CACHE = FreqCache()
+
+
+def getTree(filename: str, funcAfterPercent=None, canonical=False, cancel=None, data=None,
+            maxCodeLength: int = None, progress: Progress = None, freq: Freq = None) -> HuffTree:
     """
-    :param filenames: (("oldName", "newDir/newNameWithoutExt"), ...)
-    :param funcAfterFile: вызывается каждый раз после завершения архивирования очередного файла
-    :param funcAfterPercent: вызывается каждый раз после обработки 1% очередного файла
-    :return: список файлов, которые не удалось архивировать
+    Возвращает дерево для файла из CACHE или строит его и сохраняет в CACHE.
+    :param data: уже считанное содержимое файла (bytes, mmap), чтобы не читать файл для подсчета частот
+    :param freq: уже подсчитанные частоты файла (например, в dictionaryFits), чтобы не считать их заново
+    :param funcAfterPercent: при взятии из кэша вызывается 100 раз сразу
+    """
+    progress = getProgress(progress, funcAfterPercent, cancel)
+    with progress.phase("tree"):
+        tree = CACHE.getTree(filename, canonical, maxCodeLength)
+    if tree is not None:
+        if data is None:
+            progress.begin(1)
+            progress.finish()
+        return tree
+    if freq is None and data is not None:
+        with progress.phase("histogram"):
+            freq = Freq(data=data)
+    elif freq is None:
+        freq = Freq(filename=filename, progress=progress)
+    if progress.isRunning():
+        CACHE.putFreq(filename, freq)
+    with progress.phase("tree"):
+        tree = HuffTree(filename=filename, from_="freq", freq=freq, canonical=canonical, maxCodeLength=maxCodeLength)
+        tree.getCodes()
+    return tree
+
+
+def isIncompressible(tree: HuffTree, size: int) -> bool:
+    """
+    :param tree: HuffTree, построенное по частотам данных
+    :param size: размер данных
+    :return: True, если данные выгоднее хранить без сжатия: энтропия их частот больше RAW_ENTROPY
+             или закодированные данные вместе с деревом не меньше исходных
     """
+    freq = tree.getFreq()
+    if freq is not None and freq.getEntropy() > RAW_ENTROPY:
+        return True
+    return tree.lenInArchive() + tree.lenArchiveData() >= size
 
-    global RUN
-    RUN = True
 
-    errLst = []
-    for i in range(len(filenames)):
-        oldName = filenames[i][0]
-        newName = filenames[i][1]
-        try:
-            toArchive(oldName=oldName, newName=newName, funcAfterPercent=funcAfterPercent)
-        except:
-            errLst.append(oldName)
-        if not RUN:
-            return errLst
-        if funcAfterFile:
-            funcAfterFile()
-    return errLst
+class Dictionary:
+    """
+    Словарь - общие канонические коды для набора файлов, построенные один раз по выборке из них (см. trainDictionary).
+    Архив, закодированный словарем (формат FORMAT_DICT), хранит вместо дерева только id словаря.
+    Файл словаря: DICT_MAGIC, длины кодов (см. HuffTree.lengthsToBytes).
+    id: CRC32 длин кодов
+    tree: HuffTree по длинам кодов; коды есть у всех 256 байтов, поэтому словарем можно закодировать любой файл
+    lengths: список из 256 длин кодов
+    :param filename: путь к файлу словаря
+    """
+
+    def __init__(self, filename: str):
+        with open(filename, "rb") as file:
+            if file.read(len(DICT_MAGIC)) != DICT_MAGIC:
+                raise ValueError("Файл не является словарем")
+            data = file.read()
+        self.id = zlib.crc32(data)
+        lengths = readLengths(io.BytesIO(data))
+        if len(lengths) != 256:
+            raise ValueError("Словарь поврежден")
+        self.tree = HuffTree(filename=None, from_="lengths", lengths=lengths)
+        self.lengths = [lengths[byte] for byte in range(256)]
+
+    def lenArchiveData(self, counts: list) -> int:
+        """
+        :param counts: количество каждого байта в данных (см. countBytes)
+        :return: длина данных, закодированных словарем, в байтах
+        """
+        return ceil(sum(count * length for count, length in zip(counts, self.lengths)) / 8)
 
 
-def intToBytes(n: int) -> bytes:
+@lru_cache(maxsize=16)
+def loadDictionary(filename: str, mtime: float) -> Dictionary:
     """
-    :param n: число
-    :return: объект bytes, в котором каждый байт равен числу-цифре числа n
+    Считывает словарь один раз на процесс (вместе с его кодами и таблицей декодирования).
+    :param mtime: время изменения файла словаря (словарь считывается заново, если файл изменился)
     """
-    return bytes(list(map(int, str(n))))
+    return Dictionary(filename)
 
 
-def bytesToInt(arrOfBytes: bytes) -> int:
+def getDictionary(filename: str) -> Dictionary:
     """
-    Функция, обратная intToBytes
+    :return: Dictionary из файла filename (см. loadDictionary)
     """
-    return int("".join(map(str, list(arrOfBytes))))
+    return loadDictionary(os.path.abspath(filename), os.path.getmtime(filename))
 
 
-def fromArchive(oldName: str, newName: str, funcAfterPercent=None) -> None:
+def trainDictionary(filenames: tuple[str], newName: str, sampleSize=DICT_SAMPLE_SIZE, maxSample=DICT_MAX_SAMPLE,
+                    maxCodeLength: int = MAX_CODE_LENGTH) -> str:
     """
-    Создает файл, полученный из архива.
-    :param oldName: путь к архиву
-    :param newName: путь к извлеченному файлу без расширения
-    :param funcAfterPercent: вызывается каждый раз после обработки 1% архива
+    Строит словарь по частотам байтов выборки из файлов и сохраняет его (см. Dictionary).
+    К частоте каждого байта прибавляется 1, чтобы у всех байтов были коды.
+    :param filenames: файлы корпуса, похожие на те, которые будут архивироваться со словарем
+    :param newName: путь к словарю, без расширения
+    :param sampleSize: количество байтов из начала каждого файла
+    :param maxSample: общий размер выборки
+    :param maxCodeLength: максимальная длина кода (см. HuffTree)
+    :return: путь к словарю
+    """
+    counts = [1] * 256
+    total = 0
+    for filename in filenames:
+        if total >= maxSample:
+            break
+        with open(filename, "rb") as file:
+            data = file.read(min(sampleSize, maxSample - total))
+        counts = [a + b for a, b in zip(counts, countBytes(data))]
+        total += len(data)
+    tree = HuffTree(filename=None, from_="freq", freq=Freq(counts=dict(enumerate(counts))), canonical=True,
+                    maxCodeLength=maxCodeLength)
+    newName += "." + DICT_EXTENSION
+    with open(newName, "wb") as newfile:
+        newfile.write(DICT_MAGIC + tree.lengthsToBytes())
+    return newName
+
+
+def dictionaryFits(dictionary: Dictionary, data, storeRaw=True) -> tuple:
+    """
+    Сравнивает размер архива с кодами словаря и с собственным деревом файла (с каноническими кодами).
+    Дерево строится, только если архив со словарем больше нижней оценки архива с собственным деревом
+    (энтропия частот байтов и минимальная длина данных о кодах).
+    :param data: содержимое файла (bytes или mmap)
+    :param storeRaw: см. writeArchive: словарь не подходит, если данные не сжимаются им
+    :return: (True, если файл выгоднее закодировать словарем; Freq файла - для getTree, если словарь не подошел)
+    """
+    # Частоты считаются так же, как в getTree, чтобы дерево по ним не отличалось от дерева без словаря
+    freq = Freq(data=data)
+    counts = [freq.freq.get(byte, 0) for byte in range(256)]
+    dictLen = 4 + dictionary.lenArchiveData(counts)
+    if storeRaw and dictLen >= len(data):
+        return False, freq
+    used = sum(1 for count in counts if count)
+    lowerBound = ceil(freq.getEntropy() * len(data) / 8) + (1 + 2 * used if used < 128 else 257)
+    if dictLen <= lowerBound:
+        return True, freq
+    tree = HuffTree(filename=None, from_="freq", freq=freq, canonical=True)
+    return dictLen <= tree.lenInArchive() + tree.lenArchiveData(), freq
+
+
+def packCodes(codeLst: list, chunk: bytes, tail: str = "") -> tuple:
     """
+    Кодирует блок данных: коды всех байтов блока склеиваются в одну строку битов,
+    которая переводится в одно длинное целое число и упаковывается в байты за один вызов int.to_bytes.
+    :param codeLst: список из 256 двоичных кодов ("bincode" или None для отсутствующих байтов)
+    :param chunk: блок исходных данных
+    :param tail: биты, оставшиеся от предыдущего блока (меньше 8)
+    :return: (упакованные байты, оставшиеся биты, не составляющие целый байт)
+    """
+    return packBits(tail + "".join(map(codeLst.__getitem__, chunk)))
 
-    tree = HuffTree(filename=oldName, from_="archive")
-    with open(oldName, "rb") as oldfile:
-        oldSize = os.path.getsize(oldName)
 
-        # Считываем расширение исходного файла
-        extLen = ord(oldfile.read(1))
-        ext = "".join([chr(byte) for byte in oldfile.read(extLen)])
+def packBits(bits: str) -> tuple:
+    """
+    :param bits: строка битов
+    :return: (упакованные байты, оставшиеся биты, не составляющие целый байт)
+    """
+    fullLen = len(bits) - len(bits) % 8
+    if not fullLen:
+        return b"", bits
+    return int(bits[:fullLen], 2).to_bytes(fullLen // 8, "big"), bits[fullLen:]
 
-        newName += "." + ext
-        with open(newName, "wb") as newfile:
-            # Пропускаем данные о дереве
-            oldfile.read(tree.lenInArchive())
 
-            # Считываем размер исходного файла в байтах
-            newfilesize = 0
-            while True:
-                byte = ord(oldfile.read(1))
-                if byte == 10:
-                    break
-                newfilesize = newfilesize * 10 + byte
+def unpackCodes(decodeTable: list, chunk: bytes, topID: int) -> tuple:
+    """
+    Функция, обратная packCodes: декодирует блок архива по таблице HuffTree.getDecodeTable.
+    :param topID: вершина, в которой закончилось декодирование предыдущего блока
+    :return: (декодированные байты, вершина, в которой закончилось декодирование)
+    """
+    parts = []
+    for byte in chunk:
+        data, topID = decodeTable[topID][byte]
+        parts.append(data)
+    return b"".join(parts), topID
 
-            # Разархивируем данные
-            chunk_counter = 0
-            topID = tree.getRootID()
-            k_writed = 0
-            breakFlag = False
-            while not breakFlag:
-                if not RUN:
-                    return
-                chunk = oldfile.read(1)
-                chunk_counter += 1
-                if funcAfterPercent and int(chunk_counter / oldSize * 100) - int(
-                        (chunk_counter - 1) / oldSize * 100) == 1:
-                    funcAfterPercent()
-                if not chunk:
-                    break
-                byte = ord(chunk)
-                for k in range(7, -1, -1):
-                    bit = int(byte & (1 << k) > 0)
-                    topID = tree.getNextTopID(topID, bit)
-                    if tree.isLeaf(topID):
-                        newfile.write(bytes([tree.getByte(topID)]))
-                        k_writed += 1
-                        if k_writed == newfilesize:
-                            breakFlag = True
-                            break
-                        topID = tree.getRootID()
-    if k_writed != newfilesize:
-        raise Exception
+
+@lru_cache(maxsize=4096)
+def runTokens(length: int) -> tuple:
+    """
+    :param length: длина серии одинаковых байтов
+    :return: символы повтора (см. RLE_SYMBOL), которые вместе с первым байтом серии кодируют ее
+    """
+    repeats = length - 1
+    tokens = (RLE_SYMBOL + RLE_MAX_SHIFT,) * (repeats >> RLE_MAX_SHIFT)
+    return tokens + tuple(RLE_SYMBOL + shift for shift in range(RLE_MAX_SHIFT) if repeats >> shift & 1)
 
 
-def fromArchiveMany(filenames: tuple[(str, str)], funcAfterFile=None, funcAfterPercent=None) -> list:
+def findRuns(chunk: bytes):
     """
-    Извлекает файлы из архивов.
-    :param filenames: ([oldName, newDir/newNameWithoutExt], ...)
-    :param funcAfterFile: вызывается каждый раз после извлечения из архива очередного файла
-    :param funcAfterPercent: вызывается каждый раз после обработки 1% очередного файла
-    :return: список файлов, которые не удалось извлечь из архива
+    Генератор серий из RLE_MIN_RUN и более одинаковых байтов в блоке данных.
+    Серия ищется по ее началу, а затем продлевается повторением одного байта: поиск серии целиком
+    по обратной ссылке проверял бы каждый ее байт отдельно.
+    :return: (начало серии, конец серии), ...
     """
+    pos = 0
+    match = RUN_START.search(chunk, pos)
+    while match:
+        start = match.start()
+        pos = RUN_BYTES[chunk[start]].match(chunk, start).end()
+        yield start, pos
+        match = RUN_START.search(chunk, pos)
 
-    global RUN
-    RUN = True
 
-    errLst = []
-    for i in range(len(filenames)):
-        oldName = filenames[i][0]
-        newName = filenames[i][1]
+def countRuns(chunk: bytes, counts: list) -> None:
+    """
+    Добавляет к counts количество символов расширенного алфавита в блоке данных: серии из RLE_MIN_RUN
+    и более байтов заменяются первым байтом серии и символами повтора (см. runTokens).
+    :param counts: список из RLE_SYMBOL + RLE_MAX_SHIFT + 1 чисел, индекс - символ
+    """
+    for byte, count in enumerate(countBytes(chunk)):
+        counts[byte] += count
+    for start, end in findRuns(chunk):
+        counts[chunk[start]] -= end - start - 1
+        for token in runTokens(end - start):
+            counts[token] += 1
+
+
+def packRuns(codeLst: list, chunk: bytes, tail: str = "") -> tuple:
+    """
+    Аналог packCodes для расширенного алфавита: серии одинаковых байтов кодируются как в countRuns.
+    :param codeLst: список двоичных кодов для каждого символа расширенного алфавита
+    """
+    parts = [tail]
+    pos = 0
+    for start, end in findRuns(chunk):
+        parts.append("".join(map(codeLst.__getitem__, chunk[pos:start + 1])))
+        parts.extend(map(codeLst.__getitem__, runTokens(end - start)))
+        pos = end
+    parts.append("".join(map(codeLst.__getitem__, chunk[pos:])))
+    return packBits("".join(parts))
+
+
+def lastByte(parts: list, last: int) -> int:
+    """
+    :return: последний байт непустой части из parts или last, если все части пустые
+    """
+    for part in reversed(parts):
+        if part:
+            return part[-1]
+    return last
+
+
+def unpackRuns(decodeTable: list, chunk: bytes, topID: int, last: int, limit: int) -> tuple:
+    """
+    Функция, обратная packRuns: декодирует блок архива по таблице HuffTree.getRunDecodeTable.
+    Декодирование останавливается, как только серии дали не меньше limit байтов,
+    так как один байт архива может содержать серии длиной в несколько мегабайт
+    (без серий байт архива дает не больше 8 байтов, как в unpackCodes).
+    :param topID: вершина, в которой закончилось декодирование предыдущего блока
+    :param last: последний байт, декодированный до блока
+    :return: (декодированные байты, вершина, в которой закончилось декодирование,
+              последний декодированный байт, количество использованных байтов блока)
+    """
+    parts = []
+    size = 0
+    used = 0
+    for used, byte in enumerate(chunk, 1):
+        data, runs, topID = decodeTable[topID][byte]
+        if not runs:
+            parts.append(data)
+            continue
+        pos = 0
+        for runPos, count in runs:
+            parts.append(data[pos:runPos])
+            pos = runPos
+            last = data[runPos - 1] if runPos else lastByte(parts, last)
+            parts.append(bytes([last]) * count)
+            size += count
+        parts.append(data[pos:])
+        if size >= limit:
+            break
+    return b"".join(parts), topID, lastByte(parts, last), used
+
+
+def unpackRunChunks(tree: HuffTree, chunks, size: int):
+    """
+    Генератор декодированных данных архива с расширенным алфавитом (см. writeRle) по блокам архива chunks:
+    выдает (декодированные байты, количество использованных байтов блока архива), не больше CHUNK_SIZE
+    байтов за раз (с точностью до серий из одного байта архива).
+    :param size: размер исходного файла
+    """
+    decodeTable = tree.getRunDecodeTable()
+    topID = tree.getRootID()
+    last = 0
+    written = 0
+    for chunk in chunks:
+        view = memoryview(chunk)
+        pos = 0
+        while pos < len(view) and written < size:
+            data, topID, last, used = unpackRuns(decodeTable, view[pos:], topID, last, CHUNK_SIZE)
+            pos += used
+            data = data[:size - written]
+            written += len(data)
+            yield data, used
+        if written >= size:
+            return
+    raise ValueError("Архив поврежден")
+
+
+def encodeBlock(data: bytes, maxCodeLength: int = None, storeRaw=True) -> bytes:
+    """
+    Кодирует блок исходного файла собственными каноническими кодами.
+    :param maxCodeLength: см. HuffTree
+    :param storeRaw: хранить несжимаемый блок (см. isIncompressible) без сжатия
+    :return: длины кодов (см. HuffTree.lengthsToBytes) и коды, дополненные нулями до целого байта,
+             или нулевой байт и исходный блок (длины кодов не могут начинаться с 0, так как байтов в блоке
+             всегда не меньше 2)
+    """
+    tree = HuffTree(filename=None, from_="freq", freq=Freq(data=data), canonical=True, maxCodeLength=maxCodeLength)
+    if storeRaw and isIncompressible(tree, len(data)):
+        return b"\x00" + bytes(data)
+    codes = tree.getCodes()
+    codeLst = [codes.get(byte) for byte in range(256)]
+    parts = [tree.lengthsToBytes()]
+    tail = ""
+    for pos in range(0, len(data), CHUNK_SIZE):
+        packed, tail = packCodes(codeLst, data[pos:pos + CHUNK_SIZE], tail)
+        parts.append(packed)
+    if tail:
+        parts.append(packCodes(codeLst, b"", tail + "0" * (8 - len(tail)))[0])
+    return b"".join(parts)
+
+
+def decodeBlock(data: bytes, size: int) -> bytes:
+    """
+    Функция, обратная encodeBlock.
+    :param size: размер исходного блока
+    """
+    if data[0] == 0:
+        if len(data) <= size:
+            raise ValueError("Блок архива поврежден")
+        return bytes(data[1:size + 1])
+    # Длины кодов занимают не больше 257 байт
+    file = io.BytesIO(bytes(data[:257]))
+    tree = HuffTree(filename=None, from_="lengths", lengths=readLengths(file))
+    decoded = unpackCodes(tree.getDecodeTable(), memoryview(data)[file.tell():], tree.getRootID())[0]
+    if len(decoded) < size:
+        raise ValueError("Блок архива поврежден")
+    return decoded[:size]
+
+
+def encodeFileBlock(filename: str, offset: int, size: int, maxCodeLength: int = None, storeRaw=True) -> tuple:
+    """
+    Считывает из файла и кодирует блок (для выполнения в процессе-обработчике).
+    :return: (CRC32 исходного блока, закодированный блок)
+    """
+    with open(filename, "rb") as file, mapFile(file) as mapped:
+        if mapped is not None:
+            data = memoryview(mapped)[offset:offset + size]
+        else:
+            file.seek(offset)
+            data = file.read(size)
+        return zlib.crc32(data), encodeBlock(data, maxCodeLength, storeRaw)
+
+
+def decodeFileBlock(filename: str, start: int, end: int, size: int) -> bytes:
+    """
+    Считывает из архива и декодирует блок (для выполнения в процессе-обработчике).
+    :param start: позиция начала блока в архиве
+    :param end: позиция конца блока в архиве
+    :param size: размер исходного блока
+    """
+    with open(filename, "rb") as file, mapFile(file) as mapped:
+        if mapped is not None:
+            return decodeBlock(memoryview(mapped)[start:end], size)
+        file.seek(start)
+        return decodeBlock(file.read(end - start), size)
+
+
+def mapBlocks(func, tasks: list, workers=1):
+    """
+    Генератор результатов func(*task) для каждого task из tasks, в порядке tasks.
+    При workers > 1 блоки обрабатываются в пуле процессов, одновременно в работе не больше 2 * workers блоков.
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield func(*task)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = deque()
         try:
-            fromArchive(oldName=oldName, newName=newName, funcAfterPercent=funcAfterPercent)
-        except:
-            errLst.append(oldName)
-        if not RUN:
-            return errLst
-        if funcAfterFile:
-            funcAfterFile()
-    return errLst
+            for task in tasks:
+                futures.append(executor.submit(func, *task))
+                if len(futures) >= 2 * workers:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def writeBlocks(oldName: str, newfile, blockSize: int, workers=1, funcAfterPercent=None, cancel=None,
+                maxCodeLength: int = None, progress: Progress = None, storeRaw=True) -> bool:
+    """
+    Записывает в архив исходный файл, разбитый на блоки со своими каноническими кодами (формат FORMAT_BLOCKS):
+        заголовок (см. writeHeader) с контрольными суммами блоков, данные формата в нем:
+            размер блока: 4 байта
+            смещения начала каждого блока и конца последнего блока от начала первого блока:
+                8 * ([кол-во блоков] + 1) байт
+        блоки (см. encodeBlock)
+    :param newfile: архив, открытый для записи
+    :param workers: количество процессов, кодирующих блоки параллельно
+    :param maxCodeLength: см. HuffTree
+    :param storeRaw: см. encodeBlock
+    :return: False, если архивирование прервано
+    """
+    progress = getProgress(progress, funcAfterPercent, cancel)
+    oldFileSize = os.path.getsize(oldName)
+    progress.begin(oldFileSize)
+    tasks = [(oldName, offset, min(blockSize, oldFileSize - offset), maxCodeLength, storeRaw)
+             for offset in range(0, oldFileSize, blockSize)]
+    index = bytes(8 * (len(tasks) + 1))
+    checksumsPos = writeHeader(newfile, oldName, FORMAT_BLOCKS, oldFileSize, blockSize.to_bytes(4, "big") + index,
+                               checkSize=blockSize)
+    indexPos = newfile.tell() - len(index)
+
+    offsets = [0]
+    checksums = []
+    blocks = mapBlocks(encodeFileBlock, tasks, workers)
+    try:
+        for task in tasks:
+            # Время ожидания блока от процессов-обработчиков считается временем кодирования
+            with progress.phase("encode"):
+                crc, block = next(blocks)
+            if not progress.isRunning():
+                return False
+            with progress.phase("write"):
+                newfile.write(block)
+            offsets.append(offsets[-1] + len(block))
+            checksums.append(crc)
+            progress.advance(task[2])
+    finally:
+        blocks.close()
+
+    writeChecksums(newfile, checksumsPos, checksums)
+    endPos = newfile.tell()
+    newfile.seek(indexPos)
+    newfile.write(b"".join(offset.to_bytes(8, "big") for offset in offsets))
+    newfile.seek(endPos)
+    return True
+
+
+def readBlockIndex(file, oldFileSize: int = None, dataStart: int = None) -> tuple:
+    """
+    Считывает данные формата архива из блоков (см. writeBlocks).
+    :param file: архив (или данные формата из заголовка), указатель которого стоит на размере блока
+                 или, если oldFileSize не задан, на размере исходного файла (архив версии 1)
+    :param dataStart: позиция первого блока в архиве (по умолчанию - сразу после таблицы смещений)
+    :return: (размер исходного файла, размер блока, [позиция начала каждого блока и конца последнего в архиве])
+    """
+    if oldFileSize is None:
+        oldFileSize = int.from_bytes(file.read(8), "big")
+    blockSize = int.from_bytes(file.read(4), "big")
+    count = ceil(oldFileSize / blockSize)
+    index = file.read(8 * (count + 1))
+    if dataStart is None:
+        dataStart = file.tell()
+    offsets = [dataStart + int.from_bytes(index[i:i + 8], "big") for i in range(0, len(index), 8)]
+    return oldFileSize, blockSize, offsets
+
+
+def extToBytes(filename: str) -> bytes:
+    """
+    :return: данные о расширении файла для сохранения в архив: размер расширения (1 байт) и само расширение
+    """
+    ext = pt.getExt(filename)
+    return bytes([len(ext)]) + bytes([ord(char) for char in ext])
 
 
-def getCompress(oldSize: int, newSize: int) -> float:
+def checksumsLen(oldSize: int, checkSize: int = CHUNK_SIZE) -> int:
     """
-    :param oldSize: размер исходного файла
-    :param newSize: размер архива
-    :return: на сколько процентов уменьшился размер исходного файла при заархивировании
+    :return: длина контрольных сумм в заголовке архива для файла размером oldSize (см. headerToBytes)
     """
-    if oldSize == 0:
-        return -100.0
-    return round(100 - newSize / oldSize * 100, 2)
+    return 4 + 4 * ceil(oldSize / checkSize)
 
 
-def statisticOneFile(filename: str, tree: HuffTree) -> tuple:
+def headerLen(filename: str, formatLen: int = 0, oldSize: int = 0) -> int:
     """
-    Возвращает статистику для файла, который будет добавлен в архив.
-    :param filename: путь к файлу для архивировния
-    :param tree: HuffTree для файла
-    :return: (oldSize, newSize, compression)
+    :param formatLen: длина данных формата
+    :param oldSize: размер исходного файла (для контрольных сумм по CHUNK_SIZE байт)
+    :return: длина заголовка архива версии 2 (см. writeHeader) для файла filename
     """
-    oldSize = os.path.getsize(filename)
-    lenArchiveData = tree.lenArchiveData()
-    newSize = 1 + len(pt.getExt(filename)) + tree.lenInArchive() + len(str(lenArchiveData)) + 1 + lenArchiveData
-    compression = getCompress(oldSize, newSize)
-    return oldSize, newSize, compression
+    return HEADER.size + len(extToBytes(filename)) + checksumsLen(oldSize) + formatLen
 
 
-def statisticManyFiles(filesData: list[(str, HuffTree)]) -> list:
+def headerToBytes(ext: str, fmt: int, oldFileSize: int, formatData: bytes = b"", flags=0, checkSize=0) -> bytes:
     """
-    Возвращает статистику для файлов, которые будут добавлены в архив.
-    :param filesData: [(filename, HuffTree), ...]
-    :return: [(filename, oldSize, newSize, compression), ..., ("ИТОГО", oldSize, newSize, compression)]
+    :param checkSize: размер блока исходного файла, для которого записывается контрольная сумма (0 - без сумм)
+    :return: заголовок архива версии 2:
+        HEADER_MAGIC, версия (1 байт), флаги (1 байт, FLAG_*), формат (1 байт, FORMAT_*),
+        длина заголовка (4 байта), размер исходного файла (8 байт, 0 для FORMAT_STREAM)
+        размер исх. расширения: 1 байт, исх. расширение
+        если checkSize (флаг FLAG_CHECKSUMS): checkSize (4 байта), CRC32 каждого блока по checkSize байт
+            исходного файла (4 * [кол-во блоков] байт, записываются нулями и заполняются writeChecksums)
+        данные формата (дерево, длины кодов, таблица блоков и т.д.)
     """
-    statistic = []
-    sumOldSize = 0
-    sumNewSize = 0
-    for filePath, tree in filesData:
-        oldSize, newSize, compression = statisticOneFile(filename=filePath, tree=tree)
-        statistic.append((filePath, oldSize, newSize, compression))
-        sumOldSize += oldSize
-        sumNewSize += newSize
+    extData = bytes([len(ext)]) + bytes([ord(char) for char in ext])
+    if checkSize:
+        flags |= FLAG_CHECKSUMS
+        extData += checkSize.to_bytes(4, "big") + bytes(checksumsLen(oldFileSize, checkSize) - 4)
+    length = HEADER.size + len(extData) + len(formatData)
+    return HEADER.pack(HEADER_MAGIC, HEADER_VERSION, flags, fmt, length, oldFileSize) + extData + formatData
+
+
+def writeHeader(newfile, oldName: str, fmt: int, oldFileSize: int, formatData: bytes = b"", flags=0,
+                checkSize=0) -> int:
+    """
+    Записывает заголовок архива версии 2 (см. headerToBytes) для исходного файла oldName.
+    :param newfile: архив, открытый для записи, указатель стоит на начале архива
+    :return: позиция контрольных сумм в newfile (см. writeChecksums)
+    """
+    ext = pt.getExt(oldName)
+    checksumsPos = newfile.tell() + HEADER.size + 1 + len(ext) + 4
+    newfile.write(headerToBytes(ext, fmt, oldFileSize, formatData, flags, checkSize))
+    return checksumsPos
+
+
+def writeChecksums(newfile, checksumsPos: int, checksums: list) -> None:
+    """
+    Записывает в заголовок контрольные суммы блоков исходного файла и возвращает указатель в конец архива.
+    :param checksumsPos: результат writeHeader
+    :param checksums: CRC32 каждого блока (см. zlib.crc32)
+    """
+    endPos = newfile.tell()
+    newfile.seek(checksumsPos)
+    newfile.write(b"".join(crc.to_bytes(4, "big") for crc in checksums))
+    newfile.seek(endPos)
+
+
+def unread(file, data: bytes) -> None:
+    """
+    Возвращает считанные данные обратно в file (StreamReader или файл с произвольным доступом).
+    """
+    if isinstance(file, StreamReader):
+        file.unread(data)
+    else:
+        file.seek(file.tell() - len(data))
+
+
+class ArchiveHeader:
+    """
+    Заголовок архива одного файла любой версии. Заголовок версии 2 считывается двумя вызовами read:
+    постоянная часть (HEADER) и остаток заголовка, длина которого в ней записана.
+    version: 1 или 2 (см. writeHeader)
+    flags: FLAG_*
+    format: FORMAT_*
+    size: размер исходного файла (None для FORMAT_STREAM)
+    ext: расширение исходного файла
+    dataStart: позиция данных архива (сразу после заголовка) в file
+    tree: HuffTree для FORMAT_TREE, FORMAT_CANONICAL и FORMAT_RLE (для FORMAT_DICT - см. useDictionary)
+    dictID: id словаря для FORMAT_DICT (см. Dictionary)
+    model: ContextModel для FORMAT_CONTEXT
+    blockSize, offsets: размер блока и позиции блоков в file для FORMAT_BLOCKS (см. readBlockIndex)
+    checkSize, checksums: размер блока и CRC32 блоков исходного файла (None, если флаг FLAG_CHECKSUMS
+                          не установлен или контрольные суммы записаны в блоках FORMAT_STREAM)
+    :param file: архив (бинарный файловый объект или StreamReader), указатель которого стоит на начале архива;
+                 после чтения указатель стоит на dataStart
+    """
+
+    def __init__(self, file):
+        self.version = HEADER_VERSION
+        self.flags = 0
+        self.format = None
+        self.size = None
+        self.ext = ""
+        self.dataStart = None
+        self.tree = None
+        self.model = None
+        self.blockSize = None
+        self.offsets = None
+        self.checkSize = None
+        self.checksums = None
+        self.dictID = None
+
+        start = file.tell()
+        fixed = file.read(HEADER.size)
+        if len(fixed) < HEADER.size or fixed[:len(HEADER_MAGIC)] != HEADER_MAGIC:
+            unread(file, fixed)
+            self.readV1(file)
+            self.dataStart = file.tell()
+            return
+        magic, self.version, self.flags, self.format, length, self.size = HEADER.unpack(fixed)
+        if self.version > HEADER_VERSION:
+            raise ValueError(f"Неподдерживаемая версия архива: {self.version}")
+        rest = file.read(length - HEADER.size)
+        if len(rest) < length - HEADER.size:
+            raise ValueError("Заголовок архива поврежден")
+        self.ext = "".join([chr(byte) for byte in rest[1:1 + rest[0]]])
+        self.dataStart = start + length
+        body = io.BytesIO(rest)
+        body.seek(1 + rest[0])
+        if self.flags & FLAG_CHECKSUMS and self.format != FORMAT_STREAM:
+            self.checkSize = int.from_bytes(body.read(4), "big")
+            if not self.checkSize:
+                raise ValueError("Заголовок архива поврежден")
+            data = body.read(checksumsLen(self.size, self.checkSize) - 4)
+            self.checksums = [int.from_bytes(data[i:i + 4], "big") for i in range(0, len(data), 4)]
+        if self.format in (FORMAT_TREE, FORMAT_CANONICAL, FORMAT_RLE):
+            self.tree = HuffTree(filename=None, from_="archive", file=body)
+        elif self.format == FORMAT_CONTEXT:
+            self.model = ContextModel(from_="archive", file=body)
+        elif self.format == FORMAT_BLOCKS:
+            self.size, self.blockSize, self.offsets = readBlockIndex(body, self.size, self.dataStart)
+        elif self.format == FORMAT_STREAM:
+            self.size = None
+        elif self.format == FORMAT_DICT:
+            self.dictID = int.from_bytes(body.read(4), "big")
+        elif self.format != FORMAT_STORED:
+            raise ValueError(f"Неизвестный формат архива: {self.format}")
+
+    def useDictionary(self, dictionary: str = None) -> None:
+        """
+        Для архива, закодированного словарем (FORMAT_DICT), берет дерево из словаря, на который ссылается архив.
+        :param dictionary: путь к словарю (см. Dictionary)
+        """
+        if self.format != FORMAT_DICT:
+            return
+        if dictionary is None:
+            raise ValueError(f"Архив закодирован словарем {self.dictID:08x}, нужен файл словаря")
+        found = getDictionary(dictionary)
+        if found.id != self.dictID:
+            raise ValueError(f"Архив закодирован словарем {self.dictID:08x}, а не {found.id:08x}")
+        self.tree = found.tree
+
+    def readV1(self, file) -> None:
+        """
+        Считывает заголовок архива версии 1, который записывала исходная версия программы (только FORMAT_TREE):
+        расширение, дерево (см. HuffTree.toBytes) и размер исходного файла (см. readFileSize).
+        """
+        self.version = 1
+        extLen = ord(file.read(1))
+        self.ext = "".join([chr(byte) for byte in file.read(extLen)])
+        self.tree = HuffTree(filename=None, from_="archive", file=file)
+        if self.tree.canonical or self.tree.isExtended():
+            raise ValueError("Заголовок архива поврежден")
+        self.format = FORMAT_TREE
+        self.size = readFileSize(file)
+
+
+class ChecksumError(ValueError):
+    """
+    Контрольная сумма извлеченного блока исходного файла не совпадает с записанной в архиве.
+    block: номер блока
+    start: позиция начала блока в исходном файле
+    """
+
+    def __init__(self, block: int, start: int):
+        super().__init__(f"Блок {block} (с байта {start}) поврежден: контрольная сумма не совпадает")
+        self.block = block
+        self.start = start
+
+
+class Checksums:
+    """
+    Проверяет контрольные суммы блоков исходного файла (см. headerToBytes) по мере извлечения данных.
+    update(data) принимает извлеченные данные по порядку, finish() проверяет последний неполный блок.
+    Обе функции вызывают ChecksumError для первого поврежденного блока.
+    Если в заголовке нет контрольных сумм, ничего не проверяется.
+    :param header: заголовок архива (см. ArchiveHeader)
+    """
+
+    def __init__(self, header: ArchiveHeader):
+        self.checksums = header.checksums
+        self.checkSize = header.checkSize
+        self.block = 0
+        self.crc = 0
+        self.filled = 0
+
+    def update(self, data: bytes) -> None:
+        if self.checksums is None:
+            return
+        view = memoryview(data)
+        pos = 0
+        while pos < len(view):
+            part = view[pos:pos + self.checkSize - self.filled]
+            self.crc = zlib.crc32(part, self.crc)
+            self.filled += len(part)
+            pos += len(part)
+            if self.filled == self.checkSize:
+                self.check()
+
+    def check(self) -> None:
+        if self.block >= len(self.checksums) or self.crc != self.checksums[self.block]:
+            raise ChecksumError(self.block, self.block * self.checkSize)
+        self.block += 1
+        self.crc = 0
+        self.filled = 0
+
+    def finish(self) -> None:
+        if self.checksums is not None and self.filled:
+            self.check()
+
+
+def getSyncPoint(tree: HuffTree, codeLst: list, dataPos: int, symbolPos: int, tail: str, previous: bytes) -> tuple:
+    """
+    Вычисляет состояние декодера на границе байта архива, с которого можно начать декодирование.
+    Биты tail относятся к последним закодированным байтам previous: байты, коды которых целиком лежат в tail,
+    еще не декодированы на границе, а код байта, пересекающего границу, декодирован частично.
+    :param codeLst: список из 256 двоичных кодов
+    :param dataPos: количество полностью записанных байтов данных архива
+    :param symbolPos: количество закодированных байтов исходного файла
+    :param tail: биты, записанные после dataPos (меньше 8)
+    :param previous: последние закодированные байты исходного файла (не меньше 8, если есть)
+    :return: (dataPos, количество байтов исходного файла, полностью декодированных до dataPos,
+              вершина дерева, в которой находится декодер на dataPos)
+    """
+    rest = len(tail)
+    for byte in reversed(previous):
+        if not rest:
+            break
+        code = codeLst[byte]
+        symbolPos -= 1
+        if len(code) > rest:
+            return dataPos, symbolPos, tree.getTopByCode(code[:len(code) - rest])
+        rest -= len(code)
+    return dataPos, symbolPos, tree.getRootID()
+
+
+def syncIndexLen(oldSize: int) -> int:
+    """
+    :return: размер индекса точек синхронизации в архиве с одним деревом для файла размером oldSize
+    """
+    count = ceil(oldSize / CHUNK_SIZE) - 1
+    return count * 18 + 4 + len(SYNC_MAGIC) if count > 0 else 0
+
+
+def readSyncIndex(file, end: int) -> list:
+    """
+    Считывает индекс точек синхронизации (см. writeArchive).
+    :param file: архив
+    :param end: позиция конца архива в файле
+    :return: [(позиция в данных архива, количество байтов исходного файла до нее, вершина дерева), ...]
+             или [], если индекса нет
+    """
+    file.seek(end - 4 - len(SYNC_MAGIC))
+    count = int.from_bytes(file.read(4), "big")
+    if file.read(len(SYNC_MAGIC)) != SYNC_MAGIC:
+        return []
+    file.seek(end - 4 - len(SYNC_MAGIC) - count * 18)
+    data = file.read(count * 18)
+    return [(int.from_bytes(data[i:i + 8], "big"), int.from_bytes(data[i + 8:i + 16], "big"),
+             int.from_bytes(data[i + 16:i + 18], "big")) for i in range(0, len(data), 18)]
+
+
+def pairKey(prev: int, byte: int) -> int:
+    """
+    :return: номер пары (предыдущий байт, байт) - два байта подряд, прочитанные как memoryview.cast("H")
+    """
+    if sys.byteorder == "little":
+        return prev | byte << 8
+    return prev << 8 | byte
+
+
+def splitPairs(chunk: bytes, prev: int) -> tuple:
+    """
+    Разбивает последовательность prev + chunk на пары соседних байтов (см. pairKey) без цикла на Python.
+    :param prev: байт перед первым байтом chunk
+    :return: (пары, начинающиеся с четных позиций, пары, начинающиеся с нечетных позиций) - memoryview "H"
+    """
+    buf = bytes([prev]) + bytes(chunk)
+    evens = memoryview(buf[:len(buf) - len(buf) % 2]).cast("H")
+    odds = memoryview(buf[1:len(buf) - (len(buf) - 1) % 2]).cast("H")
+    return evens, odds
+
+
+def iterPairs(chunk: bytes, prev: int):
+    """
+    :return: итератор номеров пар (см. pairKey) для каждого байта chunk по порядку
+    """
+    evens, odds = splitPairs(chunk, prev)
+    return chain(chain.from_iterable(zip(evens, odds)), evens[len(odds):])
+
+
+def countPairs(chunk: bytes, prev: int, counts: list) -> None:
+    """
+    Добавляет к counts количество пар (предыдущий байт, байт) блока данных.
+    :param counts: список из 65536 чисел, индекс - номер пары (см. pairKey)
+    """
+    for view in splitPairs(chunk, prev):
+        if np is not None:
+            counted = np.bincount(np.frombuffer(view, dtype=np.uint16), minlength=65536)
+            for key in np.flatnonzero(counted).tolist():
+                counts[key] += int(counted[key])
+        else:
+            for key, count in Counter(view).items():
+                counts[key] += count
+
+
+class ContextModel:
+    """
+    Модель порядка 1: каждый байт кодируется каноническими кодами дерева, выбранного по предыдущему байту
+    (контексту); перед первым байтом файла контекст равен 0.
+    Собственное дерево строится для контекста, встречающегося не реже CONTEXT_MIN_COUNT раз, если его коды
+    вместе с длинами кодов короче, чем коды общего дерева; остальные контексты кодируются общим деревом trees[0],
+    построенным по их частотам.
+    trees: [HuffTree, ...] - общее дерево и деревья контекстов по возрастанию контекста
+    contextMap: [номер дерева в trees для каждого из 256 контекстов]
+    counts: частоты пар (см. countPairs) или None, если модель считана из архива
+    decodeRows: таблица декодирования целого байта архива для каждого состояния декодера
+                (номер дерева * 512 + вершина), строится по мере необходимости (см. getDecodeRow)
+    from_: "counts" - по частотам пар counts, "data" - по данным в памяти data, "file" - по файлу filename,
+           "archive" - по открытому архиву file, указатель которого стоит на данных о деревьях
+    """
+
+    def __init__(self, from_: str, counts: list = None, data: bytes = None, filename: str = None, file=None,
+                 progress: Progress = None):
+        assert from_ in ("counts", "data", "file", "archive")
+
+        self.trees = []
+        self.contextMap = [0] * 256
+        self.counts = counts
+        self.decodeRows = None
+        self.decodeRows4 = None
+
+        if from_ == "archive":
+            self.readTables(file)
+            return
+        if from_ == "data":
+            self.counts = [0] * 65536
+            countPairs(data, 0, self.counts)
+        elif from_ == "file":
+            self.counts = [0] * 65536
+            progress = getProgress(progress)
+            progress.begin(os.path.getsize(filename))
+            prev = 0
+            with open(filename, "rb") as file, mapFile(file) as mapped:
+                for chunk in readChunks(file, mapped):
+                    if not progress.isRunning():
+                        return
+                    with progress.phase("histogram"):
+                        countPairs(chunk, prev, self.counts)
+                    prev = chunk[-1]
+                    progress.advance(len(chunk))
+        self.initFromCounts(self.counts)
+
+    def initFromCounts(self, counts: list) -> None:
+        """
+        Выбирает контексты с собственными деревьями и строит деревья.
+        """
+        rows = [{} for _ in range(256)]
+        for prev in range(256):
+            for byte in range(256):
+                count = counts[pairKey(prev, byte)]
+                if count:
+                    rows[prev][byte] = count
+        total = Counter()
+        for row in rows:
+            total.update(row)
+        commonLengths = HuffTree(filename=None, from_="freq", freq=Freq(counts=total)).getCodeLengths()
+
+        own = {}
+        rare = Counter()
+        for prev, row in enumerate(rows):
+            if sum(row.values()) >= CONTEXT_MIN_COUNT:
+                tree = HuffTree(filename=None, from_="freq", freq=Freq(counts=row), canonical=True)
+                lengths = tree.getCodeLengths()
+                ownBits = sum(count * lengths[byte] for byte, count in row.items()) + \
+                    8 * len(tree.lengthsToBytes())
+                if ownBits < sum(count * commonLengths[byte] for byte, count in row.items()):
+                    own[prev] = tree
+                    continue
+            rare.update(row)
+
+        self.trees = [HuffTree(filename=None, from_="freq", freq=Freq(counts=rare or total), canonical=True)]
+        for prev in sorted(own):
+            self.contextMap[prev] = len(self.trees)
+            self.trees.append(own[prev])
+
+    def readTables(self, file) -> None:
+        """
+        Считывает деревья (см. toBytes) из открытого архива.
+        """
+        bitmap = int.from_bytes(file.read(32), "big")
+        self.trees = [HuffTree(filename=None, from_="lengths", lengths=readLengths(file))]
+        for prev in range(256):
+            if bitmap >> (255 - prev) & 1:
+                self.contextMap[prev] = len(self.trees)
+                self.trees.append(HuffTree(filename=None, from_="lengths", lengths=readLengths(file)))
+
+    def toBytes(self) -> bytes:
+        """
+        :return: данные о деревьях для сохранения в архив: битовая маска контекстов с собственными деревьями
+                 (32 байта), длины кодов общего дерева и деревьев контекстов (см. HuffTree.lengthsToBytes)
+        """
+        bitmap = sum(1 << (255 - prev) for prev in range(256) if self.contextMap[prev])
+        return bitmap.to_bytes(32, "big") + b"".join(tree.lengthsToBytes() for tree in self.trees)
+
+    def lenInArchive(self) -> int:
+        return len(self.toBytes())
+
+    def lenArchiveData(self) -> int:
+        """
+        :return: длина закодированных данных в байтах (по частотам пар)
+        """
+        codeLengths = [tree.getCodeLengths() for tree in self.trees]
+        bits = 0
+        for prev in range(256):
+            lengths = codeLengths[self.contextMap[prev]]
+            for byte in range(256):
+                count = self.counts[pairKey(prev, byte)]
+                if count:
+                    bits += count * lengths[byte]
+        return ceil(bits / 8)
+
+    def getPairCodes(self) -> list:
+        """
+        :return: список из 65536 двоичных кодов, индекс - номер пары (см. pairKey), для packCodes
+        """
+        pairCodes = [None] * 65536
+        for prev in range(256):
+            for byte, code in self.trees[self.contextMap[prev]].getCodes().items():
+                pairCodes[pairKey(prev, byte)] = code
+        return pairCodes
+
+    def getRootState(self, prev: int = 0) -> int:
+        """
+        :return: состояние декодера перед байтом, следующим за prev
+        """
+        treeID = self.contextMap[prev]
+        return treeID * 512 + self.trees[treeID].getRootID()
+
+    def getDecodeRow4(self, state: int) -> list:
+        """
+        :return: [(байты, декодированные при проходе 4 битов от состояния state, новое состояние), ... 16]
+        """
+        if self.decodeRows4[state] is not None:
+            return self.decodeRows4[state]
+        row = []
+        for bits in range(16):
+            treeID, topID = divmod(state, 512)
+            tree = self.trees[treeID]
+            data = bytearray()
+            for shift in (3, 2, 1, 0):
+                topID = tree.getNextTopID(topID, bits >> shift & 1)
+                if tree.isLeaf(topID):
+                    data.append(tree.getByte(topID))
+                    treeID = self.contextMap[data[-1]]
+                    tree = self.trees[treeID]
+                    topID = tree.getRootID()
+            row.append((bytes(data), treeID * 512 + topID))
+        self.decodeRows4[state] = row
+        return row
+
+    def getDecodeRow(self, state: int) -> list:
+        """
+        Строит переходы декодера на целый байт архива из двух переходов на 4 бита.
+        Переходы строятся только для состояний, которые встретились при декодировании.
+        :return: [(декодированные байты, новое состояние), ... 256]
+        """
+        if self.decodeRows is None:
+            self.decodeRows = [None] * (len(self.trees) * 512)
+            self.decodeRows4 = [None] * (len(self.trees) * 512)
+        if self.decodeRows[state] is None:
+            self.decodeRows[state] = [(highData + lowData, nextState)
+                                      for highData, middleState in self.getDecodeRow4(state)
+                                      for lowData, nextState in self.getDecodeRow4(middleState)]
+        return self.decodeRows[state]
+
+    def unpackCodes(self, chunk: bytes, state: int) -> tuple:
+        """
+        Аналог unpackCodes для модели порядка 1.
+        :return: (декодированные байты, состояние, в котором закончилось декодирование)
+        """
+        rows = self.decodeRows
+        if rows is None:
+            self.getDecodeRow(state)
+            rows = self.decodeRows
+        parts = []
+        for byte in chunk:
+            row = rows[state]
+            if row is None:
+                row = self.getDecodeRow(state)
+            data, state = row[byte]
+            parts.append(data)
+        return b"".join(parts), state
+
+
+def writeStored(oldName: str, oldData, newfile, progress: Progress) -> bool:
+    """
+    Записывает файл без сжатия (формат FORMAT_STORED, см. writeArchive): заголовок (см. writeHeader) без данных
+    формата, исходный файл. Во всех форматах с одним деревом, как и здесь, контрольные суммы записываются
+    для каждого CHUNK_SIZE исходного файла.
+    :param oldData: содержимое файла (bytes или mmap)
+    :return: False, если архивирование прервано
+    """
+    oldFileSize = len(oldData)
+    progress.begin(oldFileSize)
+    checksumsPos = writeHeader(newfile, oldName, FORMAT_STORED, oldFileSize, checkSize=CHUNK_SIZE)
+    view = memoryview(oldData)
+    checksums = []
+    for pos in range(0, oldFileSize, CHUNK_SIZE):
+        if not progress.isRunning():
+            return False
+        chunk = view[pos:pos + CHUNK_SIZE]
+        checksums.append(zlib.crc32(chunk))
+        with progress.phase("write"):
+            newfile.write(chunk)
+        progress.advance(len(chunk))
+    view.release()
+    writeChecksums(newfile, checksumsPos, checksums)
+    return True
+
+
+def writeContext(oldName: str, oldData, newfile, progress: Progress, storeRaw=True) -> bool:
+    """
+    Записывает архив с моделью порядка 1 (формат FORMAT_CONTEXT):
+        заголовок (см. writeHeader), данные формата в нем - данные о деревьях (см. ContextModel.toBytes)
+        массив байтов
+    :param oldData: содержимое файла (bytes или mmap)
+    :return: False, если архивирование прервано
+    """
+    oldFileSize = len(oldData)
+    with progress.phase("tree"):
+        model = ContextModel(from_="data", data=oldData)
+    if storeRaw and model.lenInArchive() + model.lenArchiveData() >= oldFileSize:
+        return writeStored(oldName, oldData, newfile, progress)
+    with progress.phase("tree"):
+        pairCodes = model.getPairCodes()
+
+    progress.begin(oldFileSize)
+    checksumsPos = writeHeader(newfile, oldName, FORMAT_CONTEXT, oldFileSize, model.toBytes(), checkSize=CHUNK_SIZE)
+    view = memoryview(oldData)
+    checksums = []
+    tail = ""
+    prev = 0
+    for pos in range(0, oldFileSize, CHUNK_SIZE):
+        if not progress.isRunning():
+            return False
+        chunk = view[pos:pos + CHUNK_SIZE]
+        checksums.append(zlib.crc32(chunk))
+        with progress.phase("encode"):
+            data, tail = packCodes(pairCodes, iterPairs(chunk, prev), tail)
+        with progress.phase("write"):
+            newfile.write(data)
+        prev = chunk[-1]
+        progress.advance(len(chunk))
+    if tail:
+        newfile.write(packCodes(pairCodes, b"", tail + "0" * (8 - len(tail)))[0])
+    view.release()
+    writeChecksums(newfile, checksumsPos, checksums)
+    return True
+
+
+def writeRle(oldName: str, oldData, newfile, progress: Progress, storeRaw=True) -> bool:
+    """
+    Записывает архив, в котором серии одинаковых байтов заменены символами повтора (формат FORMAT_RLE):
+        заголовок (см. writeHeader), данные формата в нем - дерево расширенного алфавита (см. HuffTree.toBytes)
+        массив байтов (см. packRuns)
+    Серии не переходят через границы блоков по CHUNK_SIZE байт.
+    :param oldData: содержимое файла (bytes или mmap)
+    :return: False, если архивирование прервано
+    """
+    oldFileSize = len(oldData)
+    view = memoryview(oldData)
+    counts = [0] * (RLE_SYMBOL + RLE_MAX_SHIFT + 1)
+    with progress.phase("histogram"):
+        for pos in range(0, oldFileSize, CHUNK_SIZE):
+            countRuns(view[pos:pos + CHUNK_SIZE], counts)
+    with progress.phase("tree"):
+        tree = HuffTree(filename=oldName, from_="freq", canonical=True,
+                        freq=Freq(counts={symbol: count for symbol, count in enumerate(counts) if count}))
+        codes = tree.getCodes()
+    if storeRaw and tree.lenInArchive() + tree.lenArchiveData() >= oldFileSize:
+        view.release()
+        return writeStored(oldName, oldData, newfile, progress)
+
+    progress.begin(oldFileSize)
+    checksumsPos = writeHeader(newfile, oldName, FORMAT_RLE, oldFileSize, tree.toBytes(), checkSize=CHUNK_SIZE)
+    codeLst = [codes.get(symbol) for symbol in range(len(counts))]
+    checksums = []
+    tail = ""
+    for pos in range(0, oldFileSize, CHUNK_SIZE):
+        if not progress.isRunning():
+            return False
+        chunk = view[pos:pos + CHUNK_SIZE]
+        checksums.append(zlib.crc32(chunk))
+        with progress.phase("encode"):
+            data, tail = packRuns(codeLst, chunk, tail)
+        with progress.phase("write"):
+            newfile.write(data)
+        progress.advance(len(chunk))
+    if tail:
+        newfile.write(packCodes(codeLst, b"", tail + "0" * (8 - len(tail)))[0])
+    view.release()
+    writeChecksums(newfile, checksumsPos, checksums)
+    return True
+
+
+@contextmanager
+def openData(filename: str, data=None):
+    """
+    :param data: уже считанное содержимое файла или None
+    :return: data или содержимое файла filename (mmap или bytes, см. mapFile)
+    """
+    if data is not None:
+        yield data
+        return
+    with open(filename, "rb") as file, mapFile(file) as mapped:
+        yield mapped if mapped is not None else file.read()
+
+
+def writeArchive(oldName: str, newfile, funcAfterPercent=None, canonical=False, cancel=None, blockSize=None,
+                 workers=1, memoryLimit=MEMORY_LIMIT, syncIndex=True, maxCodeLength: int = None,
+                 progress: Progress = None, storeRaw=True, context=False, rle=False, dictionary: str = None,
+                 oldData=None) -> bool:
+    """
+    Записывает архив исходного файла (см. toArchive) в открытый для записи файл с его текущей позиции.
+    Если syncIndex, в конце архива с одним деревом записывается индекс точек синхронизации в начале
+    каждого CHUNK_SIZE исходного файла (кроме первого), а в заголовке устанавливается флаг FLAG_SYNC_INDEX:
+        для каждой точки: позиция в данных архива (8 байт), количество байтов исходного файла,
+            декодированных до нее (8 байт), вершина дерева, в которой находится декодер (2 байта)
+        количество точек (4 байта), SYNC_MAGIC
+    Декодер останавливается после восстановления всех байтов, поэтому индекс не мешает извлечению.
+    Если storeRaw и файл несжимаемый (см. isIncompressible), он записывается без сжатия (см. writeStored).
+    Если context, файл кодируется моделью порядка 1 (см. writeContext), blockSize и memoryLimit не используются.
+    Если rle, серии одинаковых байтов заменяются символами повтора (см. writeRle), blockSize и memoryLimit
+    не используются.
+    Если задан dictionary (путь к словарю) и файл подходит для словаря (см. dictionaryFits), файл кодируется
+    кодами словаря (формат FORMAT_DICT: в заголовке вместо дерева записывается id словаря), иначе - своим деревом.
+    Словарь не используется для архивов из блоков, модели порядка 1 и символов повтора.
+    :param oldData: уже считанное содержимое oldName (см. BatchPipeline); не используется для архива из блоков
+    :return: False, если архивирование прервано
+    """
+    progress = getProgress(progress, funcAfterPercent, cancel)
+    oldFileSize = os.path.getsize(oldName) if oldData is None else len(oldData)
+    if context:
+        with openData(oldName, oldData) as oldData:
+            return writeContext(oldName, oldData, newfile, progress, storeRaw)
+    if rle:
+        with openData(oldName, oldData) as oldData:
+            return writeRle(oldName, oldData, newfile, progress, storeRaw)
+    if not blockSize and oldFileSize > memoryLimit:
+        blockSize = BLOCK_SIZE
+    if blockSize:
+        return writeBlocks(oldName, newfile, blockSize, workers, maxCodeLength=maxCodeLength, progress=progress,
+                           storeRaw=storeRaw)
+
+    with openData(oldName, oldData) as oldData:
+        freq = None
+        if dictionary is not None:
+            with progress.phase("tree"):
+                dictionary = getDictionary(dictionary)
+            with progress.phase("histogram"):
+                fits, freq = dictionaryFits(dictionary, oldData, storeRaw)
+            if not fits:
+                dictionary = None
+        if dictionary is not None:
+            tree = dictionary.tree
+            fmt, formatData = FORMAT_DICT, dictionary.id.to_bytes(4, "big")
+        else:
+            tree = getTree(oldName, canonical=canonical, data=oldData, maxCodeLength=maxCodeLength,
+                           progress=progress, freq=freq)
+            if storeRaw and isIncompressible(tree, oldFileSize):
+                return writeStored(oldName, oldData, newfile, progress)
+            fmt, formatData = FORMAT_CANONICAL if tree.canonical else FORMAT_TREE, tree.toBytes()
+        progress.begin(oldFileSize)
+        codes = tree.getCodes()
+
+        # Записываем заголовок с расширением, размером исходного файла и данными о дереве (или id словаря),
+        # контрольные суммы блоков записываются в него после кодирования
+        syncIndex = syncIndex and oldFileSize > CHUNK_SIZE
+        checksumsPos = writeHeader(newfile, oldName, fmt, oldFileSize, formatData,
+                                   FLAG_SYNC_INDEX if syncIndex else 0, CHUNK_SIZE)
+
+        # Записываем архивированные данные
+        codeLst = [codes.get(byte) for byte in range(256)]
+        view = memoryview(oldData)
+        tail = ""
+        dataPos = 0
+        syncPoints = []
+        checksums = []
+        for pos in range(0, oldFileSize, CHUNK_SIZE):
+            if not progress.isRunning():
+                return False
+            checksums.append(zlib.crc32(view[pos:pos + CHUNK_SIZE]))
+            with progress.phase("encode"):
+                if syncIndex and pos:
+                    syncPoints.append(getSyncPoint(tree, codeLst, dataPos, pos, tail, bytes(view[pos - 8:pos])))
+                data, tail = packCodes(codeLst, view[pos:pos + CHUNK_SIZE], tail)
+            with progress.phase("write"):
+                newfile.write(data)
+            dataPos += len(data)
+            progress.advance(min(CHUNK_SIZE, oldFileSize - pos))
+        if tail:
+            newfile.write(packCodes(codeLst, b"", tail + "0" * (8 - len(tail)))[0])
+        view.release()
+        writeChecksums(newfile, checksumsPos, checksums)
+
+        if syncPoints:
+            newfile.write(b"".join(point[0].to_bytes(8, "big") + point[1].to_bytes(8, "big") +
+                                   point[2].to_bytes(2, "big") for point in syncPoints))
+            newfile.write(len(syncPoints).to_bytes(4, "big") + SYNC_MAGIC)
+    return True
+
+
+def toArchive(oldName: str, newName: str, funcAfterPercent=None, canonical=False, cancel=None, blockSize=None,
+              workers=1, memoryLimit=MEMORY_LIMIT, maxCodeLength: int = None, progress: Progress = None,
+              storeRaw=True, context=False, rle=False, dictionary: str = None) -> tuple:
+    """
+    Создает архив на основе исходного файла.
+    Структура архива:
+        заголовок (см. writeHeader): HEADER_MAGIC, версия, флаги, формат, длина заголовка, размер исходного файла,
+            размер исх. расширения (1 байт), исх. расширение (1 байт - 1 символ),
+            данные о дереве: 2 + 4 * [длина дерева] байт (или длины канонических кодов, см. HuffTree.toBytes)
+        массив байтов
+    Если задан blockSize или размер файла больше memoryLimit, файл записывается блоками (см. writeBlocks).
+    Исходный файл считывается один раз: целиком в память (или отображается в память, см. mapFile) или по блокам,
+    частоты байтов и коды строятся по уже считанным данным.
+    :param oldName: путь к исходному файлу
+    :param newName: путь к архиву, без расширения
+    :param funcAfterPercent: вызывается каждый раз после обработки 1% исходного файла
+    :param canonical: сохранять в архив только длины канонических кодов вместо всего дерева
+    :param cancel: см. isRunning
+    :param blockSize: размер блоков, на которые разбивается файл, каждый со своими кодами
+    :param workers: количество процессов, кодирующих блоки параллельно (только для архива из блоков)
+    :param memoryLimit: максимальный размер файла, который считывается в память целиком
+    :param maxCodeLength: максимальная длина кода (см. HuffTree), например MAX_CODE_LENGTH
+    :param progress: см. Progress (вместо funcAfterPercent и cancel)
+    :param storeRaw: хранить несжимаемые файлы и блоки без сжатия (см. isIncompressible)
+    :param context: кодировать файл моделью порядка 1 (см. ContextModel)
+    :param rle: заменять серии одинаковых байтов символами повтора перед кодированием (см. writeRle)
+    :param dictionary: путь к словарю (см. trainDictionary): подходящий файл кодируется кодами словаря,
+                       и в архив вместо дерева записывается только id словаря (см. writeArchive)
+    :return: (oldSize, newSize, compression)
+    """
+
+    progress = getProgress(progress, funcAfterPercent, cancel)
+    newName += "." + EXTENSION
+    with open(newName, "wb") as newfile:
+        if not writeArchive(oldName, newfile, canonical=canonical, blockSize=blockSize, workers=workers,
+                            memoryLimit=memoryLimit, maxCodeLength=maxCodeLength, progress=progress,
+                            storeRaw=storeRaw, context=context, rle=rle, dictionary=dictionary):
+            return ()
+    oldFileSize = os.path.getsize(oldName)
+    newFileSize = os.path.getsize(newName)
+    return oldFileSize, newFileSize, getCompress(oldFileSize, newFileSize)
+
+
+def initWorker(progressQueue, cancel) -> None:
+    """
+    Инициализирует процесс-обработчик для runMany (и для BatchPipeline - только cancel).
+    """
+    global WORKER_QUEUE, WORKER_CANCEL
+    WORKER_QUEUE = progressQueue
+    WORKER_CANCEL = cancel
+
+
+def runInWorker(func, index: int, oldName: str, newName: str, kwargs: dict) -> dict:
+    """
+    Выполняет func (toArchive или fromArchive) в процессе-обработчике,
+    отправляя сообщения о каждом обработанном 1% файла в очередь WORKER_QUEUE.
+    :return: время фаз обработки (см. Progress.phases)
+    """
+    progress = Progress(funcAfterPercent=lambda: WORKER_QUEUE.put(index), cancel=WORKER_CANCEL)
+    func(oldName=oldName, newName=newName, progress=progress, **kwargs)
+    return progress.phases
+
+
+def runMany(func, filenames: tuple[(str, str)], funcAfterFile=None, funcAfterPercent=None, workers=1,
+            cancel=None, progress: Progress = None, **kwargs) -> list:
+    """
+    Применяет func (toArchive или fromArchive) к каждой паре имен файлов.
+    funcAfterFile вызывается после завершения каждого файла, в том числе не обработанного из-за ошибки.
+    При workers > 1 файлы обрабатываются параллельно в пуле из workers процессов:
+    funcAfterFile вызывается в порядке завершения файлов, а funcAfterPercent - после каждого 1%
+    суммарного размера всех файлов. Отмена передается обработчикам через multiprocessing.Event,
+    так как глобальный флаг RUN в других процессах не виден.
+    :param cancel: см. isRunning
+    :param progress: см. Progress (вместо funcAfterPercent и cancel); при workers > 1 в него прибавляется
+                     время фаз из процессов-обработчиков
+    :param kwargs: дополнительные параметры для func
+    :return: список файлов, которые не удалось обработать (в порядке filenames)
+    """
+    progress = getProgress(progress, funcAfterPercent, cancel)
+    errLst = []
+    if workers <= 1:
+        for oldName, newName in filenames:
+            try:
+                func(oldName=oldName, newName=newName, progress=progress, **kwargs)
+            except:
+                errLst.append(oldName)
+            if not progress.isRunning():
+                return errLst
+            if funcAfterFile:
+                funcAfterFile()
+        return errLst
+
+    progressQueue = mp.Queue()
+    workerCancel = mp.Event()
+    # Ошибка чтения отсутствующего файла учитывается как ошибка обработки этого файла (см. runInWorker)
+    sizes = [os.path.getsize(oldName) if os.path.isfile(oldName) else 0 for oldName, newName in filenames]
+    # Байты каждого файла, учтенные в progress: по сообщениям о каждом 1% файла
+    percents = [0] * len(filenames)
+    progress.begin(sum(sizes))
+    failed = set()
+    with ProcessPoolExecutor(max_workers=workers, initializer=initWorker,
+                             initargs=(progressQueue, workerCancel)) as executor:
+        pending = {executor.submit(runInWorker, func, i, oldName, newName, kwargs): i
+                   for i, (oldName, newName) in enumerate(filenames)}
+        while pending:
+            done, _ = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            if not progress.isRunning() and not workerCancel.is_set():
+                workerCancel.set()
+                for future in pending:
+                    future.cancel()
+            try:
+                while True:
+                    i = progressQueue.get_nowait()
+                    if percents[i] < 100:
+                        percents[i] += 1
+                        progress.advance(sizes[i] * percents[i] // 100 - sizes[i] * (percents[i] - 1) // 100)
+            except queue.Empty:
+                pass
+            for future in done:
+                i = pending.pop(future)
+                progress.advance(sizes[i] - sizes[i] * percents[i] // 100, processed=not future.cancelled())
+                percents[i] = 100
+                if future.cancelled():
+                    continue
+                if future.exception() is not None:
+                    failed.add(i)
+                else:
+                    progress.addPhases(future.result())
+                if funcAfterFile and not workerCancel.is_set():
+                    funcAfterFile()
+            for future in [future for future in pending if future.cancelled()]:
+                pending.pop(future)
+    return [filenames[i][0] for i in sorted(failed)]
+
+
+def readWhole(filename: str, memoryLimit: int, magic: bytes = None):
+    """
+    Считывает файл целиком для конвейера (см. BatchPipeline).
+    :param magic: признак файлов, которые нельзя обработать в памяти (например, CONTAINER_MAGIC)
+    :return: содержимое файла или None, если файл больше memoryLimit или начинается с magic
+    """
+    if os.path.getsize(filename) > memoryLimit:
+        return None
+    with open(filename, "rb") as file:
+        data = file.read()
+    return None if magic and data.startswith(magic) else data
+
+
+def extractedSize(filename: str, blocks=True):
+    """
+    Память для извлечения архива в конвейере (см. BatchPipeline): размер исходного файла из заголовка.
+    :param blocks: извлекать ли архивы из блоков в памяти (False - целиком в пуле, чтобы блоки декодировались
+                   параллельно, см. fromArchive)
+    :return: размер исходного файла или None, если он не записан в заголовке (FORMAT_STREAM), filename -
+             архив-контейнер или архив из блоков при blocks == False
+    """
+    with open(filename, "rb") as file:
+        if file.read(len(CONTAINER_MAGIC)) == CONTAINER_MAGIC:
+            return None
+        file.seek(0)
+        header = ArchiveHeader(file)
+    return None if header.format == FORMAT_BLOCKS and not blocks else header.size
+
+
+def writeWhole(filename: str, data: bytes) -> None:
+    with open(filename, "wb") as file:
+        file.write(data)
+
+
+def archiveToBytes(oldName: str, data: bytes, **kwargs) -> bytes:
+    """
+    Архивирует уже считанное содержимое файла oldName в память (для выполнения в процессе-обработчике).
+    :param kwargs: параметры writeArchive
+    :return: архив
+    """
+    newfile = io.BytesIO()
+    writeArchive(oldName, newfile, oldData=data, **kwargs)
+    return newfile.getvalue()
+
+
+def extractToBytes(oldName: str, data: bytes, dictionary: str = None, cancel=None) -> tuple:
+    """
+    Извлекает файл из уже считанного архива oldName в память (для выполнения в процессе-обработчике).
+    :param cancel: см. isRunning (после прерывания исходный файл неполный)
+    :return: (расширение исходного файла, исходный файл)
+    """
+    decoder = StreamDecoder(io.BytesIO(data), cancel=cancel, dictionary=dictionary)
+    newData = b"".join(decoder)
+    return decoder.ext, newData
+
+
+class BatchPipeline:
+    """
+    Конвейер пакетной обработки файлов на asyncio: чтение одних файлов, обработка других и запись результатов
+    третьих выполняются одновременно, поэтому ожидание диска (или сети) не простаивает процессор, и наоборот.
+        чтение (потоки ввода-вывода) -> очередь считанных файлов (не больше readDepth) ->
+        обработка (workers задач в пуле процессов, при workers <= 1 - в отдельном потоке) ->
+        очередь результатов (не больше writeDepth) -> запись (потоки ввода-вывода)
+    Заполненная очередь останавливает предыдущую стадию. Кроме того, суммарная память (см. size) считанных,
+    но еще не записанных файлов не больше memoryLimit (один файл считывается всегда).
+    Файл, которому нужно больше memoryLimit или для которого read вернул None, обрабатывается функцией direct
+    целиком в пуле, минуя очереди.
+    size(oldName) -> память для обработки файла или None, если ее нельзя оценить: выполняется в потоке
+    ввода-вывода перед read; по умолчанию - размер файла
+    read(oldName) -> данные или None: выполняется в потоке ввода-вывода
+    process(oldName, данные, cancel=cancel) -> результат: выполняется в пуле, поэтому должна сериализоваться (pickle)
+    write(newName, результат): выполняется в потоке ввода-вывода
+    direct(oldName=oldName, newName=newName, cancel=cancel): выполняется в пуле
+    phase: название фазы обработки в progress ("encode" или "decode"); кроме нее учитываются "read" и "write"
+    Прерывание progress останавливает все стадии: файлы в очередях пропускаются, а process и direct получают
+    его через cancel (см. isRunning); результаты прерванной обработки не записываются.
+    """
+
+    def __init__(self, read, process, write, direct, workers=1, readDepth=PIPELINE_DEPTH,
+                 writeDepth=PIPELINE_DEPTH, memoryLimit=MEMORY_LIMIT, ioThreads=PIPELINE_IO_THREADS,
+                 phase="encode", size=None):
+        self.read = read
+        self.size = size
+        self.process = process
+        self.write = write
+        self.direct = direct
+        self.workers = max(workers, 1)
+        self.readDepth = readDepth
+        self.writeDepth = writeDepth
+        self.memoryLimit = memoryLimit
+        self.ioThreads = ioThreads
+        self.phase = phase
+        self.inFlight = 0
+        self.memory = None
+
+    def run(self, filenames: tuple[(str, str)], funcAfterFile=None, progress: Progress = None) -> list:
+        """
+        :param filenames: ((oldName, newName), ...)
+        :param funcAfterFile: вызывается каждый раз после завершения очередного файла (в порядке завершения),
+                              в том числе не обработанного из-за ошибки (как в runMany)
+        :param progress: см. Progress: прогресс считается по размерам завершенных файлов
+        :return: список файлов, которые не удалось обработать (в порядке filenames)
+        """
+        progress = getProgress(progress)
+        # Ошибка чтения отсутствующего файла учитывается как ошибка обработки этого файла
+        sizes = [os.path.getsize(oldName) if os.path.isfile(oldName) else 0 for oldName, newName in filenames]
+        progress.begin(sum(sizes))
+        failed = set()
+
+        def finish(i: int, ok: bool) -> None:
+            progress.advance(sizes[i], processed=ok)
+            if not ok:
+                failed.add(i)
+            if funcAfterFile:
+                funcAfterFile()
+
+        # asyncio импортируется только для конвейера: без него быстрее запуск cli.py
+        import asyncio
+
+        if self.workers > 1:
+            # Процессам-обработчикам cancel передается при запуске (см. initWorker и runCancellable)
+            cancel = mp.Event()
+            pool = ProcessPoolExecutor(self.workers, initializer=initWorker, initargs=(None, cancel))
+            process, direct = partial(runCancellable, self.process), partial(runCancellable, self.direct)
+        else:
+            cancel = threading.Event()
+            pool = ThreadPoolExecutor(1)
+            process, direct = partial(self.process, cancel=cancel), partial(self.direct, cancel=cancel)
+        with pool, ThreadPoolExecutor(self.ioThreads) as ioPool:
+            asyncio.run(self.runAsync(filenames, sizes, pool, ioPool, finish, progress, process, direct, cancel))
+        return [filenames[i][0] for i in sorted(failed)]
+
+    async def timed(self, progress: Progress, name: str, executor, func, *args):
+        """
+        Выполняет func(*args) в executor и прибавляет время ожидания к фазе name.
+        """
+        import asyncio
+
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        finally:
+            progress.addPhases({name: time.perf_counter() - start})
+
+    async def reserve(self, size: int) -> None:
+        """
+        Ждет, пока size байт поместятся в memoryLimit вместе с уже считанными файлами.
+        """
+        async with self.memory:
+            await self.memory.wait_for(lambda: not self.inFlight or self.inFlight + size <= self.memoryLimit)
+            self.inFlight += size
+
+    async def release(self, size: int) -> None:
+        async with self.memory:
+            self.inFlight -= size
+            self.memory.notify_all()
+
+    async def runAsync(self, filenames, sizes: list, pool, ioPool, finish, progress: Progress, process, direct,
+                       cancel) -> None:
+        """
+        :param process, direct: self.process и self.direct с переданным cancel
+        :param cancel: устанавливается при прерывании progress
+        """
+        import asyncio
+
+        self.inFlight = 0
+        self.memory = asyncio.Condition()
+        readQueue = asyncio.Queue(self.readDepth)
+        writeQueue = asyncio.Queue(self.writeDepth)
+
+        async def reader() -> None:
+            for i, (oldName, newName) in enumerate(filenames):
+                if not progress.isRunning():
+                    break
+                try:
+                    if self.size is None:
+                        reserved = sizes[i]
+                    else:
+                        reserved = await self.timed(progress, "read", ioPool, self.size, oldName)
+                except Exception:
+                    finish(i, False)
+                    continue
+                # Файлы, которым нужно больше memoryLimit, не считываются в память (см. direct)
+                if reserved is None or reserved > self.memoryLimit:
+                    await readQueue.put((i, None, 0))
+                    continue
+                await self.reserve(reserved)
+                try:
+                    data = await self.timed(progress, "read", ioPool, self.read, oldName)
+                except Exception:
+                    await self.release(reserved)
+                    finish(i, False)
+                    continue
+                if data is None:
+                    await self.release(reserved)
+                    reserved = 0
+                await readQueue.put((i, data, reserved))
+            for _ in range(self.workers):
+                await readQueue.put(None)
+
+        async def worker() -> None:
+            while True:
+                item = await readQueue.get()
+                if item is None:
+                    return
+                i, data, reserved = item
+                oldName, newName = filenames[i]
+                # После прерывания считанные файлы пропускаются
+                if not progress.isRunning():
+                    await self.release(reserved)
+                    continue
+                if data is None:
+                    try:
+                        await self.timed(progress, self.phase, pool, partial(direct, oldName=oldName, newName=newName))
+                        if progress.isRunning():
+                            finish(i, True)
+                    except Exception:
+                        finish(i, False)
+                    continue
+                try:
+                    result = await self.timed(progress, self.phase, pool, process, oldName, data)
+                except Exception:
+                    await self.release(reserved)
+                    finish(i, False)
+                    continue
+                await writeQueue.put((i, result, reserved))
+
+        async def writer() -> None:
+            while True:
+                item = await writeQueue.get()
+                if item is None:
+                    return
+                i, result, reserved = item
+                # Результат прерванной обработки может быть неполным
+                if not progress.isRunning():
+                    await self.release(reserved)
+                    continue
+                try:
+                    await self.timed(progress, "write", ioPool, self.write, filenames[i][1], result)
+                    finish(i, True)
+                except Exception:
+                    finish(i, False)
+                finally:
+                    await self.release(reserved)
+
+        async def watcher() -> None:
+            while progress.isRunning():
+                await asyncio.sleep(0.1)
+            cancel.set()
+
+        writerTask = asyncio.create_task(writer())
+        watcherTask = asyncio.create_task(watcher())
+        await asyncio.gather(reader(), *(worker() for _ in range(self.workers)))
+        await writeQueue.put(None)
+        await writerTask
+        watcherTask.cancel()
+
+
+def runCancellable(func, *args, **kwargs):
+    """
+    Выполняет func в процессе-обработчике конвейера, передавая ей cancel процесса (см. initWorker, BatchPipeline).
+    """
+    return func(*args, cancel=WORKER_CANCEL, **kwargs)
+
+
+def toArchiveMany(filenames: tuple[(str, str)], funcAfterFile=None, funcAfterPercent=None, canonical=False,
+                  workers=1, cancel=None, blockSize=None, memoryLimit=MEMORY_LIMIT, maxCodeLength: int = None,
+                  progress: Progress = None, storeRaw=True, context=False, rle=False, dictionary: str = None,
+                  pipeline=False, readDepth=PIPELINE_DEPTH, writeDepth=PIPELINE_DEPTH, blockWorkers=1) -> list:
+    """
+    :param filenames: (("oldName", "newDir/newNameWithoutExt"), ...)
+    :param funcAfterFile: вызывается каждый раз после завершения архивирования очередного файла
+    :param funcAfterPercent: вызывается каждый раз после обработки 1% очередного файла
+                             (при workers > 1 - после каждого 1% всех файлов)
+    :param canonical: см. toArchive
+    :param workers: количество процессов, архивирующих файлы параллельно
+    :param blockSize: см. toArchive
+    :param memoryLimit: см. toArchive
+    :param maxCodeLength: см. toArchive
+    :param storeRaw: см. toArchive
+    :param context: см. toArchive
+    :param rle: см. toArchive
+    :param dictionary: см. toArchive
+    :param cancel: см. isRunning
+    :param progress: см. runMany
+    :param pipeline: чтение, кодирование и запись разных файлов выполняются одновременно (см. BatchPipeline);
+                     файлы больше memoryLimit и архивы из блоков (blockSize) кодируются целиком в пуле,
+                     memoryLimit ограничивает также суммарный размер файлов в очередях конвейера
+    :param readDepth, writeDepth: глубина очередей конвейера (см. BatchPipeline)
+    :param blockWorkers: количество процессов, кодирующих блоки одного файла (workers в toArchive, только
+                         с blockSize); workers задает только количество файлов, архивируемых одновременно
+    :return: список файлов, которые не удалось архивировать
+    """
+
+    global RUN
+    RUN = True
+
+    if pipeline:
+        options = dict(canonical=canonical, blockSize=blockSize, memoryLimit=memoryLimit, maxCodeLength=maxCodeLength,
+                       storeRaw=storeRaw, context=context, rle=rle, dictionary=dictionary, workers=blockWorkers)
+        engine = BatchPipeline(read=partial(readWhole, memoryLimit=0 if blockSize else memoryLimit),
+                               process=partial(archiveToBytes, **options),
+                               write=lambda newName, data: writeWhole(newName + "." + EXTENSION, data),
+                               direct=partial(toArchive, **options), workers=workers, readDepth=readDepth,
+                               writeDepth=writeDepth, memoryLimit=memoryLimit, phase="encode")
+        return engine.run(filenames, funcAfterFile, getProgress(progress, funcAfterPercent, cancel))
+    return runMany(partial(toArchive, workers=blockWorkers), filenames, funcAfterFile=funcAfterFile,
+                   funcAfterPercent=funcAfterPercent, workers=workers, cancel=cancel, progress=progress,
+                   canonical=canonical, blockSize=blockSize, memoryLimit=memoryLimit, maxCodeLength=maxCodeLength,
+                   storeRaw=storeRaw, context=context, rle=rle, dictionary=dictionary)
+
+
+def intToBytes(n: int) -> bytes:
+    """
+    :param n: число
+    :return: объект bytes, в котором каждый байт равен числу-цифре числа n
+    """
+    return bytes(list(map(int, str(n))))
+
+
+def bytesToInt(arrOfBytes: bytes) -> int:
+    """
+    Функция, обратная intToBytes
+    """
+    return int("".join(map(str, list(arrOfBytes))))
+
+
+def readFileSize(file) -> int:
+    """
+    Считывает размер исходного файла, записанный в архив как intToBytes(size) + bytes([10]).
+    :param file: архив, указатель которого стоит на начале записи о размере
+    """
+    size = 0
+    while True:
+        byte = ord(file.read(1))
+        if byte == 10:
+            return size
+        size = size * 10 + byte
+
+
+def readBlocks(oldName: str, header: ArchiveHeader, newfile, workers=1, funcAfterPercent=None, cancel=None,
+               progress: Progress = None, oldfile=None, mapped=None) -> None:
+    """
+    Извлекает файл из архива, разбитого на блоки (см. writeBlocks), проверяя контрольные суммы блоков.
+    :param header: заголовок архива (см. ArchiveHeader)
+    :param newfile: извлекаемый файл, открытый для записи
+    :param workers: количество процессов, декодирующих блоки параллельно
+    :param oldfile: открытый архив, из которого блоки декодируются без открытия архива заново при workers <= 1
+    :param mapped: результат mapFile(oldfile)
+    """
+    progress = getProgress(progress, funcAfterPercent, cancel)
+    offsets = header.offsets
+    tasks = [(oldName, offsets[i], offsets[i + 1], min(header.blockSize, header.size - i * header.blockSize))
+             for i in range(len(offsets) - 1)]
+    progress.begin(os.path.getsize(oldName), offsets[0])
+    if oldfile is not None and workers <= 1:
+        blocks = (decodeBlock(readAt(oldfile, mapped, start, end - start), size) for _, start, end, size in tasks)
+    else:
+        blocks = mapBlocks(decodeFileBlock, tasks, workers)
+    checksums = Checksums(header)
+    try:
+        for task in tasks:
+            with progress.phase("decode"):
+                data = next(blocks)
+            if not progress.isRunning():
+                return
+            with progress.phase("check"):
+                checksums.update(data)
+            with progress.phase("write"):
+                newfile.write(data)
+            progress.advance(task[2] - task[1])
+        checksums.finish()
+    finally:
+        blocks.close()
+
+
+def fromArchive(oldName: str, newName: str, funcAfterPercent=None, cancel=None, workers=1,
+                progress: Progress = None, dictionary: str = None) -> None:
+    """
+    Создает файл, полученный из архива.
+    Архив открывается один раз, его заголовок считывается целиком (см. ArchiveHeader).
+    Если в архиве записаны контрольные суммы, извлеченные данные проверяются по ним (см. ChecksumError).
+    :param oldName: путь к архиву
+    :param newName: путь к извлеченному файлу без расширения
+    :param funcAfterPercent: вызывается каждый раз после обработки 1% архива
+    :param cancel: см. isRunning
+    :param workers: количество процессов, декодирующих блоки параллельно (для архивов из блоков)
+    :param progress: см. Progress (вместо funcAfterPercent и cancel)
+    :param dictionary: путь к словарю, которым закодирован архив (см. toArchive)
+    Если oldName - архив-контейнер, все файлы из него извлекаются в папку newName (см. fromContainer).
+    """
+
+    progress = getProgress(progress, funcAfterPercent, cancel)
+    with open(oldName, "rb") as oldfile, mapFile(oldfile) as mapped:
+        if oldfile.read(len(CONTAINER_MAGIC)) == CONTAINER_MAGIC:
+            errLst = fromContainer(oldName, newName, progress=progress, dictionary=dictionary)
+            if errLst:
+                raise ValueError(f"Не удалось извлечь файлы: {', '.join(errLst)}")
+            return
+        oldfile.seek(0)
+        oldSize = os.path.getsize(oldName)
+
+        with progress.phase("tree"):
+            header = ArchiveHeader(oldfile)
+            header.useDictionary(dictionary)
+        newName += "." + header.ext
+        newfilesize = header.size
+        if header.format == FORMAT_BLOCKS:
+            with open(newName, "wb") as newfile:
+                readBlocks(oldName, header, newfile, workers, progress=progress, oldfile=oldfile, mapped=mapped)
+            return
+        if header.format == FORMAT_STREAM:
+            oldfile.seek(0)
+            progress.begin(oldSize)
+            with open(newName, "wb") as newfile:
+                for data in StreamDecoder(oldfile, progress):
+                    with progress.phase("write"):
+                        newfile.write(data)
+                    progress.advance(oldfile.tell() - progress.done)
+                progress.finish()
+            return
+        checksums = Checksums(header)
+        if header.format == FORMAT_RLE:
+            progress.begin(oldSize, oldfile.tell())
+            k_writed = 0
+            with open(newName, "wb") as newfile:
+                decoded = unpackRunChunks(header.tree, readChunks(oldfile, mapped), newfilesize)
+                while progress.isRunning():
+                    with progress.phase("decode"):
+                        data, used = next(decoded, (None, 0))
+                    if data is None:
+                        break
+                    with progress.phase("check"):
+                        checksums.update(data)
+                    with progress.phase("write"):
+                        newfile.write(data)
+                    k_writed += len(data)
+                    progress.advance(used)
+            if not progress.isRunning():
+                return
+            if k_writed != newfilesize:
+                raise ValueError("Размер извлеченного файла не совпадает с исходным")
+            checksums.finish()
+            return
+
+        progress.begin(oldSize, oldfile.tell())
+        k_writed = 0
+        with open(newName, "wb") as newfile:
+            if header.format == FORMAT_STORED:
+                for chunk in readChunks(oldfile, mapped):
+                    if not progress.isRunning():
+                        return
+                    chunk = chunk[:newfilesize - k_writed]
+                    with progress.phase("check"):
+                        checksums.update(chunk)
+                    with progress.phase("write"):
+                        newfile.write(chunk)
+                    k_writed += len(chunk)
+                    progress.advance(len(chunk))
+            else:
+                # Разархивируем данные: по таблице за один шаг декодируется целый байт архива,
+                # результат записывается одним блоком на каждый считанный блок архива.
+                # Биты-заполнители в конце последнего байта могут дать лишние байты, поэтому результат обрезается
+                if header.format == FORMAT_CONTEXT:
+                    state = header.model.getRootState()
+                    unpack = header.model.unpackCodes
+                else:
+                    with progress.phase("tree"):
+                        decodeTable = header.tree.getDecodeTable()
+                    state = header.tree.getRootID()
+
+                    def unpack(chunk: bytes, topID: int) -> tuple:
+                        return unpackCodes(decodeTable, chunk, topID)
+
+                for chunk in readChunks(oldfile, mapped):
+                    if not progress.isRunning():
+                        return
+                    if k_writed >= newfilesize:
+                        break
+                    with progress.phase("decode"):
+                        data, state = unpack(chunk, state)
+                    data = data[:newfilesize - k_writed]
+                    with progress.phase("check"):
+                        checksums.update(data)
+                    with progress.phase("write"):
+                        newfile.write(data)
+                    k_writed += len(data)
+                    progress.advance(len(chunk))
+    if k_writed != newfilesize:
+        raise ValueError("Размер извлеченного файла не совпадает с исходным")
+    checksums.finish()
+
+
+class StreamReader:
+    """
+    Обертка над источником данных для потокового чтения архивов.
+    src: бинарный файловый объект (файл, sys.stdin.buffer, канал процесса, socket.makefile("rb"))
+         или итератор блоков байтов
+    read(size) всегда возвращает ровно size байтов (меньше - только в конце данных),
+    unread(data) возвращает прочитанные данные обратно, tell() - количество прочитанных байтов.
+    """
+
+    def __init__(self, src):
+        self.file = src if hasattr(src, "read") else None
+        self.chunks = None if self.file else iter(src)
+        self.buffer = bytearray()
+        self.pos = 0
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self.buffer) < size:
+            if self.file:
+                chunk = self.file.read(CHUNK_SIZE if size < 0 else max(size - len(self.buffer), 0))
+            else:
+                chunk = next(self.chunks, b"")
+            if not chunk:
+                break
+            self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.pos += len(data)
+        return data
+
+    def unread(self, data: bytes) -> None:
+        self.buffer[:0] = data
+        self.pos -= len(data)
+
+    def tell(self) -> int:
+        return self.pos
+
+
+class StreamEncoder:
+    """
+    Потоковое архивирование без обращения к файловой системе.
+    Исходные данные читаются блоками по blockSize байт из src (бинарный файловый объект или итератор блоков байтов),
+    каждый блок кодируется своими каноническими кодами, поэтому память не зависит от размера данных.
+    Итерирование по объекту выдает байты архива (формат FORMAT_STREAM):
+        заголовок (см. headerToBytes) без размера исходного файла и данных формата, с флагом FLAG_CHECKSUMS
+        блоки: размер исходного блока (4 байта), размер закодированного блока (4 байта),
+            CRC32 исходного блока (4 байта), блок (см. encodeBlock)
+        4 нулевых байта - конец архива (записываются, только если src прочитан до конца; архив прерванного
+        архивирования без них считается поврежденным, см. readStreamBlock)
+    """
+
+    def __init__(self, src, ext: str = "", blockSize=BLOCK_SIZE, cancel=None):
+        self.src = StreamReader(src)
+        self.ext = ext
+        self.blockSize = blockSize
+        self.cancel = cancel
+
+    def __iter__(self):
+        yield headerToBytes(self.ext, FORMAT_STREAM, 0, flags=FLAG_CHECKSUMS)
+        while isRunning(self.cancel):
+            data = self.src.read(self.blockSize)
+            if not data:
+                yield bytes(4)
+                return
+            block = encodeBlock(data)
+            yield len(data).to_bytes(4, "big") + len(block).to_bytes(4, "big") + \
+                zlib.crc32(data).to_bytes(4, "big") + block
+
+
+def readExactly(file, size: int) -> bytes:
+    """
+    :return: size байт из file
+    :raise ValueError: архив закончился раньше (обрезан)
+    """
+    data = file.read(size)
+    if len(data) < size:
+        raise ValueError("Архив поврежден")
+    return data
+
+
+def readStreamBlock(file, flags: int):
+    """
+    Считывает заголовок очередного блока FORMAT_STREAM (см. StreamEncoder).
+    Конец архива - только полный маркер из 4 нулевых байтов: архив, обрезанный в любом месте (в том числе
+    на границе блоков), считается поврежденным, а не коротким.
+    :param flags: флаги заголовка архива (FLAG_CHECKSUMS)
+    :return: (размер исходного блока, размер закодированного блока, CRC32 блока или None) или None в конце архива
+    """
+    size = int.from_bytes(readExactly(file, 4), "big")
+    if not size:
+        return None
+    blockLen = int.from_bytes(readExactly(file, 4), "big")
+    crc = int.from_bytes(readExactly(file, 4), "big") if flags & FLAG_CHECKSUMS else None
+    return size, blockLen, crc
+
+
+class StreamDecoder:
+    """
+    Потоковое извлечение данных из архива любого формата.
+    Архив читается последовательно из src (бинарный файловый объект или итератор блоков байтов),
+    итерирование по объекту выдает извлеченные данные блоками. Если в архиве записаны контрольные суммы,
+    данные проверяются по ним (см. ChecksumError), а в конце проверяется размер извлеченного файла.
+    ext: расширение исходного файла (известно после начала итерирования)
+    dictionary: путь к словарю, которым закодирован архив (см. toArchive)
+    """
+
+    def __init__(self, src, cancel=None, dictionary: str = None):
+        self.src = src if isinstance(src, StreamReader) else StreamReader(src)
+        self.cancel = cancel
+        self.dictionary = dictionary
+        self.ext = None
+
+    def __iter__(self):
+        header = ArchiveHeader(self.src)
+        header.useDictionary(self.dictionary)
+        self.ext = header.ext
+
+        if header.format == FORMAT_BLOCKS:
+            decoded = self.iterBlocks(header)
+        elif header.format == FORMAT_STREAM:
+            yield from self.iterStream(header)
+            return
+        elif header.format == FORMAT_STORED:
+            decoded = self.iterStored(header.size)
+        elif header.format == FORMAT_CONTEXT:
+            decoded = self.iterContext(header.model, header.size)
+        elif header.format == FORMAT_RLE:
+            decoded = self.iterRuns(header.tree, header.size)
+        else:
+            decoded = self.iterCodes(header.tree, header.size)
+
+        checksums = Checksums(header)
+        k_writed = 0
+        for data in decoded:
+            checksums.update(data)
+            k_writed += len(data)
+            yield data
+        if not isRunning(self.cancel):
+            return
+        if k_writed != header.size:
+            raise ValueError("Размер извлеченного файла не совпадает с исходным")
+        checksums.finish()
+
+    def iterCodes(self, tree: HuffTree, newfilesize: int):
+        """
+        Декодирует данные архива с одним деревом для всего файла.
+        """
+        decodeTable = tree.getDecodeTable()
+        topID = tree.getRootID()
+        k_writed = 0
+        while k_writed < newfilesize and isRunning(self.cancel):
+            chunk = self.src.read(CHUNK_SIZE)
+            if not chunk:
+                raise ValueError("Архив поврежден")
+            data, topID = unpackCodes(decodeTable, chunk, topID)
+            data = data[:newfilesize - k_writed]
+            k_writed += len(data)
+            yield data
+
+    def iterContext(self, model: ContextModel, newfilesize: int):
+        """
+        Декодирует архив с моделью порядка 1 (см. writeContext).
+        """
+        state = model.getRootState()
+        k_writed = 0
+        while k_writed < newfilesize and isRunning(self.cancel):
+            chunk = self.src.read(CHUNK_SIZE)
+            if not chunk:
+                raise ValueError("Архив поврежден")
+            data, state = model.unpackCodes(chunk, state)
+            data = data[:newfilesize - k_writed]
+            k_writed += len(data)
+            yield data
+
+    def iterRuns(self, tree: HuffTree, newfilesize: int):
+        """
+        Декодирует архив с символами повтора (см. writeRle).
+        """
+        chunks = iter(lambda: self.src.read(CHUNK_SIZE), b"")
+        for data, used in unpackRunChunks(tree, chunks, newfilesize):
+            if not isRunning(self.cancel):
+                return
+            yield data
+
+    def iterStored(self, newfilesize: int):
+        """
+        Выдает исходный файл, хранящийся без сжатия (см. writeStored).
+        """
+        k_writed = 0
+        while k_writed < newfilesize and isRunning(self.cancel):
+            data = self.src.read(min(CHUNK_SIZE, newfilesize - k_writed))
+            if not data:
+                raise ValueError("Архив поврежден")
+            k_writed += len(data)
+            yield data
+
+    def iterBlocks(self, header: ArchiveHeader):
+        """
+        Декодирует архив из блоков (см. writeBlocks).
+        """
+        offsets = header.offsets
+        for i in range(len(offsets) - 1):
+            if not isRunning(self.cancel):
+                return
+            yield decodeBlock(self.src.read(offsets[i + 1] - offsets[i]),
+                              min(header.blockSize, header.size - i * header.blockSize))
+
+    def iterStream(self, header: ArchiveHeader):
+        """
+        Декодирует поток блоков (см. StreamEncoder), проверяя контрольные суммы блоков, если они записаны.
+        """
+        symbolPos = 0
+        block = 0
+        while isRunning(self.cancel):
+            blockHeader = readStreamBlock(self.src, header.flags)
+            if blockHeader is None:
+                return
+            size, blockLen, crc = blockHeader
+            data = decodeBlock(readExactly(self.src, blockLen), size)
+            if crc is not None and zlib.crc32(data) != crc:
+                raise ChecksumError(block, symbolPos)
+            symbolPos += size
+            block += 1
+            yield data
+
+
+def compressStream(src, dst, ext: str = "", blockSize=BLOCK_SIZE, cancel=None) -> None:
+    """
+    Архивирует данные из src в dst (бинарные файловые объекты; src может быть итератором блоков байтов).
+    """
+    for data in StreamEncoder(src, ext=ext, blockSize=blockSize, cancel=cancel):
+        dst.write(data)
+
+
+def decompressStream(src, dst, cancel=None, dictionary: str = None) -> str:
+    """
+    Извлекает данные из архива src в dst (бинарные файловые объекты; src может быть итератором блоков байтов).
+    :param dictionary: см. StreamDecoder
+    :return: расширение исходного файла
+    """
+    decoder = StreamDecoder(src, cancel=cancel, dictionary=dictionary)
+    for data in decoder:
+        dst.write(data)
+    return decoder.ext
+
+
+def isContainer(filename: str) -> bool:
+    """
+    :return: True, если файл - архив-контейнер (см. toContainer)
+    """
+    with open(filename, "rb") as file:
+        return file.read(len(CONTAINER_MAGIC)) == CONTAINER_MAGIC
+
+
+def toContainer(filenames: tuple[str], newName: str, funcAfterFile=None, funcAfterPercent=None, canonical=False,
+                cancel=None, blockSize=None, memoryLimit=MEMORY_LIMIT, maxCodeLength: int = None,
+                progress: Progress = None, storeRaw=True, context=False, rle=False, dictionary: str = None,
+                workers=1) -> list:
+    """
+    Создает один архив-контейнер для нескольких файлов.
+    Структура контейнера:
+        CONTAINER_MAGIC
+        архивы файлов (как в toArchive) друг за другом, в начале каждого - его расширение и коды
+        центральный каталог: количество файлов (4 байта), для каждого файла: длина имени (2 байта),
+            имя (utf-8), размер исходного файла (8 байт), смещение архива файла (8 байт), размер архива файла (8 байт)
+        смещение каталога (8 байт), CONTAINER_MAGIC
+    Одинаковые имена файлов дополняются номером: "name (1).ext".
+    :param filenames: ("oldName", ...)
+    :param newName: путь к контейнеру, без расширения
+    :param funcAfterFile: вызывается каждый раз после завершения архивирования очередного файла
+    :param funcAfterPercent: вызывается каждый раз после обработки 1% очередного файла
+    :param canonical, cancel, blockSize, workers, memoryLimit, maxCodeLength, progress, storeRaw, context, rle,
+           dictionary: см. toArchive
+    :return: список файлов, которые не удалось архивировать
+    """
+
+    global RUN
+    RUN = True
+
+    progress = getProgress(progress, funcAfterPercent, cancel)
+    newName += "." + CONTAINER_EXTENSION
+    errLst = []
+    directory = []
+    names = set()
+    with open(newName, "wb") as newfile:
+        newfile.write(CONTAINER_MAGIC)
+        for oldName in filenames:
+            name = os.path.basename(oldName)
+            counter = 1
+            while name in names:
+                stem, ext = os.path.splitext(os.path.basename(oldName))
+                name = f"{stem} ({counter}){ext}"
+                counter += 1
+            start = newfile.tell()
+            try:
+                done = writeArchive(oldName, newfile, canonical=canonical, blockSize=blockSize, workers=workers,
+                                    memoryLimit=memoryLimit, maxCodeLength=maxCodeLength, progress=progress,
+                                    storeRaw=storeRaw, context=context, rle=rle, dictionary=dictionary)
+            except:
+                errLst.append(oldName)
+                done = False
+            if done:
+                names.add(name)
+                directory.append((name, os.path.getsize(oldName), start, newfile.tell() - start))
+            else:
+                newfile.seek(start)
+                newfile.truncate()
+            if not progress.isRunning():
+                break
+            if funcAfterFile:
+                funcAfterFile()
+
+        directoryPos = newfile.tell()
+        newfile.write(len(directory).to_bytes(4, "big"))
+        for name, oldSize, start, length in directory:
+            encodedName = name.encode("utf-8")
+            newfile.write(len(encodedName).to_bytes(2, "big") + encodedName + oldSize.to_bytes(8, "big") +
+                          start.to_bytes(8, "big") + length.to_bytes(8, "big"))
+        newfile.write(directoryPos.to_bytes(8, "big") + CONTAINER_MAGIC)
+    return errLst
+
+
+def listContainer(filename: str) -> list:
+    """
+    Считывает центральный каталог контейнера, не читая архивы файлов.
+    :return: [(name, oldSize, start, length), ...], где start и length - смещение и размер архива файла в контейнере
+    """
+    with open(filename, "rb") as file:
+        if file.read(len(CONTAINER_MAGIC)) != CONTAINER_MAGIC:
+            raise ValueError("Файл не является архивом-контейнером")
+        file.seek(-8 - len(CONTAINER_MAGIC), os.SEEK_END)
+        directoryPos = int.from_bytes(file.read(8), "big")
+        if file.read(len(CONTAINER_MAGIC)) != CONTAINER_MAGIC:
+            raise ValueError("Каталог архива-контейнера поврежден")
+        file.seek(directoryPos)
+        directory = []
+        for _ in range(int.from_bytes(file.read(4), "big")):
+            name = file.read(int.from_bytes(file.read(2), "big")).decode("utf-8")
+            oldSize, start, length = (int.from_bytes(file.read(8), "big") for _ in range(3))
+            directory.append((name, oldSize, start, length))
+    return directory
+
+
+def fromContainer(oldName: str, newDir: str, names=None, funcAfterFile=None, funcAfterPercent=None,
+                  cancel=None, progress: Progress = None, dictionary: str = None) -> list:
+    """
+    Извлекает файлы из архива-контейнера. Архив каждого файла находится по смещению из центрального каталога,
+    остальные архивы не читаются.
+    :param oldName: путь к контейнеру
+    :param newDir: папка для извлеченных файлов (создается при необходимости)
+    :param names: имена файлов для извлечения (см. listContainer), None - все файлы
+    :param funcAfterFile: вызывается каждый раз после извлечения очередного файла
+    :param funcAfterPercent: вызывается каждый раз после обработки 1% архива очередного файла
+    :param cancel: см. isRunning
+    :param progress: см. Progress (вместо funcAfterPercent и cancel)
+    :param dictionary: см. fromArchive
+    :return: список имен файлов, которые не удалось извлечь (в том числе имена из names, которых нет в контейнере)
+    """
+    progress = getProgress(progress, funcAfterPercent, cancel)
+    directory = [member for member in listContainer(oldName) if names is None or member[0] in names]
+    os.makedirs(newDir, exist_ok=True)
+    found = {member[0] for member in directory}
+    errLst = [name for name in names if name not in found] if names is not None else []
+    with open(oldName, "rb") as oldfile, mapFile(oldfile) as mapped:
+        for name, oldSize, start, length in directory:
+            try:
+                if mapped is not None:
+                    view = memoryview(mapped)[start:start + length]
+                    chunks = (view[pos:pos + CHUNK_SIZE] for pos in range(0, length, CHUNK_SIZE))
+                else:
+                    oldfile.seek(start)
+                    chunks = (oldfile.read(min(CHUNK_SIZE, start + length - pos))
+                              for pos in range(start, start + length, CHUNK_SIZE))
+                reader = StreamReader(chunks)
+                written = 0
+                progress.begin(length)
+                with open(os.path.join(newDir, os.path.basename(name)), "wb") as newfile:
+                    for data in StreamDecoder(reader, progress, dictionary):
+                        with progress.phase("write"):
+                            newfile.write(data)
+                        written += len(data)
+                        progress.advance(reader.tell() - progress.done)
+                    progress.finish()
+                if written != oldSize:
+                    raise ValueError("Размер извлеченного файла не совпадает с исходным")
+            except:
+                errLst.append(name)
+            if not progress.isRunning():
+                return errLst
+            if funcAfterFile:
+                funcAfterFile()
+    return errLst
+
+
+def readRange(oldName: str, start: int, size: int, member: str = None, dictionary: str = None) -> bytes:
+    """
+    Возвращает байты start..start + size - 1 исходного файла, декодируя только нужную часть архива:
+        архив из блоков - только блоки, в которые попадает диапазон (по таблице смещений блоков);
+        поток блоков - только нужные блоки, остальные пропускаются по их размерам;
+        архив с одним деревом - от ближайшей точки синхронизации до конца диапазона
+            (без индекса точек синхронизации - от начала данных до конца диапазона);
+        файл без сжатия - только сам диапазон;
+        модель порядка 1 и архив с символами повтора - от начала данных до конца диапазона.
+    :param oldName: путь к архиву или к архиву-контейнеру
+    :param member: имя файла в архиве-контейнере (см. listContainer)
+    :param dictionary: см. fromArchive
+    :return: байты исходного файла (меньше size, если диапазон выходит за конец файла)
+    """
+    base, end = getMemberRange(oldName, member)
+    with open(oldName, "rb") as file, mapFile(file) as mapped:
+        file.seek(base)
+        header = ArchiveHeader(file)
+        header.useDictionary(dictionary)
+        return decodeRange(file, mapped, header, end, start, size)
+
+
+def getMemberRange(oldName: str, member: str = None) -> tuple:
+    """
+    :param member: имя файла в архиве-контейнере oldName (см. listContainer) или None для архива одного файла
+    :return: (позиция начала, позиция конца) архива файла в oldName
+    """
+    if member is None:
+        return 0, os.path.getsize(oldName)
+    for name, oldSize, start, length in listContainer(oldName):
+        if name == member:
+            return start, start + length
+    raise KeyError(member)
+
+
+def decodeRange(file, mapped, header: ArchiveHeader, end: int, start: int, size: int) -> bytes:
+    """
+    Декодирует байты start..start + size - 1 исходного файла (см. readRange).
+    :param file: открытый архив
+    :param mapped: результат mapFile(file)
+    :param header: заголовок архива (см. ArchiveHeader)
+    :param end: позиция конца архива в file
+    """
+    file.seek(header.dataStart)
+    oldSize = header.size
+    parts = []
+    if header.format == FORMAT_BLOCKS:
+        blockSize, offsets = header.blockSize, header.offsets
+        stop = min(start + size, oldSize)
+        first = start // blockSize
+        for i in range(first, ceil(stop / blockSize)):
+            parts.append(decodeBlock(readAt(file, mapped, offsets[i], offsets[i + 1] - offsets[i]),
+                                     min(blockSize, oldSize - i * blockSize)))
+        return b"".join(parts)[start - first * blockSize:stop - first * blockSize]
+
+    if header.format == FORMAT_STREAM:
+        first = symbolPos = 0
+        while symbolPos < start + size:
+            blockHeader = readStreamBlock(file, header.flags)
+            if blockHeader is None:
+                break
+            blockSize, blockLen, crc = blockHeader
+            if symbolPos + blockSize > start:
+                if not parts:
+                    first = symbolPos
+                data = readAt(file, mapped, file.tell(), blockLen)
+                if len(data) < blockLen:
+                    raise ValueError("Архив поврежден")
+                parts.append(decodeBlock(data, blockSize))
+            file.seek(file.tell() + blockLen)
+            symbolPos += blockSize
+        return b"".join(parts)[start - first:start + size - first]
+
+    stop = min(start + size, oldSize)
+    if header.format == FORMAT_STORED:
+        return bytes(readAt(file, mapped, header.dataStart + start, max(stop - start, 0)))
+
+    if header.format == FORMAT_CONTEXT:
+        model = header.model
+        dataPos, symbolPos, state = header.dataStart, 0, model.getRootState()
+        while symbolPos < stop and dataPos < end:
+            chunk = readAt(file, mapped, dataPos, min(CHUNK_SIZE, end - dataPos))
+            data, state = model.unpackCodes(chunk, state)
+            parts.append(data)
+            dataPos += CHUNK_SIZE
+            symbolPos += len(data)
+        return b"".join(parts)[start:stop]
+
+    if header.format == FORMAT_RLE:
+        chunks = (readAt(file, mapped, pos, min(CHUNK_SIZE, end - pos))
+                  for pos in range(header.dataStart, end, CHUNK_SIZE))
+        symbolPos = 0
+        for data, used in unpackRunChunks(header.tree, chunks, stop):
+            if symbolPos + len(data) > start:
+                parts.append(data[max(start - symbolPos, 0):])
+            symbolPos += len(data)
+        return b"".join(parts)
+
+    tree = header.tree
+    dataStart = header.dataStart
+    dataPos, symbolPos, topID = 0, 0, tree.getRootID()
+    if header.flags & FLAG_SYNC_INDEX:
+        for point in readSyncIndex(file, end):
+            if point[1] <= start:
+                dataPos, symbolPos, topID = point
+    decodeTable = tree.getDecodeTable()
+    first = symbolPos
+    # Архив читается частями по оценке длины кодов оставшихся байтов диапазона, чтобы не декодировать лишнее
+    ratio = (end - dataStart) / max(oldSize, 1)
+    while symbolPos < stop and dataStart + dataPos < end:
+        length = min(CHUNK_SIZE, ceil((stop - symbolPos) * ratio) + 4096)
+        data, topID = unpackCodes(decodeTable, readAt(file, mapped, dataStart + dataPos, length), topID)
+        parts.append(data)
+        dataPos += length
+        symbolPos += len(data)
+    return b"".join(parts)[start - first:stop - first]
+
+
+@lru_cache(maxsize=8)
+def loadHeader(oldName: str, base: int, mtime: float, dictionary: str = None) -> ArchiveHeader:
+    """
+    Считывает заголовок архива с позиции base в oldName. Заголовок (вместе с таблицей декодирования его дерева)
+    сохраняется между вызовами, поэтому процесс-обработчик строит его один раз для всех блоков архива.
+    :param mtime: время изменения oldName (заголовок считывается заново, если архив изменился)
+    :param dictionary: см. fromArchive
+    """
+    with open(oldName, "rb") as file:
+        file.seek(base)
+        header = ArchiveHeader(file)
+    header.useDictionary(dictionary)
+    return header
+
+
+def testBlock(oldName: str, base: int, end: int, block: int, dictionary: str = None):
+    """
+    Декодирует блок исходного файла номер block (по checkSize байт, см. ArchiveHeader) без записи и сверяет его
+    контрольную сумму (для выполнения в процессе-обработчике).
+    :param base: позиция начала архива в oldName
+    :param end: позиция конца архива в oldName
+    :param dictionary: см. fromArchive
+    :return: None или (block, текст ошибки)
+    """
+    header = loadHeader(oldName, base, os.path.getmtime(oldName), dictionary)
+    start = block * header.checkSize
+    size = min(header.checkSize, header.size - start)
+    try:
+        with open(oldName, "rb") as file, mapFile(file) as mapped:
+            data = decodeRange(file, mapped, header, end, start, size)
+    except Exception as error:
+        return block, f"Блок {block} (с байта {start}) поврежден: {error}"
+    if len(data) != size or zlib.crc32(data) != header.checksums[block]:
+        return block, str(ChecksumError(block, start))
+    return None
+
+
+def testArchive(oldName: str, workers=1, member: str = None, funcAfterPercent=None, cancel=None,
+                progress: Progress = None, dictionary: str = None) -> list:
+    """
+    Проверяет архив, не записывая извлеченные данные: данные декодируются и сверяются с контрольными суммами блоков.
+    Блоки архива из блоков, файла без сжатия и архива с одним деревом и индексом точек синхронизации декодируются
+    независимо друг от друга (см. testBlock), поэтому проверяются все блоки, при workers > 1 - параллельно.
+    Остальные архивы (поток блоков, модель порядка 1, символы повтора, архивы версии 1) декодируются
+    последовательно (см. StreamDecoder) до первой ошибки, затем размер извлеченных данных сверяется с заголовком
+    (у потока блоков размера в заголовке нет - обрезанный поток определяется по маркеру конца, см. readStreamBlock).
+    :param oldName: путь к архиву или к архиву-контейнеру (проверяются все файлы, если не задан member)
+    :param workers: количество процессов, проверяющих блоки параллельно
+    :param member: имя файла в архиве-контейнере (см. listContainer)
+    :param funcAfterPercent: вызывается каждый раз после обработки 1% архива
+    :param cancel: см. isRunning
+    :param progress: см. Progress (вместо funcAfterPercent и cancel)
+    :param dictionary: см. fromArchive
+    :return: [(номер блока, текст ошибки), ...] - пустой список, если архив не поврежден;
+             номер блока None, если ошибка не относится к одному блоку (заголовок, размер файла, архив без
+             контрольных сумм); для архива-контейнера текст ошибки начинается с имени файла
+    """
+    progress = getProgress(progress, funcAfterPercent, cancel)
+    if member is None and isContainer(oldName):
+        errLst = []
+        for name, oldSize, start, length in listContainer(oldName):
+            errLst += [(block, f"{name}: {message}")
+                       for block, message in testArchive(oldName, workers, name, progress=progress,
+                                                         dictionary=dictionary)]
+            if not progress.isRunning():
+                break
+        return errLst
+
+    base, end = getMemberRange(oldName, member)
+    try:
+        header = loadHeader(oldName, base, os.path.getmtime(oldName), dictionary)
+    except Exception as error:
+        return [(None, f"Не удалось прочитать заголовок архива: {error}")]
+
+    if header.checksums is not None and (
+            header.format in (FORMAT_BLOCKS, FORMAT_STORED) or
+            header.format in (FORMAT_TREE, FORMAT_CANONICAL, FORMAT_DICT) and
+            (header.flags & FLAG_SYNC_INDEX or len(header.checksums) <= 1)):
+        progress.begin(header.size)
+        tasks = [(oldName, base, end, block, dictionary) for block in range(len(header.checksums))]
+        errLst = []
+        results = mapBlocks(testBlock, tasks, workers)
+        try:
+            for block in range(len(tasks)):
+                with progress.phase("decode"):
+                    error = next(results)
+                if not progress.isRunning():
+                    break
+                if error:
+                    errLst.append(error)
+                progress.advance(min(header.checkSize, header.size - block * header.checkSize))
+        finally:
+            results.close()
+        return errLst
+
+    progress.begin(end - base)
+    with open(oldName, "rb") as file, mapFile(file) as mapped:
+        reader = StreamReader(readAt(file, mapped, pos, min(CHUNK_SIZE, end - pos))
+                              for pos in range(base, end, CHUNK_SIZE))
+        total = 0
+        try:
+            for data in StreamDecoder(reader, progress, dictionary):
+                total += len(data)
+                progress.advance(reader.tell() - progress.done)
+        except ChecksumError as error:
+            return [(error.block, str(error))]
+        except Exception as error:
+            return [(None, str(error) or "Архив поврежден")]
+    if not progress.isRunning():
+        return []
+    if header.size is not None and total != header.size:
+        return [(None, "Размер извлеченного файла не совпадает с исходным")]
+    progress.finish()
+    return []
+
+
+def fromArchiveMany(filenames: tuple[(str, str)], funcAfterFile=None, funcAfterPercent=None, workers=1,
+                    cancel=None, progress: Progress = None, dictionary: str = None, pipeline=False,
+                    readDepth=PIPELINE_DEPTH, writeDepth=PIPELINE_DEPTH, memoryLimit=MEMORY_LIMIT,
+                    blockWorkers=1) -> list:
+    """
+    Извлекает файлы из архивов.
+    :param filenames: ([oldName, newDir/newNameWithoutExt], ...)
+    :param funcAfterFile: вызывается каждый раз после извлечения из архива очередного файла
+    :param funcAfterPercent: вызывается каждый раз после обработки 1% очередного файла
+                             (при workers > 1 - после каждого 1% всех файлов)
+    :param workers: количество процессов, извлекающих файлы параллельно
+    :param cancel: см. isRunning
+    :param progress: см. runMany
+    :param dictionary: см. fromArchive
+    :param pipeline: чтение, декодирование и запись разных файлов выполняются одновременно (см. BatchPipeline);
+                     архивы-контейнеры и архивы, исходный файл которых больше memoryLimit или его размер
+                     не записан в заголовке (FORMAT_STREAM), извлекаются целиком в пуле
+    :param readDepth, writeDepth, memoryLimit: см. BatchPipeline
+    :param blockWorkers: количество процессов, декодирующих блоки одного архива из блоков (workers в fromArchive);
+                         workers задает только количество архивов, извлекаемых одновременно
+    :return: список файлов, которые не удалось извлечь из архива
+    """
+
+    global RUN
+    RUN = True
+
+    if pipeline:
+
+        def write(newName: str, result: tuple) -> None:
+            ext, data = result
+            writeWhole(newName + "." + ext, data)
+
+        engine = BatchPipeline(read=partial(readWhole, memoryLimit=memoryLimit, magic=CONTAINER_MAGIC),
+                               process=partial(extractToBytes, dictionary=dictionary), write=write,
+                               direct=partial(fromArchive, dictionary=dictionary, workers=blockWorkers),
+                               workers=workers, readDepth=readDepth, writeDepth=writeDepth, memoryLimit=memoryLimit,
+                               phase="decode", size=partial(extractedSize, blocks=blockWorkers <= 1))
+        return engine.run(filenames, funcAfterFile, getProgress(progress, funcAfterPercent, cancel))
+
+    return runMany(partial(fromArchive, workers=blockWorkers), filenames, funcAfterFile=funcAfterFile,
+                   funcAfterPercent=funcAfterPercent, workers=workers, cancel=cancel, progress=progress,
+                   dictionary=dictionary)
+
+
+def getCompress(oldSize: int, newSize: int) -> float:
+    """
+    :param oldSize: размер исходного файла
+    :param newSize: размер архива
+    :return: на сколько процентов уменьшился размер исходного файла при заархивировании
+    """
+    if oldSize == 0:
+        return -100.0
+    return round(100 - newSize / oldSize * 100, 2)
+
+
+def limitTree(tree: HuffTree, maxCodeLength: int) -> (HuffTree, HuffTree):
+    """
+    Строит дерево с длиной кодов не больше maxCodeLength и дерево без ограничения для сравнения с ним.
+    Ограниченное дерево всегда каноническое (см. HuffTree.initCodes), поэтому дерево для сравнения
+    тоже перестраивается в каноническое, чтобы потеря сжатия не включала разницу в размере дерева в архиве.
+    :return: (freeTree, limitedTree)
+    """
+    limitedTree = HuffTree(filename=None, from_="freq", freq=tree.getFreq(), canonical=tree.canonical,
+                           maxCodeLength=maxCodeLength)
+    if limitedTree.canonical and not tree.canonical:
+        tree = HuffTree(filename=None, from_="freq", freq=tree.getFreq(), canonical=True)
+    return tree, limitedTree
+
+
+def statisticOneFile(filename: str, tree: HuffTree, maxCodeLength: int = None,
+                     contextModel: ContextModel = None) -> tuple:
+    """
+    Возвращает статистику для файла, который будет добавлен в архив.
+    :param filename: путь к файлу для архивировния
+    :param tree: HuffTree для файла
+    :param maxCodeLength: если задан, статистика считается для кодов с длиной не больше maxCodeLength
+                          (см. HuffTree), и к ней добавляется потеря сжатия по сравнению с tree
+    :param contextModel: ContextModel для файла; если задан, к статистике добавляются размер архива
+                         и сжатие для модели порядка 1 (toArchive с context=True)
+    :return: (oldSize, newSize, compression) или, если задан maxCodeLength,
+             (oldSize, newSize, compression, compressionLoss), где compressionLoss - на сколько процентных пунктов
+             сжатие хуже, чем без ограничения длины кодов; если задан contextModel, в конец добавляются
+             (contextNewSize, contextCompression)
+    """
+    oldSize = os.path.getsize(filename)
+    if contextModel is not None:
+        # Архив с моделью порядка 1 или файл без сжатия, если он меньше (см. writeContext)
+        contextNewSize = headerLen(filename, oldSize=oldSize) + \
+            min(contextModel.lenInArchive() + contextModel.lenArchiveData(), oldSize)
+        return statisticOneFile(filename, tree, maxCodeLength) + \
+            (contextNewSize, getCompress(oldSize, contextNewSize))
+    if maxCodeLength:
+        freeTree, limitedTree = limitTree(tree, maxCodeLength)
+        compression = statisticOneFile(filename, freeTree)[2]
+        oldSize, newSize, limitedCompression = statisticOneFile(filename, limitedTree)
+        return oldSize, newSize, limitedCompression, round(compression - limitedCompression, 2)
+    if isIncompressible(tree, oldSize):
+        # Файл будет храниться без сжатия (см. writeArchive)
+        newSize = headerLen(filename, oldSize=oldSize) + oldSize
+        return oldSize, newSize, getCompress(oldSize, newSize)
+    newSize = headerLen(filename, tree.lenInArchive(), oldSize) + tree.lenArchiveData() + syncIndexLen(oldSize)
+    compression = getCompress(oldSize, newSize)
+    return oldSize, newSize, compression
+
+
+def estimateOneFile(filename: str, sampleCount=SAMPLE_COUNT, sampleSize=SAMPLE_SIZE,
+                    progress: Progress = None) -> tuple:
+    """
+    Быстро оценивает статистику для файла по выборке из sampleCount блоков по sampleSize байт,
+    равномерно расположенных по файлу. Файлы не больше выборки считаются точно.
+    Средняя длина кода оценивается по кодам, построенным по всей выборке, а погрешность - по разбросу
+    средней длины кода между блоками выборки (95% доверительный интервал с поправкой на размер файла).
+    :param filename: путь к файлу для архивирования
+    :param progress: см. Progress: прогресс считается по прочитанным байтам (всего файла или выборки)
+    :return: (oldSize, newSize, compression, newSizeError) - размер архива newSize ± newSizeError
+             или None, если расчет прерван
+    """
+    progress = getProgress(progress)
+    oldSize = os.path.getsize(filename)
+    if oldSize <= sampleCount * sampleSize:
+        tree = getTree(filename, progress=progress)
+        if not progress.isRunning():
+            return None
+        return statisticOneFile(filename=filename, tree=tree) + (0,)
+
+    step = (oldSize - sampleSize) // (sampleCount - 1)
+    blocks = []
+    progress.begin(sampleCount * sampleSize)
+    with open(filename, "rb") as file:
+        for i in range(sampleCount):
+            if not progress.isRunning():
+                return None
+            file.seek(i * step)
+            blocks.append(file.read(sampleSize))
+            progress.advance(len(blocks[-1]))
+    tree = HuffTree(filename=filename, from_="freq", freq=Freq(data=b"".join(blocks)))
+    lengths = [0] * 256
+    for byte, length in tree.getCodeLengths().items():
+        lengths[byte] = length
+    means = [sum(count * length for count, length in zip(countBytes(block), lengths)) / len(block)
+             for block in blocks]
+    mean = sum(means) / sampleCount
+    variance = sum((x - mean) ** 2 for x in means) / (sampleCount - 1)
+    error = 1.96 * sqrt(variance / sampleCount * (1 - sampleCount * sampleSize / oldSize))
+
+    lenArchiveData = ceil(oldSize * mean / 8)
+    if isIncompressible(tree, sampleCount * sampleSize) or lenArchiveData >= oldSize:
+        newSize = headerLen(filename, oldSize=oldSize) + oldSize
+        return oldSize, newSize, getCompress(oldSize, newSize), 0
+    newSize = headerLen(filename, tree.lenInArchive(), oldSize) + lenArchiveData + syncIndexLen(oldSize)
+    return oldSize, newSize, getCompress(oldSize, newSize), ceil(oldSize * error / 8)
+
+
+def previewEstimate(filenames: tuple[str], funcAfterFile=None, progress: Progress = None) -> list:
+    """
+    Быстрый приблизительный preview() по выборкам из файлов (см. estimateOneFile).
+    :param progress: см. Progress: прогресс и прерывание расчета (небольшие файлы считываются целиком)
+    :return: [(filename, oldSize, newSize, compression, newSizeError), ...,
+              ("ИТОГО", oldSize, newSize, compression, newSizeError)] или [], если расчет прерван
+    """
+    progress = getProgress(progress)
+    statistic = []
+    sumOldSize = 0
+    sumNewSize = 0
+    sumSquareError = 0
+    for fileName in filenames:
+        estimate = estimateOneFile(filename=fileName, progress=progress)
+        if estimate is None or not progress.isRunning():
+            return []
+        oldSize, newSize, compression, error = estimate
+        statistic.append((fileName, oldSize, newSize, compression, error))
+        sumOldSize += oldSize
+        sumNewSize += newSize
+        sumSquareError += error ** 2
+        if funcAfterFile:
+            funcAfterFile()
+    sumCompression = getCompress(oldSize=sumOldSize, newSize=sumNewSize)
+    statistic.append(("ИТОГО", sumOldSize, sumNewSize, sumCompression, ceil(sqrt(sumSquareError))))
+    return statistic
+
+
+def statisticManyFiles(filesData: list[(str, HuffTree)], maxCodeLength: int = None) -> list:
+    """
+    Возвращает статистику для файлов, которые будут добавлены в архив.
+    :param filesData: [(filename, HuffTree), ...] или [(filename, HuffTree, ContextModel), ...]
+    :param maxCodeLength: см. statisticOneFile
+    :return: [(filename, oldSize, newSize, compression), ..., ("ИТОГО", oldSize, newSize, compression)],
+             с maxCodeLength в строки добавляется compressionLoss, с ContextModel - в конец строк
+             (contextNewSize, contextCompression) (см. statisticOneFile)
+    """
+    statistic = []
+    sumOldSize = 0
+    sumNewSize = 0
+    sumFreeNewSize = 0
+    sumContextNewSize = 0
+    for filePath, tree, *model in filesData:
+        row = statisticOneFile(filename=filePath, tree=tree, maxCodeLength=maxCodeLength,
+                               contextModel=model[0] if model else None)
+        statistic.append((filePath,) + row)
+        sumOldSize += row[0]
+        sumNewSize += row[1]
+        if maxCodeLength:
+            sumFreeNewSize += statisticOneFile(filename=filePath, tree=limitTree(tree, maxCodeLength)[0])[1]
+        if model:
+            sumContextNewSize += row[-2]
     sumCompression = getCompress(oldSize=sumOldSize, newSize=sumNewSize)
-    statistic.append(("ИТОГО", sumOldSize, sumNewSize, sumCompression))
+    total = ("ИТОГО", sumOldSize, sumNewSize, sumCompression)
+    if maxCodeLength:
+        total += (round(getCompress(oldSize=sumOldSize, newSize=sumFreeNewSize) - sumCompression, 2),)
+    if filesData and len(filesData[0]) > 2:
+        total += (sumContextNewSize, getCompress(oldSize=sumOldSize, newSize=sumContextNewSize))
+    statistic.append(total)
     return statistic
 
 
-def preview(filenames: tuple[str], funcAfterPercent=None, funcAfterFile=None) -> list:
+def preview(filenames: tuple[str], funcAfterPercent=None, funcAfterFile=None, progress: Progress = None,
+            context=False, maxCodeLength: int = None) -> list:
     """
     Ресурсозатратный statisticManyFiles()
-    :return: [(filename, oldSize, newSize, compression), ..., ("ИТОГО", oldSize, newSize, compression)]
+    Частоты байтов сохраняются в CACHE, поэтому последующее архивирование и повторный предпросмотр
+    тех же файлов не считают их заново.
+    :param context: рассчитать также сжатие моделью порядка 1 (файлы читаются еще раз для подсчета пар байтов)
+    :param maxCodeLength: рассчитать сжатие для кодов с длиной не больше maxCodeLength (toArchive с тем же
+                          maxCodeLength) и его потерю по сравнению с кодами без ограничения (см. statisticOneFile)
+    :return: [(filename, oldSize, newSize, compression), ..., ("ИТОГО", oldSize, newSize, compression)],
+             с context и maxCodeLength - см. statisticManyFiles
     """
 
+    progress = getProgress(progress, funcAfterPercent)
     filesData = []
     for fileName in filenames:
-        tree = HuffTree(filename=fileName, from_="file", funcAfterPercent=funcAfterPercent)
-        filesData.append((fileName, tree))
-        if not RUN:
+        tree = getTree(fileName, progress=progress)
+        if context and progress.isRunning():
+            filesData.append((fileName, tree, ContextModel(from_="file", filename=fileName, progress=progress)))
+        else:
+            filesData.append((fileName, tree))
+        if not progress.isRunning():
             return []
         if funcAfterFile:
             funcAfterFile()
-    statistic = statisticManyFiles(filesData=filesData)
+    statistic = statisticManyFiles(filesData=filesData, maxCodeLength=maxCodeLength)
     return statistic
@@ -1,7 +1,12 @@
-import gui
+import sys
 
 
 def main():
+    # С аргументами запускается консольная версия, gui (и tkinter) при этом не импортируется
+    if len(sys.argv) > 1:
+        import cli
+        sys.exit(cli.main())
+    import gui
     gui.windowMain()
 
 
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+import huffman_coding as hf
+
+
+@pytest.fixture
+def files(tmp_path):
+    """
+    Два файла для пакетной обработки и отсутствующий файл между ними.
+    """
+    names = []
+    for i, name in enumerate(("a.txt", "missing.txt", "b.txt")):
+        path = tmp_path / name
+        if name != "missing.txt":
+            path.write_bytes(b"abracadabra " * (100 + i))
+        names.append((str(path), str(tmp_path / "out" / name)))
+    os.mkdir(tmp_path / "out")
+    return names
+
+
+@pytest.mark.parametrize("options", [dict(workers=1), dict(workers=2), dict(pipeline=True)])
+def test_missing_file(files, options):
+    calls = []
+    errLst = hf.toArchiveMany(files, funcAfterFile=lambda: calls.append(None), **options)
+    assert errLst == [files[1][0]]
+    assert len(calls) == len(files)
+    for oldName, newName in (files[0], files[2]):
+        assert os.path.isfile(newName + "." + hf.EXTENSION)
+
+    archives = [(newName + "." + hf.EXTENSION, newName) for oldName, newName in files]
+    errLst = hf.fromArchiveMany(archives, **options)
+    assert errLst == [archives[1][0]]
+    for oldName, newName in (files[0], files[2]):
+        with open(oldName, "rb") as old, open(newName + ".txt", "rb") as new:
+            assert old.read() == new.read()
+
+
+def test_pipeline_memory_limit(tmp_path):
+    oldName = tmp_path / "zeros.bin"
+    oldName.write_bytes(bytes(2 ** 20))
+    hf.toArchiveMany([(str(oldName), str(tmp_path / "zeros"))], rle=True)
+    archive = str(tmp_path / "zeros") + "." + hf.EXTENSION
+    assert hf.extractedSize(archive) == 2 ** 20
+
+    # Архив меньше memoryLimit, а исходный файл - больше: извлекается целиком в пуле
+    assert hf.fromArchiveMany([(archive, str(tmp_path / "out"))], pipeline=True, memoryLimit=2 ** 16) == []
+    assert (tmp_path / "out.bin").read_bytes() == oldName.read_bytes()
+
+
+@pytest.mark.parametrize("options", [dict(workers=1), dict(workers=2), dict(pipeline=True)])
+def test_block_workers(tmp_path, options):
+    oldName = tmp_path / "big.log"
+    oldName.write_bytes(bytes(range(256)) * 2000 + b"abracadabra " * 20000)
+    newName = str(tmp_path / "big")
+    assert hf.toArchiveMany([(str(oldName), newName)], blockSize=2 ** 16, blockWorkers=2, **options) == []
+    archive = newName + "." + hf.EXTENSION
+    assert hf.extractedSize(archive, blocks=False) is None
+    assert hf.fromArchiveMany([(archive, str(tmp_path / "out"))], blockWorkers=2, **options) == []
+    assert (tmp_path / "out.log").read_bytes() == oldName.read_bytes()
@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+import cli
+
+
+def test_error_exit_code(tmp_path, capsys):
+    oldName = tmp_path / "a.txt"
+    oldName.write_bytes(b"abracadabra")
+    assert cli.main(["list", str(oldName)]) == 1
+    assert cli.main(["compress", str(oldName), "--dict", str(tmp_path / "missing.huff_dict")]) == 1
+    lines = capsys.readouterr().err.splitlines()
+    assert len(lines) == 2 and all(line.startswith("Ошибка: ") for line in lines)
+
+
+@pytest.mark.parametrize("argv", [["compress", "a.txt", "--context", "--rle"],
+                                  ["preview", "a.txt", "--estimate", "--context"]])
+def test_exclusive_options(argv):
+    with pytest.raises(SystemExit) as error:
+        cli.makeParser().parse_args(argv)
+    assert error.value.code == 2
+
+
+def test_extract_reports_written_file(tmp_path, capsys):
+    oldName = tmp_path / "big.log"
+    oldName.write_bytes(b"abracadabra " * 100)
+    assert cli.main(["compress", str(oldName), "-o", str(tmp_path / "arc"), "--json"]) == 0
+    capsys.readouterr()
+    assert cli.main(["extract", str(tmp_path / "arc" / "big.huff_archive"), "-o", str(tmp_path / "out"),
+                     "--json"]) == 0
+    result = json.loads(capsys.readouterr().out)
+    assert result["files"][0]["file"] == str(tmp_path / "out" / "big.log")
+    assert (tmp_path / "out" / "big.log").read_bytes() == oldName.read_bytes()
+
+
+def test_preview_max_code_length(tmp_path, capsys):
+    oldName = tmp_path / "skewed.bin"
+    oldName.write_bytes(bytes(byte for byte in range(16) for _ in range(2 ** byte)))
+    assert cli.main(["preview", str(oldName), "--max-code-length", "6", "--json"]) == 0
+    total = json.loads(capsys.readouterr().out)["total"]
+    assert cli.main(["compress", str(oldName), "-o", str(tmp_path / "arc"), "--max-code-length", "6", "-q"]) == 0
+    assert total["newSize"] == (tmp_path / "arc" / "skewed.huff_archive").stat().st_size
+    assert total["compressionLoss"] > 0
+    assert cli.main(["preview", str(oldName), "--max-code-length", "6", "--estimate"]) == 1
@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+import huffman_coding as hf
+
+FILES = {"007": b"abracadabra " * 500, "a.txt": bytes(range(256)) * 40}
+
+
+@pytest.fixture
+def container(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    for name, data in FILES.items():
+        (src / name).write_bytes(data)
+    assert hf.toContainer([str(src / name) for name in FILES], str(tmp_path / "pack")) == []
+    return str(tmp_path / "pack") + "." + hf.CONTAINER_EXTENSION
+
+
+def test_round_trip(container, tmp_path):
+    assert [(name, oldSize) for name, oldSize, start, length in hf.listContainer(container)] == \
+        [(name, len(data)) for name, data in FILES.items()]
+    assert hf.fromContainer(container, str(tmp_path / "out")) == []
+    for name, data in FILES.items():
+        assert (tmp_path / "out" / name).read_bytes() == data
+    assert hf.testArchive(container) == []
+    assert hf.readRange(container, 100, 50, member="a.txt") == FILES["a.txt"][100:150]
+
+
+def test_missing_names_are_errors(container, tmp_path):
+    assert hf.fromContainer(container, str(tmp_path / "out"), names=("007", "7")) == ["7"]
+    assert os.listdir(tmp_path / "out") == ["007"]
@@ -0,0 +1,115 @@
+import io
+import os
+
+import pytest
+
+import huffman_coding as hf
+
+DATA = b"abracadabra " * 30000 + bytes(range(256)) * 100
+RANDOM = bytes((i * 7919 + (i >> 8) * 104729) % 251 for i in range(50000))
+
+# Архив версии 1, записанный исходной версией программы для b"abracadabra, abracadabra!\n" (файл sample.txt)
+V1_DATA = b"abracadabra, abracadabra!\n"
+V1_ARCHIVE = bytes.fromhex("0374787400110061000000620001007200020063000300640004002c00050020000600210007000a0008"
+                           "00070008000500060009000a00030004000b000c00010002000d000e000f000002060aa729d38874e53a7004")
+
+FORMATS = [(DATA, dict(), hf.FORMAT_TREE), (DATA, dict(canonical=True), hf.FORMAT_CANONICAL),
+           (DATA, dict(maxCodeLength=10), hf.FORMAT_CANONICAL), (DATA, dict(blockSize=2 ** 15), hf.FORMAT_BLOCKS),
+           (RANDOM, dict(), hf.FORMAT_STORED), (DATA, dict(context=True), hf.FORMAT_CONTEXT),
+           (DATA, dict(rle=True), hf.FORMAT_RLE), (DATA, "dictionary", hf.FORMAT_DICT)]
+
+
+def makeArchive(tmp_path, data: bytes, options) -> tuple:
+    """
+    :return: (путь к архиву, параметры извлечения)
+    """
+    oldName = tmp_path / "src.txt"
+    oldName.write_bytes(data)
+    extract = {}
+    if options == "dictionary":
+        dictionary = str(tmp_path / "d")
+        hf.trainDictionary([str(oldName)], dictionary)
+        options = extract = dict(dictionary=dictionary + "." + hf.DICT_EXTENSION)
+    hf.toArchive(str(oldName), str(tmp_path / "src"), **options)
+    return str(tmp_path / "src") + "." + hf.EXTENSION, extract
+
+
+@pytest.mark.parametrize("data, options, fmt", FORMATS)
+def test_round_trip(tmp_path, data, options, fmt):
+    archive, extract = makeArchive(tmp_path, data, options)
+    with open(archive, "rb") as file:
+        header = hf.ArchiveHeader(file)
+    assert (header.version, header.format, header.size, header.ext) == (hf.HEADER_VERSION, fmt, len(data), "txt")
+    assert header.flags & hf.FLAG_CHECKSUMS and header.checksums
+    if options == dict(maxCodeLength=10):
+        assert max(len(code) for code in header.tree.getCodes().values()) <= 10
+
+    hf.fromArchive(archive, str(tmp_path / "out"), **extract)
+    assert (tmp_path / "out.txt").read_bytes() == data
+    assert hf.testArchive(archive, **extract) == []
+    for start, size in ((0, 10), (12345, 1000), (len(data) - 5, 100)):
+        assert hf.readRange(archive, start, size, **extract) == data[start:start + size]
+
+
+@pytest.mark.parametrize("data, options, fmt", FORMATS)
+def test_corrupted_data(tmp_path, data, options, fmt):
+    archive, extract = makeArchive(tmp_path, data, options)
+    with open(archive, "rb") as file:
+        archiveData = bytearray(file.read())
+    header = hf.ArchiveHeader(io.BytesIO(archiveData))
+    archiveData[(header.dataStart + len(archiveData)) // 2] ^= 0x55
+    with open(archive, "wb") as file:
+        file.write(archiveData)
+
+    assert hf.testArchive(archive, **extract)
+    with pytest.raises(ValueError):
+        hf.fromArchive(archive, str(tmp_path / "out"), **extract)
+
+
+def test_v1_archive(tmp_path):
+    archive = tmp_path / ("sample." + hf.EXTENSION)
+    archive.write_bytes(V1_ARCHIVE)
+    with open(archive, "rb") as file:
+        header = hf.ArchiveHeader(file)
+    assert (header.version, header.format, header.size, header.ext) == (1, hf.FORMAT_TREE, len(V1_DATA), "txt")
+
+    hf.fromArchive(str(archive), str(tmp_path / "out"))
+    assert (tmp_path / "out.txt").read_bytes() == V1_DATA
+    assert hf.testArchive(str(archive)) == []
+    assert hf.readRange(str(archive), 5, 10) == V1_DATA[5:15]
+
+    archive.write_bytes(V1_ARCHIVE[:-1])
+    assert hf.testArchive(str(archive))
+
+
+def test_newer_version_is_rejected():
+    header = hf.HEADER.pack(hf.HEADER_MAGIC, hf.HEADER_VERSION + 1, 0, hf.FORMAT_STORED, hf.HEADER.size + 1, 0)
+    with pytest.raises(ValueError, match="версия"):
+        hf.ArchiveHeader(io.BytesIO(header + b"\x00"))
+
+
+@pytest.mark.parametrize("options", [dict(workers=1), dict(workers=2), dict(pipeline=True)])
+def test_cancel(tmp_path, options):
+    """
+    Прерывание после первого файла: оставшиеся файлы не архивируются (процессы могут успеть начать
+    все файлы), а незаконченные архивы не проходят проверку (а не извлекаются в неверные данные).
+    """
+    filenames = []
+    for i in range(6):
+        (tmp_path / f"f{i}.txt").write_bytes(DATA)
+        filenames.append((str(tmp_path / f"f{i}.txt"), str(tmp_path / f"f{i}")))
+    progress = hf.Progress()
+    assert hf.toArchiveMany(filenames, funcAfterFile=progress.stop, progress=progress, **options) == []
+
+    archives = [newName + "." + hf.EXTENSION for oldName, newName in filenames
+                if os.path.exists(newName + "." + hf.EXTENSION)]
+    assert archives
+    if options.get("workers", 1) == 1:
+        assert len(archives) < len(filenames)
+    assert hf.testArchive(archives[0]) == []
+    for archive in archives[1:]:
+        errors = hf.testArchive(archive)
+        if not errors:
+            hf.fromArchive(archive, archive + ".out")
+            with open(archive + ".out.txt", "rb") as file:
+                assert file.read() == DATA
@@ -0,0 +1,43 @@
+import io
+import os
+
+import pytest
+
+import huffman_coding as hf
+
+DATA = b"abracadabra " * 30000 + bytes(range(256)) * 100
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "src.txt"
+    path.write_bytes(DATA)
+    return str(path)
+
+
+def makeStream(source: str, newName: str) -> str:
+    with open(source, "rb") as src, open(newName + "." + hf.EXTENSION, "wb") as dst:
+        hf.compressStream(src, dst, ext="txt", blockSize=2 ** 15)
+    return newName + "." + hf.EXTENSION
+
+
+OPTIONS = [dict(), dict(canonical=True), dict(blockSize=2 ** 15), dict(context=True), dict(rle=True), "stream"]
+
+
+@pytest.mark.parametrize("options", OPTIONS)
+def test_truncated_archive_fails(source, tmp_path, options):
+    newName = str(tmp_path / "src")
+    if options == "stream":
+        archive = makeStream(source, newName)
+    else:
+        hf.toArchive(source, newName, **options)
+        archive = newName + "." + hf.EXTENSION
+    assert hf.testArchive(archive) == []
+
+    with open(archive, "rb") as file:
+        data = file.read()
+    header = hf.ArchiveHeader(io.BytesIO(data))
+    for end in (len(data) - 1, (header.dataStart + len(data)) // 2):
+        with open(archive, "wb") as file:
+            file.write(data[:end])
+        assert hf.testArchive(archive), end
@@ -0,0 +1,49 @@
+import io
+import threading
+
+import pytest
+
+import huffman_coding as hf
+
+DATA = bytes(range(256)) * 64 + b"abracadabra " * 4000
+
+
+def compress(data: bytes, **kwargs) -> bytes:
+    dst = io.BytesIO()
+    hf.compressStream(io.BytesIO(data), dst, ext="txt", blockSize=2 ** 14, **kwargs)
+    return dst.getvalue()
+
+
+def decompress(archive: bytes) -> bytes:
+    dst = io.BytesIO()
+    hf.decompressStream(io.BytesIO(archive), dst)
+    return dst.getvalue()
+
+
+def test_round_trip():
+    assert decompress(compress(DATA)) == DATA
+    assert decompress(compress(b"")) == b""
+
+
+def test_chunk_iterator_source():
+    dst = io.BytesIO()
+    hf.compressStream((DATA[i:i + 1000] for i in range(0, len(DATA), 1000)), dst, blockSize=2 ** 14)
+    assert decompress(dst.getvalue()) == DATA
+
+
+def test_cancelled_archive_is_damaged():
+    cancel = threading.Event()
+    cancel.set()
+    archive = compress(DATA, cancel=cancel)
+    with pytest.raises(ValueError, match="Архив поврежден"):
+        decompress(archive)
+
+
+def test_truncated_archive_is_damaged():
+    archive = compress(DATA)
+    header = hf.ArchiveHeader(io.BytesIO(archive))
+    blockLen = int.from_bytes(archive[header.dataStart + 4:header.dataStart + 8], "big")
+    # Обрезка на границе блоков, в середине блока и без маркера конца архива
+    for end in (header.dataStart + 12 + blockLen, header.dataStart + 20, len(archive) - 4, len(archive) - 1):
+        with pytest.raises(ValueError, match="Архив поврежден"):
+            decompress(archive[:end])